@@ -0,0 +1,70 @@
+"""
+Compare recall@top_k and search latency of the index types used for user storages.
+
+    python -m benchmarks.ann_index --sizes 10000 50000 --queries 200
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from config import embed_dim, top_k
+from data.index_selection import build_index
+
+
+def make_corpus(n: int, d: int, n_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, d)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, d)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(true_row)) for row, true_row in zip(found, truth))
+    return hits / truth.size
+
+
+def run(sizes: list[int], n_queries: int, k: int, d: int) -> list[dict]:
+    results = []
+    for n in sizes:
+        vectors = make_corpus(n + n_queries, d)
+        corpus, queries = vectors[:n], vectors[n:]
+        truth = None
+        for kind in ("flat", "hnsw", "ivf"):
+            start = time.perf_counter()
+            index = build_index(kind, corpus)
+            build_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for query in queries:  # One query per call, like a user request
+                index.search(query[None, :], k)
+            latency_ms = (time.perf_counter() - start) / n_queries * 1000
+
+            _, found = index.search(queries, k)
+            if truth is None:
+                truth = found
+            results.append({
+                'n': n,
+                'index': kind,
+                'build_s': round(build_s, 3),
+                'latency_ms': round(latency_ms, 3),
+                f'recall@{k}': round(recall_at_k(found, truth), 4),
+            })
+            print(json.dumps(results[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5_000, 20_000, 50_000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=top_k)
+    parser.add_argument('--dim', type=int, default=embed_dim)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.k, args.dim)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Compare compact vector codes with exact rescoring against the exact IndexFlatL2:
+recall@top_k, search latency, bytes on disk of the index and the rescoring vectors,
+and resident memory of a fresh process that loads them the way the bot does and serves the queries
+(heap pages as rss_anon_mb, pages of mapped files as rss_file_mb).
+
+    python -m benchmarks.compact_index --sizes 20000 50000 --dims 896 256
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+
+from benchmarks.ann_index import make_corpus, recall_at_k
+from config import embed_dim, top_k, compact_pq_m, compact_rescore_factor
+from data.index_selection import build_compact_index
+from data.rescore_vectors import VECTORS_FILE, RescoreVectors
+
+
+def rss_mb() -> dict[str, float]:
+    """Resident anonymous and file-backed memory of this process (Linux)."""
+    rss = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(('RssAnon:', 'RssFile:')):
+                name, kb = line.split()[:2]
+                rss[name[:-1]] = int(kb) / 1024
+    return rss
+
+
+def serve(index_path: str, vectors_path: Optional[str], queries: np.ndarray, k: int, rescore_factor: int) -> dict:
+    """Load an index (and mapped rescoring vectors) in a fresh process, search and report latency and RSS growth."""
+    before = rss_mb()
+    index = faiss.read_index(index_path)
+    rescore_vectors = RescoreVectors.load(vectors_path) if vectors_path else None
+
+    def search(query_batch: np.ndarray) -> np.ndarray:
+        if rescore_vectors is None:
+            return index.search(query_batch, k)[1]
+        _, candidates = index.search(query_batch, k * rescore_factor)
+        return rescore_vectors.rescore(query_batch, candidates, k)[1]
+
+    start = time.perf_counter()
+    for query in queries:  # One query per call, like a user request
+        search(query[None, :])
+    latency_ms = (time.perf_counter() - start) / len(queries) * 1000
+    found = search(queries)
+    after = rss_mb()
+    return {
+        'latency_ms': round(latency_ms, 3),
+        'rss_anon_mb': round(after['RssAnon'] - before['RssAnon'], 1),
+        'rss_file_mb': round(after['RssFile'] - before['RssFile'], 1),
+        'found': found,
+    }
+
+
+def run(sizes: list[int], n_queries: int, k: int, d: int, dims: list[int], quantizers: list[str], rescore_factor: int) -> list[dict]:
+    results = []
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), max_tasks_per_child=1)
+    with pool, tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            vectors = make_corpus(n + n_queries, d)
+            corpus, queries = vectors[:n], vectors[n:]
+
+            flat_path = os.path.join(tmp_dir, f'flat-{n}.faiss')
+            flat = faiss.IndexFlatL2(d)
+            flat.add(corpus)
+            faiss.write_index(flat, flat_path)
+            del flat
+            served = pool.submit(serve, flat_path, None, queries, k, rescore_factor).result()
+            truth = served.pop('found')
+            results.append({'n': n, 'index': 'flat', 'dim': d, 'index_bytes': os.path.getsize(flat_path),
+                            'vectors_bytes': 0, **served, f'recall@{k}': 1.0})
+            print(json.dumps(results[-1]))
+
+            for quantizer in quantizers:
+                for dim in dims:
+                    if quantizer == 'pq' and min(dim, d) % compact_pq_m:
+                        continue
+                    start = time.perf_counter()
+                    index = build_compact_index(corpus, quantizer, dim, compact_pq_m)
+                    index.add(corpus)
+                    build_s = time.perf_counter() - start
+
+                    index_path = os.path.join(tmp_dir, f'{quantizer}-{dim}-{n}.faiss')
+                    vectors_path = os.path.join(tmp_dir, f'{quantizer}-{dim}-{n}-{VECTORS_FILE}')
+                    faiss.write_index(index, index_path)
+                    RescoreVectors(corpus).save(vectors_path)
+                    del index
+
+                    for stage, stage_vectors in (('coarse', None), ('rescored', vectors_path)):
+                        served = pool.submit(serve, index_path, stage_vectors, queries, k, rescore_factor).result()
+                        found = served.pop('found')
+                        results.append({
+                            'n': n,
+                            'index': f'{quantizer}-{stage}',
+                            'dim': min(dim, d),
+                            'index_bytes': os.path.getsize(index_path),
+                            'vectors_bytes': os.path.getsize(stage_vectors) if stage_vectors else 0,
+                            'build_s': round(build_s, 3),
+                            **served,
+                            f'recall@{k}': round(recall_at_k(found, truth), 4),
+                        })
+                        print(json.dumps(results[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20_000, 50_000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=top_k)
+    parser.add_argument('--dim', type=int, default=embed_dim)
+    parser.add_argument('--dims', type=int, nargs='+', default=[embed_dim, 256], help="Prefix dimensions of the codes")
+    parser.add_argument('--quantizers', nargs='+', default=['sq8', 'fp16', 'pq'])
+    parser.add_argument('--rescore-factor', type=int, default=compact_rescore_factor)
+    args = parser.parse_args()
+    run(args.sizes, args.queries, args.k, args.dim, args.dims, args.quantizers, args.rescore_factor)
+
+
+if __name__ == '__main__':
+    main()
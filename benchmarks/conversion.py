@@ -0,0 +1,66 @@
+"""
+Compare sequential conversion of documents to Markdown with parallel page/sheet range conversion.
+Checks that both paths produce the same text.
+
+    python -m benchmarks.conversion example/*.pdf --workers 4
+"""
+import os
+import json
+import time
+import glob
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config import ingest_workers
+from data.utils import clean_md
+from utils.file_processor import convert_file
+from utils.parallel_conversion import plan_parts, convert_part, join_parts
+
+
+def convert_parallel(pool: ProcessPoolExecutor, file_path: str, n_parts: int, min_units: int) -> tuple[str, int]:
+    parts = plan_parts(file_path, n_parts, min_units)
+    texts = list(pool.map(convert_part, [file_path] * len(parts), parts))
+    return clean_md(join_parts(file_path, texts)), len(parts)
+
+
+def run(files: list[str], workers: int, min_units: int, repeats: int) -> list[dict]:
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        list(pool.map(plan_parts, files[:1] * workers, [1] * workers))  # Start the workers before timing
+        for file_path in files:
+            start = time.perf_counter()
+            for _ in range(repeats):
+                sequential = convert_file(file_path)
+            sequential_s = (time.perf_counter() - start) / repeats
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                parallel, n_parts = convert_parallel(pool, file_path, workers, min_units)
+            parallel_s = (time.perf_counter() - start) / repeats
+
+            results.append({
+                'file': os.path.basename(file_path),
+                'parts': n_parts,
+                'sequential_s': round(sequential_s, 3),
+                'parallel_s': round(parallel_s, 3),
+                'speedup': round(sequential_s / parallel_s, 2),
+                'identical': sequential == parallel,
+            })
+            print(json.dumps(results[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', default=sorted(glob.glob('example/*.pdf')))
+    parser.add_argument('--workers', type=int, default=ingest_workers)
+    parser.add_argument('--min-units', type=int, default=2, help="Pages or sheets from which files are split, "
+                        "lower than the config thresholds so that small sample files are split too")
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    run(args.files, args.workers, args.min_units, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
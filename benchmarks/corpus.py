@@ -0,0 +1,169 @@
+"""
+Synthetic multilingual documents for benchmarks: Markdown, plain text or HTML
+with headings, paragraphs, lists and tables in English, German and Russian.
+The same seed gives the same corpus.
+
+    python -m benchmarks.corpus /tmp/corpus --docs 10 --size-kb 200 --formats md html
+"""
+import os
+import argparse
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+WORDS = {
+    'en': (
+        "the contract invoice customer service report payment period delivery order account policy "
+        "employee office meeting schedule budget project quarter revenue risk insurance claim request "
+        "approval document version review update process system data record access support ticket "
+        "is are was will must should can may includes requires describes covers applies remains "
+        "new annual monthly open late signed current previous internal external total additional "
+        "for within after before during under with without by of to in on at from"
+    ).split(),
+    'de': (
+        "der die das Vertrag Rechnung Kunde Dienst Bericht Zahlung Frist Lieferung Auftrag Konto Richtlinie "
+        "Mitarbeiter Büro Termin Plan Budget Projekt Quartal Umsatz Risiko Versicherung Antrag Genehmigung "
+        "Dokument Fassung Prüfung Ablauf System Daten Zugang Urlaub Gehalt Kündigung Abteilung "
+        "ist sind war wird muss soll kann darf enthält verlangt beschreibt gilt bleibt "
+        "neue jährliche monatliche offene späte unterschriebene aktuelle frühere interne gesamte "
+        "für innerhalb nach vor während unter mit ohne durch von zu im am aus"
+    ).split(),
+    'ru': (
+        "договор счёт клиент служба отчёт оплата срок поставка заказ аккаунт правило сотрудник офис "
+        "встреча график бюджет проект квартал выручка риск страховка заявка согласование документ "
+        "версия проверка процесс система данные доступ отпуск зарплата отдел виза "
+        "является были будет должен может включает требует описывает действует остаётся "
+        "новый годовой ежемесячный открытый поздний подписанный текущий прежний внутренний общий "
+        "для в течение после до во время под с без через из к на от"
+    ).split(),
+}
+
+Block = Tuple[str, object]  # ('h1' | 'h2' | 'p', text), ('ul', items), ('table', rows)
+
+
+def sentence(rng: np.random.Generator, lang: str) -> str:
+    words = rng.choice(WORDS[lang], int(rng.integers(6, 18)))
+    text = " ".join(words)
+    return text[0].upper() + text[1:] + "."
+
+
+def make_blocks(size_bytes: int, langs: Sequence[str] = ('en', 'de', 'ru'), seed: int = 0) -> List[Block]:
+    """Blocks of a document of roughly `size_bytes` of UTF-8 text, each section in a random language."""
+    rng = np.random.default_rng(seed)
+    blocks = [('h1', f"Document {seed}: {sentence(rng, langs[0])[:-1]}")]
+    size = 0
+    while size < size_bytes:
+        lang = langs[int(rng.integers(len(langs)))]
+        title = sentence(rng, lang)[:-1]
+        blocks.append(('h2', title))
+        size += len(title.encode('utf-8'))
+        for _ in range(int(rng.integers(2, 6))):
+            kind = rng.choice(['p', 'p', 'p', 'ul', 'table'])
+            if kind == 'p':
+                block = ('p', " ".join(sentence(rng, lang) for _ in range(int(rng.integers(3, 9)))))
+                size += len(block[1].encode('utf-8'))
+            elif kind == 'ul':
+                block = ('ul', [sentence(rng, lang) for _ in range(int(rng.integers(3, 7)))])
+                size += sum(len(item.encode('utf-8')) for item in block[1])
+            else:
+                n_cols = int(rng.integers(2, 5))
+                rows = [[str(rng.choice(WORDS[lang])).capitalize() for _ in range(n_cols)]]
+                rows += [[f"{rng.uniform(0, 10_000):.2f}" for _ in range(n_cols)] for _ in range(int(rng.integers(2, 8)))]
+                block = ('table', rows)
+                size += sum(len(cell) + 3 for row in rows for cell in row)
+            blocks.append(block)
+    return blocks
+
+
+def render_markdown(blocks: List[Block]) -> str:
+    parts = []
+    for kind, content in blocks:
+        if kind == 'h1':
+            parts.append(f"# {content}")
+        elif kind == 'h2':
+            parts.append(f"## {content}")
+        elif kind == 'p':
+            parts.append(content)
+        elif kind == 'ul':
+            parts.append("\n".join(f"- {item}" for item in content))
+        else:
+            header, *rows = content
+            lines = [f"| {' | '.join(header)} |", f"|{'---|' * len(header)}"]
+            lines += [f"| {' | '.join(row)} |" for row in rows]
+            parts.append("\n".join(lines))
+    return "\n\n".join(parts) + "\n"
+
+
+def render_text(blocks: List[Block]) -> str:
+    parts = []
+    for kind, content in blocks:
+        if kind in ('h1', 'h2', 'p'):
+            parts.append(content)
+        elif kind == 'ul':
+            parts.append("\n".join(content))
+        else:
+            parts.append("\n".join("\t".join(row) for row in content))
+    return "\n\n".join(parts) + "\n"
+
+
+def render_html(blocks: List[Block]) -> str:
+    from html import escape
+
+    parts = ["<html><head><meta charset=\"utf-8\"></head><body>"]
+    for kind, content in blocks:
+        if kind in ('h1', 'h2'):
+            parts.append(f"<{kind}>{escape(content)}</{kind}>")
+        elif kind == 'p':
+            parts.append(f"<p>{escape(content)}</p>")
+        elif kind == 'ul':
+            parts.append("<ul>" + "".join(f"<li>{escape(item)}</li>" for item in content) + "</ul>")
+        else:
+            header, *rows = content
+            parts.append(
+                "<table><tr>" + "".join(f"<th>{escape(cell)}</th>" for cell in header) + "</tr>"
+                + "".join("<tr>" + "".join(f"<td>{escape(cell)}</td>" for cell in row) + "</tr>" for row in rows)
+                + "</table>"
+            )
+    parts.append("</body></html>")
+    return "\n".join(parts) + "\n"
+
+
+RENDERERS = {'md': render_markdown, 'txt': render_text, 'html': render_html}
+
+
+def write_corpus(out_dir: str, n_docs: int, size_kb: int, formats: Sequence[str] = ('md',), langs: Sequence[str] = ('en', 'de', 'ru'), seed: int = 0) -> List[str]:
+    """Write `n_docs` documents in each format and return their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i in range(n_docs):
+        blocks = make_blocks(size_kb * 1024, langs, seed + i)
+        for fmt in formats:
+            path = os.path.join(out_dir, f"doc-{seed + i:04d}.{fmt}")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(RENDERERS[fmt](blocks))
+            paths.append(path)
+    return paths
+
+
+def make_queries(n: int, langs: Sequence[str] = ('en', 'de', 'ru'), seed: int = 0) -> List[str]:
+    """Questions built from the same vocabulary as the corpus."""
+    rng = np.random.default_rng(seed + 1_000_000)
+    return [sentence(rng, langs[i % len(langs)])[:-1] + "?" for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('out_dir')
+    parser.add_argument('--docs', type=int, default=10)
+    parser.add_argument('--size-kb', type=int, default=200)
+    parser.add_argument('--formats', nargs='+', default=['md'], choices=sorted(RENDERERS))
+    parser.add_argument('--langs', nargs='+', default=['en', 'de', 'ru'], choices=sorted(WORDS))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for path in write_corpus(args.out_dir, args.docs, args.size_kb, args.formats, args.langs, args.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Compare CPU inference backends of the embedding model and the reranker with the stock float32 model:
+throughput in chunks/sec for several thread counts and agreement with the reference outputs.
+
+    python -m benchmarks.cpu_inference example/*.pdf --backends onnx int8 --threads 1 2 4
+"""
+import argparse
+import glob
+import json
+import time
+
+import numpy as np
+import torch
+from langchain_huggingface import HuggingFaceEmbeddings
+from FlagEmbedding import FlagReranker
+
+from config import inference_check_tolerance, retrieval_model_name, rerank_model_name, rerank_top_k
+from data.inference_backend import load_embeddings, load_reranker, compare_embeddings
+from utils.file_processor import convert_file, split_markdown
+
+
+def load_chunks(files: list[str], limit: int) -> list[str]:
+    texts = []
+    for file_path in files:
+        texts += [doc.page_content for doc in split_markdown(convert_file(file_path), file_path)]
+    return texts[:limit]
+
+
+def throughput(func, texts: list[str], repeats: int) -> float:
+    func(texts[:4])  # Warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func(texts)
+    return len(texts) * repeats / (time.perf_counter() - start)
+
+
+def compare_scores(scores: list[float], reference: list[float], k: int) -> dict:
+    top = set(np.argsort(scores)[::-1][:k])
+    reference_top = set(np.argsort(reference)[::-1][:k])
+    return {
+        'max_score_diff': round(float(np.max(np.abs(np.asarray(scores) - np.asarray(reference)))), 4),
+        f'top{k}_overlap': round(len(top & reference_top) / min(k, len(scores)), 4),
+    }
+
+
+def run(texts: list[str], query: str, backends: list[str], threads: list[int], repeats: int, rerank: bool) -> list[dict]:
+    results = []
+    torch.set_num_threads(max(threads))
+    reference = HuggingFaceEmbeddings(model_name=retrieval_model_name, model_kwargs={'device': 'cpu'})
+    pairs = [[query, text] for text in texts]
+    if rerank:
+        reference_reranker = FlagReranker(rerank_model_name, use_fp16=False, devices='cpu')
+        reference_scores = reference_reranker.compute_score(pairs)
+        reference_rate = throughput(reference_reranker.compute_score, pairs, repeats)
+        results.append({'model': 'reranker', 'backend': 'reference', 'threads': max(threads), 'chunks_per_s': round(reference_rate, 2)})
+        print(json.dumps(results[-1]))
+        del reference_reranker
+    reference_rate = throughput(reference.embed_documents, texts, repeats)
+    results.append({'model': 'embedder', 'backend': 'reference', 'threads': max(threads), 'chunks_per_s': round(reference_rate, 2)})
+    print(json.dumps(results[-1]))
+
+    for backend in backends:
+        for n_threads in threads:
+            embeddings = load_embeddings(backend, threads=n_threads)
+            torch.set_num_threads(n_threads)
+            agreement = compare_embeddings(embeddings, reference, texts)
+            results.append({
+                'model': 'embedder',
+                'backend': backend,
+                'threads': n_threads,
+                'chunks_per_s': round(throughput(embeddings.embed_documents, texts, repeats), 2),
+                'min_cosine': round(agreement['min_cosine'], 5),
+                'mean_cosine': round(agreement['mean_cosine'], 5),
+                'within_tolerance': agreement['min_cosine'] >= inference_check_tolerance,
+            })
+            print(json.dumps(results[-1]))
+            del embeddings
+
+            if rerank:
+                reranker = load_reranker(backend, threads=n_threads)
+                torch.set_num_threads(n_threads)
+                results.append({
+                    'model': 'reranker',
+                    'backend': backend,
+                    'threads': n_threads,
+                    'chunks_per_s': round(throughput(reranker.compute_score, pairs, repeats), 2),
+                    **compare_scores(reranker.compute_score(pairs), reference_scores, rerank_top_k),
+                })
+                print(json.dumps(results[-1]))
+                del reranker
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', default=sorted(glob.glob('example/*.pdf')))
+    parser.add_argument('--chunks', type=int, default=64, help="Max number of chunks taken from the files")
+    parser.add_argument('--query', default="What dishes are vegetarian?", help="Query paired with the chunks for the reranker")
+    parser.add_argument('--backends', nargs='+', default=['onnx', 'int8'])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--no-rerank', action='store_true', help="Benchmark only the embedding model")
+    args = parser.parse_args()
+    texts = load_chunks(args.files, args.chunks)
+    run(texts, args.query, args.backends, args.threads, args.repeats, not args.no_rerank)
+
+
+if __name__ == '__main__':
+    main()
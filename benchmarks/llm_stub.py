@@ -0,0 +1,196 @@
+"""
+OpenAI-compatible stub of the LLM endpoint with configurable latency and token rate.
+Serves /v1/chat/completions, streamed and not, and returns JSON matching the requested
+schema for structured output. With --cjk-rate a share of answers drifts into chinese
+partway through, unless the request bans tokens with logit_bias. Point LLM_ENDPOINT at it:
+
+    python -m benchmarks.llm_stub --port 8001 --latency 0.3 --tokens-per-s 40
+    LLM_ENDPOINT=http://127.0.0.1:8001/v1 LLM_API_KEY=stub python main.py
+"""
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+from benchmarks.corpus import WORDS
+
+
+CHINESE_TOKENS = ["合同", "的", "付款", "条款", "是", "客户", "报告", "。"]
+
+class StubSettings:
+    def __init__(self, latency: float = 0.2, tokens_per_s: float = 50, answer_tokens: int = 120, seed: int = 0, cjk_rate: float = 0.0):
+        self.latency = latency  # Seconds before the first token
+        self.tokens_per_s = tokens_per_s
+        self.answer_tokens = answer_tokens
+        self.cjk_rate = cjk_rate  # Share of answers that switch to chinese
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+
+    def tokens(self, n: Optional[int] = None) -> List[str]:
+        with self.lock:
+            self.requests += 1
+            words = self.rng.choice(WORDS['en'], n or self.answer_tokens)
+        return [f"{word} " for word in words]
+
+
+    def drifts(self) -> bool:
+        with self.lock:
+            return bool(self.rng.random() < self.cjk_rate)
+
+
+    def drift_to_chinese(self, tokens: List[str]) -> List[str]:
+        """Continue the answer in chinese from a random token on."""
+        with self.lock:
+            start = int(self.rng.integers(len(tokens)))
+        return tokens[:start] + [CHINESE_TOKENS[i % len(CHINESE_TOKENS)] for i in range(len(tokens) - start)]
+
+
+
+def sample_from_schema(schema: dict, defs: Optional[dict] = None, text: str = "What are the payment terms of the contract") -> object:
+    """Smallest valid-looking instance of a JSON schema, enough for pydantic models of the bot."""
+    defs = defs if defs is not None else schema.get('$defs', {})
+    if '$ref' in schema:
+        return sample_from_schema(defs[schema['$ref'].split('/')[-1]], defs, text)
+    for key in ('anyOf', 'oneOf', 'allOf'):
+        if key in schema:
+            return sample_from_schema(schema[key][0], defs, text)
+    kind = schema.get('type')
+    if kind == 'object':
+        return {name: sample_from_schema(prop, defs, text) for name, prop in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items', {}), defs, text) for _ in range(2)]
+    if kind == 'integer':
+        return 1
+    if kind == 'number':
+        return 1.0
+    if kind == 'boolean':
+        return True
+    if 'enum' in schema:
+        return schema['enum'][0]
+    return text
+
+
+def make_handler(settings: StubSettings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            model = request.get('model', 'stub')
+            response_format = request.get('response_format') or {}
+            drifts = not request.get('logit_bias') and settings.drifts()
+            if response_format.get('type') == 'json_schema':
+                sample = sample_from_schema(response_format['json_schema']['schema'], **({'text': "".join(CHINESE_TOKENS)} if drifts else {}))
+                content = json.dumps(sample, ensure_ascii=False)
+                tokens = [content[i:i + 8] for i in range(0, len(content), 8)]
+            else:
+                tokens = settings.tokens(min(request.get('max_tokens') or settings.answer_tokens, settings.answer_tokens))
+                if drifts:
+                    tokens = settings.drift_to_chinese(tokens)
+            time.sleep(settings.latency)
+            if request.get('stream'):
+                self._stream(model, tokens)
+            else:
+                time.sleep(len(tokens) / settings.tokens_per_s)
+                self._send_json({
+                    'id': f'chatcmpl-{uuid.uuid4().hex}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': "".join(tokens)},
+                        'finish_reason': 'stop',
+                    }],
+                    'usage': {'prompt_tokens': 0, 'completion_tokens': len(tokens), 'total_tokens': len(tokens)},
+                })
+
+        def _send_json(self, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, model: str, tokens: List[str]):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+            for i, token in enumerate(tokens + [None]):
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'delta': {'content': token} if token is not None else {},
+                        'finish_reason': None if token is not None else 'stop',
+                    }],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                if token is not None and i < len(tokens) - 1:
+                    time.sleep(1 / settings.tokens_per_s)
+            self._write_chunk("data: [DONE]\n\n")
+            self._write_chunk("")
+
+        def _write_chunk(self, text: str):
+            data = text.encode('utf-8')
+            self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def handle(self):
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client cancelled a stream
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(host: str = '127.0.0.1', port: int = 0, settings: Optional[StubSettings] = None) -> ThreadingHTTPServer:
+    """Serve the stub from a daemon thread. Port 0 picks a free port, the base URL is `base_url(server)`."""
+    server = ThreadingHTTPServer((host, port), make_handler(settings or StubSettings()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='llm-stub', daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument('--tokens-per-s', type=float, default=50)
+    parser.add_argument('--answer-tokens', type=int, default=120)
+    parser.add_argument('--cjk-rate', type=float, default=0.0, help="Share of answers that switch to chinese")
+    args = parser.parse_args()
+    settings = StubSettings(args.latency, args.tokens_per_s, args.answer_tokens, cjk_rate=args.cjk_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(settings))
+    print(f"LLM stub at {base_url(server)}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+"""
+Concurrent load on the bot's handlers: simulated users ask questions, upload documents and page
+through their sources at a Poisson arrival rate. Updates go through the real Application
+(middleware, handler dispatch and the `concurrent_updates` limit), while the Telegram Bot API
+and the LLM endpoint are local stubs with configurable latency.
+
+Per request type it reports latency, queueing delay (arrival until the first handler runs) and
+error rate. Event loop lag and waits for DatabaseManager's per-user locks show blocking and contention.
+
+    python -m benchmarks.load --rate 5 --duration 60 --users 30 --mix query=0.7 upload=0.2 list=0.1
+"""
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest, RequestData
+
+import config
+from benchmarks.corpus import make_queries, write_corpus
+from benchmarks.llm_stub import StubSettings, base_url, start_stub
+from benchmarks.run import isolate_storage
+
+
+TOKEN = "123456:LOAD-TEST"
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'SmartReader', 'username': 'smart_reader_load_bot'}
+LOOP_LAG_INTERVAL = 0.01
+
+current_request: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('current_request', default=None)
+
+
+class TelegramStub(BaseRequest):
+    """Answers Bot API calls locally after `latency` seconds. Downloads are served from `files`."""
+    def __init__(self, latency: float, files: Dict[str, str], error_prefixes: List[str]):
+        self.latency = latency
+        self.files = files
+        self.error_prefixes = error_prefixes
+        self.calls = Counter()
+        self.failed_requests = set()
+        self._message_ids = Counter()
+
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+
+    async def initialize(self) -> None:
+        pass
+
+
+    async def shutdown(self) -> None:
+        pass
+
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None, *args, **kwargs) -> Tuple[int, bytes]:
+        await asyncio.sleep(self.latency)
+        if "/file/bot" in url:
+            self.calls['download'] += 1
+            with open(self.files[url.rsplit('/', 1)[-1]], 'rb') as f:
+                return 200, f.read()
+
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data is not None else {}
+        text = params.get('text')
+        if text and any(text.startswith(prefix) for prefix in self.error_prefixes):
+            self.failed_requests.add(current_request.get())
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method == 'getFile':
+            result = {'file_id': params['file_id'], 'file_unique_id': params['file_id'], 'file_path': params['file_id']}
+        elif api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            if api_method == 'sendMessage':
+                self._message_ids[chat_id] += 1
+            message_id = int(params.get('message_id') or self._message_ids[chat_id])
+            result = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER, 'text': text}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+
+class UpdateFactory:
+    """Bot API update payloads of simulated users."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'load_user_{user_id}'}
+
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {
+            'message_id': self.update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            **fields,
+        }
+
+
+    def query(self, user_id: int, text: str) -> Update:
+        update_id = self._next()
+        return Update.de_json({'update_id': update_id, 'message': self._message(user_id, text=text)}, self.bot)
+
+
+    def upload(self, user_id: int, file_id: str, file_name: str, size: int) -> Update:
+        update_id = self._next()
+        document = {'file_id': file_id, 'file_unique_id': file_id, 'file_name': file_name, 'file_size': size}
+        return Update.de_json({'update_id': update_id, 'message': self._message(user_id, document=document)}, self.bot)
+
+
+    def button(self, user_id: int, data: str) -> Update:
+        update_id = self._next()
+        callback = {
+            'id': str(update_id),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': self._message(user_id, text="sources"),
+        }
+        return Update.de_json({'update_id': update_id, 'callback_query': callback}, self.bot)
+
+
+
+class LockWaits:
+    """Wraps DatabaseManager.user_lock to record how long callers wait for users' locks."""
+    def __init__(self, db_manager):
+        self.waits = []
+        self._lock = threading.Lock()
+        original = db_manager.user_lock
+        waits = self
+
+        class TimedLock:
+            def __init__(self, lock):
+                self.lock = lock
+
+            def __enter__(self):
+                start = time.perf_counter()
+                self.lock.acquire()
+                with waits._lock:
+                    waits.waits.append(time.perf_counter() - start)
+                return self
+
+            def __exit__(self, *exc):
+                self.lock.release()
+
+        db_manager.user_lock = lambda user_id: TimedLock(original(user_id))
+
+
+
+async def measure_loop_lag(samples: List[float], stop: asyncio.Event):
+    """Delay of a periodic wake-up, which grows when something blocks the event loop."""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+def summarize(samples: List[float]) -> dict:
+    if not samples:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    values = np.asarray(samples) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 2),
+        'p95_ms': round(float(np.percentile(values, 95)), 2),
+        'p99_ms': round(float(np.percentile(values, 99)), 2),
+        'max_ms': round(float(values.max()), 2),
+    }
+
+
+async def run_load(args, work_dir: str) -> dict:
+    from bot.telegram_bot import SmartReaderBot
+    from data.job_store import JobStore
+    from data.language_manager import LanguageManager
+    from data.user_manager import UserManager
+    from utils.metrics import Metrics
+    from utils.warmup import ModelWarmup
+
+    lang_manager = LanguageManager()
+    error_prefixes = [lang_manager.get_message(key).split('{')[0] for key in ('error', 'file_failed', 'proc_file_fail')]
+    files = {
+        os.path.basename(path): path
+        for path in write_corpus(os.path.join(work_dir, 'corpus'), args.upload_files, args.upload_kb, ['md', 'html'])
+    }
+    telegram = TelegramStub(args.telegram_latency, files, error_prefixes)
+    smart_reader = SmartReaderBot(TOKEN, request=telegram)
+    app = smart_reader.app
+
+    arrivals, started, finished = dict(), dict(), dict()
+    kinds: Dict[int, str] = dict()
+
+    async def mark_started(update: Update, context):
+        started.setdefault(update.update_id, time.perf_counter())
+        current_request.set(update.update_id)
+
+    async def on_error(update, context):
+        if isinstance(update, Update):
+            telegram.failed_requests.add(update.update_id)
+
+    app.add_handler(TypeHandler(Update, mark_started), group=-2)
+    app.add_error_handler(on_error)
+
+    user_ids = [100_000 + i for i in range(args.users)]
+    for user_id in user_ids:
+        UserManager().add_user(f'load_user_{user_id}')
+
+    await app.initialize()
+    await app.post_init(app)
+    warmup_start = time.perf_counter()
+    await ModelWarmup().wait_ready()
+    warmup_s = time.perf_counter() - warmup_start
+
+    from data.database_manager import DatabaseManager
+    lock_waits = LockWaits(DatabaseManager())
+
+    factory = UpdateFactory(app.bot)
+    rng = np.random.default_rng(args.seed)
+    kinds_mix, weights = zip(*args.mix.items())
+    weights = np.asarray(weights) / sum(weights)
+    queries = make_queries(1000, seed=args.seed)
+    file_names = sorted(files)
+    uploaded = defaultdict(list)
+
+    def next_update(kind: str, user_id: int) -> Update:
+        if kind == 'query':
+            return factory.query(user_id, queries[int(rng.integers(len(queries)))])
+        if kind == 'upload':
+            file_name = file_names[int(rng.integers(len(file_names)))]
+            uploaded[user_id].append(file_name)
+            return factory.upload(user_id, file_name, file_name, os.path.getsize(files[file_name]))
+        if kind == 'delete' and uploaded[user_id]:
+            return factory.button(user_id, f"delete_{uploaded[user_id].pop()}")
+        return factory.button(user_id, "page_0")
+
+    async def process(update: Update):
+        try:
+            await app.update_processor.process_update(update, app.process_update(update))
+        finally:
+            finished[update.update_id] = time.perf_counter()
+
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop))
+    stages_before = Metrics().summary()
+    tasks = []
+    start = time.perf_counter()
+    n_requests = args.requests or int(args.rate * args.duration)
+    for _ in range(n_requests):
+        await asyncio.sleep(rng.exponential(1 / args.rate))
+        kind = str(rng.choice(kinds_mix, p=weights))
+        update = next_update(kind, user_ids[int(rng.integers(len(user_ids)))])
+        kinds[update.update_id] = kind
+        arrivals[update.update_id] = time.perf_counter()
+        tasks.append(asyncio.create_task(process(update)))
+    await asyncio.gather(*tasks, return_exceptions=True)
+    handlers_s = time.perf_counter() - start
+
+    # Uploads are ingested in the background, wait for the queue to drain
+    deadline = time.perf_counter() + args.drain_timeout
+    while JobStore().get_active() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.5)
+    stop.set()
+    await lag_task
+
+    by_kind = defaultdict(lambda: {'latency': [], 'queueing': [], 'errors': 0})
+    for update_id, kind in kinds.items():
+        row = by_kind[kind]
+        row['latency'].append(finished[update_id] - arrivals[update_id])
+        row['queueing'].append(started.get(update_id, finished[update_id]) - arrivals[update_id])
+        row['errors'] += update_id in telegram.failed_requests
+    requests = {
+        kind: {
+            'count': len(row['latency']),
+            'error_rate': round(row['errors'] / len(row['latency']), 4),
+            'latency': summarize(row['latency']),
+            'queueing': summarize(row['queueing']),
+        }
+        for kind, row in sorted(by_kind.items())
+    }
+    jobs = Counter(job['state'] for job in JobStore().get_active())
+
+    await app.post_shutdown(app)
+    await app.shutdown()
+    return {
+        'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        'warmup_s': round(warmup_s, 3),
+        'handlers_s': round(handlers_s, 3),
+        'throughput_rps': round(n_requests / handlers_s, 2),
+        'requests': requests,
+        'event_loop_lag': summarize(lag_samples),
+        'user_lock_wait': summarize(lock_waits.waits),
+        'unfinished_jobs': dict(jobs),
+        'telegram_calls': dict(telegram.calls),
+        'stages': {
+            stage: row for stage, row in Metrics().summary().items()
+            if row['count'] != stages_before.get(stage, {}).get('count')
+        },
+    }
+
+
+def parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = dict()
+    for item in items:
+        kind, weight = item.split('=')
+        if kind not in ('query', 'upload', 'list', 'delete'):
+            raise argparse.ArgumentTypeError(f"Unknown request type '{kind}', expected query, upload, list or delete")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=5, help="Mean arrivals per second")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of arrivals, unless --requests is given")
+    parser.add_argument('--requests', type=int, help="Number of requests")
+    parser.add_argument('--users', type=int, default=30)
+    parser.add_argument('--mix', nargs='+', default=['query=0.7', 'upload=0.2', 'list=0.1'], help="Weights of query, upload, list and delete requests")
+    parser.add_argument('--upload-files', type=int, default=5, help="Distinct synthetic documents users upload")
+    parser.add_argument('--upload-kb', type=int, default=100)
+    parser.add_argument('--telegram-latency', type=float, default=0.05, help="Seconds per Bot API call")
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--llm-tokens-per-s', type=float, default=50)
+    parser.add_argument('--drain-timeout', type=float, default=120, help="Seconds to wait for background ingestion after the last request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    args = parser.parse_args()
+    args.mix = parse_mix(args.mix)
+
+    work_dir = tempfile.mkdtemp(prefix='smartreader-load-')
+    isolate_storage(work_dir)
+    config.metrics_port = None
+    config.ADMIN_NICKNAME = config.ADMIN_NICKNAME or 'load_admin'
+    server = start_stub(settings=StubSettings(args.llm_latency, args.llm_tokens_per_s))
+    config.LLM_ENDPOINT, config.LLM_API_KEY = base_url(server), 'load-test'
+    try:
+        report = asyncio.run(run_load(args, work_dir))
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
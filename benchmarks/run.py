@@ -0,0 +1,328 @@
+"""
+End-to-end benchmark scenarios on a synthetic multilingual corpus, with the LLM replaced by a local stub:
+
+    ingest   IngestionQueue throughput in MB/s and chunks/s
+    storage  DatabaseManager.add_docs and get_storage (load from disk) cost vs corpus size
+    rag      RAG.process latency
+
+All storages live in a temporary directory. Results are written as JSON and compared with a baseline,
+the exit code is 1 if any metric regressed by more than the tolerance.
+Numbers depend on the machine, device and models, so no baseline is kept in the repository:
+save one from the base commit on the machine that runs the comparison, with the same arguments.
+
+    git checkout main && python -m benchmarks.run --save-baseline baseline.json
+    git checkout my-branch && python -m benchmarks.run --baseline baseline.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List
+
+import numpy as np
+
+import config
+from benchmarks.corpus import make_blocks, make_queries, render_markdown, write_corpus
+from benchmarks.llm_stub import StubSettings, base_url, start_stub
+
+
+# Whether a higher value of a metric is better, metrics without a direction are reported but not compared
+HIGHER_IS_BETTER = {
+    'mb_per_s': True,
+    'chunks_per_s': True,
+    'add_chunks_per_s': True,
+    'add_s': False,
+    'load_s': False,
+    'p50_ms': False,
+    'p95_ms': False,
+    'mean_ms': False,
+    'llm_wasted_tokens': False,
+}
+
+
+def isolate_storage(work_dir: str):
+    """
+    Point every storage path of the config into `work_dir`.
+    Must run before modules that import these paths from config are imported.
+    """
+    for name in dir(config):
+        value = getattr(config, name)
+        if name.endswith('_path') and name != 'messages_path' and isinstance(value, str):
+            setattr(config, name, os.path.join(work_dir, os.path.relpath(value, './storage')))
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    samples = np.asarray(samples) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(samples, 50)), 2),
+        'p95_ms': round(float(np.percentile(samples, 95)), 2),
+        'mean_ms': round(float(samples.mean()), 2),
+    }
+
+
+class StatusBot:
+    """Stands in for the Telegram Bot in ingestion jobs, which only edit their status message."""
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int):
+        pass
+
+
+_loop = None
+
+
+def run_async(coro):
+    """Run a coroutine on one event loop for the whole benchmark, the ingestion queue holds loop-bound semaphores."""
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+async def warm_up(work_dir: str):
+    """Load the models the way the bot does at startup and start the conversion workers, so the first scenario doesn't time them."""
+    from utils.warmup import ModelWarmup
+
+    if ModelWarmup().ready:
+        return
+    ModelWarmup().start(StatusBot())
+    await ModelWarmup().wait_ready()
+    path = os.path.join(work_dir, 'warm-up.md')
+    with open(path, 'w') as f:
+        f.write(render_markdown(make_blocks(1024, seed=0)))
+    await ingest([path], 'bench-warm-up')
+
+
+async def ingest(paths: List[str], user_id: str):
+    """Queue files as uploads of one user, like the bot does, and wait until all jobs are finished."""
+    from data.job_store import ACTIVE_STATES, JobStore
+    from utils.ingestion import IngestionQueue
+
+    bot, jobs = StatusBot(), JobStore()
+    job_ids = [
+        IngestionQueue().submit(bot, user_id, path, os.path.basename(path), chat_id=0, message_id=i, lang='en')
+        for i, path in enumerate(paths)
+    ]
+    while True:
+        states = [jobs.get(job_id)['state'] for job_id in job_ids]
+        if not any(state in ACTIVE_STATES for state in states):
+            break
+        await asyncio.sleep(0.05)
+    failed = [path for path, state in zip(paths, states) if state != 'indexed']
+    if failed:
+        raise RuntimeError(f"Failed to ingest {failed}")
+
+
+def scenario_ingest(work_dir: str, n_docs: int, size_kb: int, formats: List[str]) -> List[dict]:
+    from utils.file_processor import convert_file, split_markdown
+
+    results = []
+    for fmt in formats:
+        corpus_dir = os.path.join(work_dir, 'corpus', fmt)
+        files = write_corpus(corpus_dir, n_docs, size_kb, [fmt])
+        total_bytes = sum(os.path.getsize(path) for path in files)
+        total_chunks = sum(len(split_markdown(convert_file(path), os.path.basename(path))) for path in files)
+        uploads = []
+        for path in files:  # Ingestion deletes processed uploads
+            upload = os.path.join(config.uploads_path, 'bench-ingest', os.path.basename(path))
+            os.makedirs(os.path.dirname(upload), exist_ok=True)
+            shutil.copyfile(path, upload)
+            uploads.append(upload)
+
+        run_async(warm_up(work_dir))
+        start = time.perf_counter()
+        run_async(ingest(uploads, f'bench-ingest-{fmt}'))
+        elapsed = time.perf_counter() - start
+        results.append({
+            'scenario': 'ingest',
+            'params': {'format': fmt, 'docs': n_docs, 'size_kb': size_kb},
+            'metrics': {
+                'mb_per_s': round(total_bytes / 1024**2 / elapsed, 3),
+                'chunks_per_s': round(total_chunks / elapsed, 2),
+                'seconds': round(elapsed, 3),
+                'chunks': total_chunks,
+            },
+        })
+        print(json.dumps(results[-1]))
+    return results
+
+
+def scenario_storage(sizes: List[int]) -> List[dict]:
+    from langchain_core.documents import Document
+    from data.database_manager import DatabaseManager
+
+    db_manager = DatabaseManager()
+    results = []
+    for n in sizes:
+        user_id = f'bench-storage-{n}'
+        rng = np.random.default_rng(n)
+        chunks = []
+        doc = 0
+        while len(chunks) < n:
+            text = render_markdown(make_blocks(8 * 1024, seed=int(rng.integers(1 << 30))))
+            for start in range(0, len(text), config.chunk):
+                chunks.append(Document(page_content=text[start:start + config.chunk], metadata={'source': f'doc-{doc}.md'}))
+            doc += 1
+        chunks = chunks[:n]
+
+        start = time.perf_counter()
+        db_manager.add_docs(chunks, user_id)
+        add_s = time.perf_counter() - start
+        db_manager.flush()
+
+        db_manager.cache.discard(user_id)
+        start = time.perf_counter()
+        db_manager.get_storage(user_id)
+        load_s = time.perf_counter() - start
+        results.append({
+            'scenario': 'storage',
+            'params': {'chunks': n, 'backend': config.storage_backend, 'mode': config.storage_mode},
+            'metrics': {
+                'add_s': round(add_s, 3),
+                'add_chunks_per_s': round(n / add_s, 2),
+                'load_s': round(load_s, 4),
+            },
+        })
+        print(json.dumps(results[-1]))
+    return results
+
+
+def scenario_rag(work_dir: str, n_queries: int, n_docs: int, size_kb: int, stub: StubSettings) -> List[dict]:
+    from utils.metrics import Metrics
+    from utils.rag import RAG
+
+    user_id = 'bench-rag'
+    run_async(warm_up(work_dir))
+    run_async(ingest(write_corpus(os.path.join(work_dir, 'corpus', 'rag'), n_docs, size_kb, ['md'], seed=10_000), user_id))
+
+    rag = RAG()
+    stages_before = Metrics().summary()
+    counters_before = Metrics().counters()
+    samples = []
+    for query in make_queries(n_queries):
+        start = time.perf_counter()
+        rag.process(query, user_id, 'en')
+        samples.append(time.perf_counter() - start)
+    stages = {
+        stage: row for stage, row in Metrics().summary().items()
+        if row['count'] != stages_before.get(stage, {}).get('count')
+    }
+    counters = Metrics().counters()
+    retries, wasted_tokens = (
+        counters.get(name, 0) - counters_before.get(name, 0)
+        for name in ('llm_retries_total[chinese]', 'llm_wasted_tokens_total[chinese]')
+    )
+    results = [{
+        'scenario': 'rag',
+        'params': {'queries': n_queries, 'llm_latency_s': stub.latency, 'llm_tokens_per_s': stub.tokens_per_s, 'llm_cjk_rate': stub.cjk_rate},
+        'metrics': {**percentiles(samples), 'llm_retries': retries, 'llm_wasted_tokens': wasted_tokens},
+        'stages': stages,
+    }]
+    print(json.dumps(results[-1]))
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'embed_model_device': config.embed_model_device,
+        'inference_backend': config.inference_backend,
+        'retrieval_model_name': config.retrieval_model_name,
+    }
+
+
+def result_key(result: dict) -> str:
+    return f"{result['scenario']}:{json.dumps(result['params'], sort_keys=True)}"
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[dict]:
+    """Metrics that are worse than the baseline by more than `tolerance` (relative)."""
+    baseline = {result_key(result): result['metrics'] for result in baseline}
+    regressions = []
+    for result in results:
+        reference = baseline.get(result_key(result))
+        if reference is None:
+            continue
+        for metric, value in result['metrics'].items():
+            if metric not in HIGHER_IS_BETTER or not reference.get(metric):
+                continue
+            change = (value - reference[metric]) / reference[metric]
+            worse = -change if HIGHER_IS_BETTER[metric] else change
+            if worse > tolerance:
+                regressions.append({
+                    'key': result_key(result),
+                    'metric': metric,
+                    'baseline': reference[metric],
+                    'value': value,
+                    'change': round(change, 3),
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=['ingest', 'storage', 'rag'], choices=['ingest', 'storage', 'rag'])
+    parser.add_argument('--docs', type=int, default=5)
+    parser.add_argument('--size-kb', type=int, default=100)
+    parser.add_argument('--formats', nargs='+', default=['md', 'html'])
+    parser.add_argument('--storage-sizes', type=int, nargs='+', default=[1_000, 5_000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--llm-tokens-per-s', type=float, default=50)
+    parser.add_argument('--llm-cjk-rate', type=float, default=0.0, help="Share of stub answers that switch to chinese")
+    parser.add_argument('--content-cache', action='store_true', help="Keep the content cache on, off by default for cold numbers")
+    parser.add_argument('--output', help="Write results to this JSON file")
+    parser.add_argument('--baseline', help="Compare results with this JSON file")
+    parser.add_argument('--save-baseline', help="Write results as a new baseline to this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='smartreader-bench-')
+    isolate_storage(work_dir)
+    config.use_content_cache = args.content_cache
+    stub = StubSettings(args.llm_latency, args.llm_tokens_per_s, cjk_rate=args.llm_cjk_rate)
+    server = start_stub(settings=stub)
+    config.LLM_ENDPOINT, config.LLM_API_KEY = base_url(server), 'benchmark'
+
+    results = []
+    try:
+        if 'ingest' in args.scenarios:
+            results += scenario_ingest(work_dir, args.docs, args.size_kb, args.formats)
+        if 'storage' in args.scenarios:
+            results += scenario_storage(args.storage_sizes)
+        if 'rag' in args.scenarios:
+            results += scenario_rag(work_dir, args.queries, args.docs, args.size_kb, stub)
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        print(json.dumps({'baseline': args.baseline, 'regressions': regressions}))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
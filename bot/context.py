@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from data.user_manager import UserManager
+from data.language_manager import LanguageManager
+
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """Who sent an update and what they may do, resolved once per update."""
+    user_id: int
+    username: Optional[str]
+    lang: str
+    is_allowed: bool
+    is_admin: bool
+
+
+def resolve_user_context(update: Update) -> UserContext:
+    user_id = update.effective_chat.id
+    username = update.effective_user.username if update.effective_user else None
+    user_manager = UserManager()
+    return UserContext(
+        user_id=user_id,
+        username=username,
+        lang=LanguageManager().get_user_language(user_id),
+        is_allowed=user_manager.is_allowed_user(username),
+        is_admin=user_manager.is_admin(username),
+    )
+
+
+async def user_context_middleware(update: Update, context: CallbackContext) -> None:
+    """Runs before all other handlers and stores the sender's context on the update's callback context."""
+    if update.effective_chat is not None:
+        context.user_context = resolve_user_context(update)
+
+
+def get_user_context(update: Update, context: CallbackContext) -> UserContext:
+    """Context resolved by the middleware, resolved here for updates that skipped it."""
+    user_context = getattr(context, 'user_context', None)
+    if user_context is None:
+        user_context = resolve_user_context(update)
+        context.user_context = user_context
+    return user_context
@@ -1,6 +1,7 @@
 from telegram import Update
 from telegram.ext import CallbackContext
 
+from bot.context import get_user_context
 from bot.keyboard_markup import get_lang_markup
 from data.user_manager import UserManager
 from data.language_manager import LanguageManager
@@ -13,16 +14,17 @@ async def set_language(update: Update, context: CallbackContext) -> None:
     """
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
 
-    if not user_manager.is_allowed_user(username):
+    if not user_context.is_allowed:
         user_manager.logger.warning(f'{username} ({user_id}) tried issuing a command but was not allowed.')
         await update.message.reply_text(lang_manager.get_message("access_denied"))
         return
 
-    cur_lang = lang_manager.get_user_language(user_id)
+    cur_lang = user_context.lang
     message = lang_manager.get_message('choose_lang', cur_lang)
     await update.message.reply_text(message, reply_markup=get_lang_markup())
 
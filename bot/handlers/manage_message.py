@@ -3,11 +3,14 @@ from telegram.constants import ParseMode
 from telegram.error import BadRequest
 from telegram.ext import CallbackContext
 
-from config import add_relative_queries
+from bot.context import get_user_context
+from bot.streaming import StreamingReply
+from config import add_relative_queries, stream_responses
 from data.utils import sanitize_response
 from data.user_manager import UserManager
 from data.language_manager import LanguageManager
-from utils.rag import RAG, QueryExpander
+from utils.metrics import Metrics
+from utils.warmup import ModelWarmup
 
 
 
@@ -15,12 +18,13 @@ async def start(update: Update, context: CallbackContext) -> None:
     """Handles the /start command. Sends a welcome message and asks for language preference."""
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_allowed_user(username):
+    if not user_context.is_allowed:
         user_manager.logger.warning(f'{username} ({user_id}) tried issuing a command but was not allowed.')
         await update.message.reply_text(lang_manager.get_message("access_denied"))
         return
@@ -32,13 +36,14 @@ async def user_query_handler(update: Update, context: CallbackContext) -> None:
     """Handles a question from the user and replies with the assistant's response."""
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
     user_query = update.message.text
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_allowed_user(username):
+    if not user_context.is_allowed:
         user_manager.logger.warning(f'{username} ({user_id}) tried issuing a command but was not allowed.')
         message = lang_manager.get_message('access_denied')
         await update.message.reply_text(message)
@@ -49,19 +54,28 @@ async def user_query_handler(update: Update, context: CallbackContext) -> None:
     user_manager.logger.info(f'{username} ({user_id}) asked "{user_query}".')
 
     try:
-        if add_relative_queries:
-            relative_questions = QueryExpander().expand_query(user_query, lang)
-        else:
-            relative_questions = None
-
-        response = RAG().process(user_query, user_id, lang, relative_questions)
-        clean_response = sanitize_response(response)
-
-        try:
-            await update.message.reply_text(clean_response, parse_mode=ParseMode.MARKDOWN_V2)
-        except BadRequest:
-            user_manager.logger.warning(f"Failed to apply parse_mode MARKDOWN_V2 to message {response}")
-            await update.message.reply_text(response)
+        with Metrics().timer('answer'):  # Whole answer, from retrieval to the last sent message
+            await ModelWarmup().wait_ready()  # Requests that arrive during startup wait for the models
+            from utils.rag import RAG, QueryExpander
+
+            if add_relative_queries:
+                relative_questions = await QueryExpander().aexpand_query(user_query, lang)
+            else:
+                relative_questions = None
+
+            if stream_responses:
+                sources_str, chunks = await RAG().astream(user_query, user_id, lang, relative_questions)
+                await StreamingReply(update.message).send(sources_str, chunks)
+                return
+
+            response = await RAG().aprocess(user_query, user_id, lang, relative_questions)
+            clean_response = sanitize_response(response)
+
+            try:
+                await update.message.reply_text(clean_response, parse_mode=ParseMode.MARKDOWN_V2)
+            except BadRequest:
+                user_manager.logger.warning(f"Failed to apply parse_mode MARKDOWN_V2 to message {response}")
+                await update.message.reply_text(response)
     
     except Exception as e:
         user_manager.logger.error(f'Error while generating response: {e}')
@@ -72,12 +86,13 @@ async def unsupported_file_handler(update: Update, context: CallbackContext) ->
     """Handles unsupported file types like images, videos, etc."""
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_allowed_user(username):
+    if not user_context.is_allowed:
         user_manager.logger.warning(f'{username} ({user_id}) tried issuing a command but was not allowed.')
         await update.message.reply_text(lang_manager.get_message("access_denied"))
         return
@@ -0,0 +1,37 @@
+import html
+
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import CallbackContext
+
+from bot.context import get_user_context
+from data.language_manager import LanguageManager
+from utils.metrics import Metrics
+
+
+async def show_stats(update: Update, context: CallbackContext) -> None:
+    """
+    Handle showing latency percentiles of request stages and counters (admin only).
+    If the user is not an admin, it returns a 'not_authorized' message.
+    """
+    user_context = get_user_context(update, context)
+    lang_manager = LanguageManager()
+
+    if not user_context.is_admin:
+        await update.message.reply_text(lang_manager.get_message('not_authorized'))
+        return
+
+    metrics = Metrics()
+    stages = [
+        f"{stage[:28]:<28} {row['count']:>7} {row['p50']:>8} {row['p95']:>8} {row['p99']:>8}"
+        for stage, row in metrics.summary().items()
+    ]
+    stages = [f"{'stage':<28} {'n':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"] + stages
+    counters = [f"{name[:40]:<40} {value:>10g}" for name, value in metrics.counters().items()]
+
+    message = lang_manager.get_message('stats', user_context.lang).format(
+        window=metrics.window,
+        stages=f"<pre>{html.escape(chr(10).join(stages))}</pre>",
+        counters=f"<pre>{html.escape(chr(10).join(counters) or '-')}</pre>",
+    )
+    await update.message.reply_text(message, parse_mode=ParseMode.HTML)
@@ -4,32 +4,34 @@ from typing import List
 from telegram import Update
 from telegram.ext import CallbackContext
 
+from bot.context import get_user_context
 from bot.keyboard_markup import get_list_markup
-from config import uploads_path, cleanup_original, cleanup_markdown
+from config import uploads_path
 from data.user_manager import UserManager
 from data.language_manager import LanguageManager
-from data.database_manager import DatabaseManager
-from utils.file_processor import process_file
+from utils.executors import run_blocking
+from utils.warmup import ModelWarmup
 
 
 
 async def file_handler(update: Update, context: CallbackContext) -> None:
     """
     Handles the file upload process.
-    Takes an uploaded file from a user, checks if the user is allowed, saves the file temporarily,
-    attempts to process the file, and then deletes the file if processing is successful and cleanup is enabled.
+    Takes an uploaded file from a user, checks if the user is allowed, saves the file temporarily
+    and queues it for background ingestion. The reply message is then edited with the job's progress.
 
     Returns:
     - int: The state of the conversation after handling the file.
     """
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_allowed_user(username):
+    if not user_context.is_allowed:
         user_manager.logger.warning(f'{username} ({user_id}) tried issuing a command but was not allowed.')
         await update.message.reply_text(lang_manager.get_message("access_denied"))
         return
@@ -39,24 +41,24 @@ async def file_handler(update: Update, context: CallbackContext) -> None:
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
     message = lang_manager.get_message('proc_file', lang)
-    await update.message.reply_text(message)
+    status_message = await update.message.reply_text(message)
 
     try:
         file_content = await update.message.document.get_file()
         await file_content.download_to_drive(file_path)
         user_manager.logger.info(f'File from {username} ({user_id}) temporarily loaded to {file_path}.')
-        is_processed = await process_file(
-            file_path,
+        message = lang_manager.get_message('job_queued', lang).format(file_name=file_name)
+        await status_message.edit_text(message)
+        from utils.ingestion import IngestionQueue
+        IngestionQueue().submit(
+            context.bot,
             user_id,
+            file_path,
             source=file_name,
-            cleanup_original=cleanup_original,
-            cleanup_markdown=cleanup_markdown,
+            chat_id=status_message.chat_id,
+            message_id=status_message.message_id,
+            lang=lang,
         )
-        if is_processed:
-            message = lang_manager.get_message('proc_file_ok', lang).format(file_name=file_name)
-        else:
-            message = lang_manager.get_message('proc_file_fail', lang).format(file_name=file_name)
-        await update.message.reply_text(message)
 
     except Exception as e:
         message = lang_manager.get_message('file_failed', lang).format(e=e)
@@ -68,19 +70,22 @@ async def docs_list_handler(update: Update, context: CallbackContext) -> None:
     """Handler for listing user's documents."""
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
-    db_manager = DatabaseManager()
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_allowed_user(username):
+    if not user_context.is_allowed:
         user_manager.logger.warning(f'{username} ({user_id}) tried issuing a command but was not allowed.')
         await update.message.reply_text(lang_manager.get_message("access_denied"))
         return
 
-    lang = lang_manager.get_user_language(user_id)
-    users_docs = db_manager.get_users_docs(user_id)
+    await ModelWarmup().wait_ready()
+    from data.database_manager import DatabaseManager
+    db_manager = DatabaseManager()
+
+    users_docs = await run_blocking(db_manager.get_users_docs, user_id)
     db_manager.logger.info(f'{username} ({user_id}) has {len(users_docs)} saved sources.')
 
     if len(users_docs) == 0:
@@ -92,10 +97,10 @@ async def docs_list_handler(update: Update, context: CallbackContext) -> None:
     
 async def send_docs_list(update: Update, context: CallbackContext, page: int, users_docs: List) -> None:
     """Send a list of documents with pagination to the user."""
-    user_id = update.effective_chat.id
+    user_context = get_user_context(update, context)
 
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
     if update.callback_query:
         reply_method = update.callback_query.edit_message_text
@@ -114,14 +119,17 @@ async def list_buttons_handler(update: Update, context: CallbackContext) -> None
 
     user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
+    await ModelWarmup().wait_ready()
+    from data.database_manager import DatabaseManager
     db_manager = DatabaseManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
     if query.data.startswith("delete_"):
         deleted_doc = query.data.replace("delete_", "", 1)
-        db_manager.delete_doc(user_id=user_id, source=deleted_doc)
+        await run_blocking(db_manager.delete_doc, user_id=user_id, source=deleted_doc)
         
         db_manager.logger.info(f'{username} ({user_id}) deleted document {deleted_doc}.')
         message = lang_manager.get_message('deleted_doc', lang).format(deleted_doc=deleted_doc)
@@ -130,5 +138,5 @@ async def list_buttons_handler(update: Update, context: CallbackContext) -> None
 
     elif query.data.startswith("page_"):
         page = int(query.data.split("_")[1])
-        users_docs = db_manager.get_users_docs(user_id)
+        users_docs = await run_blocking(db_manager.get_users_docs, user_id)
         await send_docs_list(update, context, page, users_docs=users_docs)
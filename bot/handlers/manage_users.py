@@ -1,5 +1,6 @@
 from telegram import Update
 from telegram.ext import CallbackContext
+from bot.context import get_user_context
 from data.user_manager import UserManager
 from data.language_manager import LanguageManager
 
@@ -14,14 +15,14 @@ async def add_user(update: Update, context: CallbackContext) -> None:
     If the user is already in the allowlist, it returns a 'user_exists' message.
     Otherwise, it adds the user to the allowlist and returns a 'user_added' message.
     """
-    user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
     
-    if not user_manager.is_admin(username):
+    if not user_context.is_admin:
         message = lang_manager.get_message('not_authorized')
     elif not context.args:
         message = lang_manager.get_message('add_user')
@@ -50,14 +51,14 @@ async def add_admin(update: Update, context: CallbackContext) -> None:
     Otherwise, it adds the user with admin's status to the allowlist and returns a 'user_added' message.
     
     """
-    user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
     
-    if not user_manager.is_admin(username):
+    if not user_context.is_admin:
         message = lang_manager.get_message('not_authorized')
     elif not context.args:
         message = lang_manager.get_message('add_admin')
@@ -85,14 +86,14 @@ async def del_user(update: Update, context: CallbackContext) -> None:
     If the user is not in the allowlist, it returns a 'user_not_found' message.
     Otherwise, it removes the user from the allowlist and returns a 'user_removed' message.
     """
-    user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_admin(username):
+    if not user_context.is_admin:
         message = lang_manager.get_message('not_authorized')
     elif not context.args:
         message = lang_manager.get_message('specify_username')
@@ -118,14 +119,14 @@ async def show_users(update: Update, context: CallbackContext) -> None:
     If the user is not an admin, it returns a 'not_authorized' message.
     Otherwise, it returns a formatted list of users.
     """
-    user_id = update.effective_chat.id
     username = update.effective_user.username
+    user_context = get_user_context(update, context)
 
     user_manager = UserManager()
     lang_manager = LanguageManager()
-    lang = lang_manager.get_user_language(user_id)
+    lang = user_context.lang
 
-    if not user_manager.is_admin(username):
+    if not user_context.is_admin:
         message = lang_manager.get_message('not_authorized')
     else:
         users_list = [f"{e[0].replace('@', '')}, is admin: {e[1]}" for e in user_manager.list_users()]
@@ -0,0 +1,14 @@
+from typing import Optional
+
+from telegram.request import HTTPXRequest, RequestData
+
+from utils.metrics import Metrics
+
+
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency of each Bot API call as the `telegram` stage."""
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None, *args, **kwargs) -> tuple[int, bytes]:
+        api_method = "download" if "/file/bot" in url else url.rsplit('/', 1)[-1]
+        with Metrics().timer('telegram', method=api_method):
+            return await super().do_request(url, method, request_data, *args, **kwargs)
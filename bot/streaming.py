@@ -0,0 +1,123 @@
+import time
+import asyncio
+from typing import AsyncIterator
+
+from telegram import Message
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from config import stream_edit_interval
+from data.utils import sanitize_response
+from utils.logging_config import setup_logging
+
+
+PLACEHOLDER = "…"
+
+
+class StreamingReply:
+    """
+    Delivers a streamed answer by progressively editing one Telegram message.
+    Edits are throttled to `stream_edit_interval` seconds to stay within Telegram rate limits.
+    Text that doesn't fit into one message continues in a new one.
+    When the answer is generated again, the streamed text is removed and the stream starts over.
+    """
+    def __init__(self, message: Message, min_interval: float = stream_edit_interval):
+        self.message = message
+        self.min_interval = min_interval
+        self.logger = setup_logging('StreamingReply')
+        self._reply = None
+        self._replies = []
+        self._text = ""
+        self._shown = ""
+        self._next_edit = 0.0
+
+
+    async def send(self, header: str, chunks: AsyncIterator[str]) -> str:
+        """
+        Send the header first, then append chunks as they arrive.
+        Returns:
+            Full text of the last message.
+        """
+        from utils.llm import STREAM_RESET
+
+        self._text = header
+        self._reply = await self.message.reply_text(header or PLACEHOLDER)
+        self._replies = [self._reply]
+        self._shown = header
+        self._next_edit = time.monotonic() + self.min_interval
+
+        async for chunk in chunks:
+            if chunk is STREAM_RESET:
+                await self._reset(header)
+                continue
+            self._text += chunk
+            if len(self._text) > MessageLimit.MAX_TEXT_LENGTH:
+                await self._start_new_message()
+            elif time.monotonic() >= self._next_edit:
+                await self._edit(self._text)
+
+        await self._finalize()
+        return self._text
+
+
+    async def _start_new_message(self):
+        """Freeze the current message at the limit and continue the stream in a new one."""
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        split_at = self._text.rfind("\n", 0, limit)
+        if split_at <= 0:
+            split_at = limit
+        head, self._text = self._text[:split_at], self._text[split_at:].lstrip("\n")
+        await self._finalize(head)
+        self._reply = await self.message.reply_text(self._text or PLACEHOLDER)
+        self._replies.append(self._reply)
+        self._shown = self._text
+        self._next_edit = time.monotonic() + self.min_interval
+
+
+    async def _reset(self, header: str):
+        """Delete messages the stream continued in and bring the first one back to the header."""
+        for reply in self._replies[1:]:
+            try:
+                await reply.delete()
+            except BadRequest as e:
+                self.logger.warning(f"Failed to delete a discarded message: {e}")
+        self._reply = self._replies[0]
+        self._replies = [self._reply]
+        self._text = header
+        self._shown = None
+        await self._edit(header)
+
+
+    async def _edit(self, text: str, parse_mode: str = None) -> bool:
+        if text == self._shown and parse_mode is None:
+            return True
+        try:
+            await self._reply.edit_text(text or PLACEHOLDER, parse_mode=parse_mode)
+        except RetryAfter as e:
+            self.logger.warning(f"Hit Telegram flood control, pausing edits for {e.retry_after}s")
+            self._next_edit = time.monotonic() + float(e.retry_after)
+            return False
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return True
+            raise
+        self._shown = text
+        self._next_edit = time.monotonic() + self.min_interval
+        return True
+
+
+    async def _finalize(self, text: str = None):
+        """Apply MarkdownV2 to the finished message, falling back to plain text."""
+        text = self._text if text is None else text
+        while True:
+            try:
+                await self._reply.edit_text(sanitize_response(text), parse_mode=ParseMode.MARKDOWN_V2)
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(float(e.retry_after))
+            except BadRequest:
+                self.logger.warning(f"Failed to apply parse_mode MARKDOWN_V2 to message {text}")
+                while not await self._edit(text):
+                    await asyncio.sleep(max(self._next_edit - time.monotonic(), 0))
+                break
+        self._shown = text
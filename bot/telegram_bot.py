@@ -1,25 +1,69 @@
+from typing import Optional
+
+from telegram import Update
+from telegram.request import BaseRequest
 from telegram.ext import (
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
     filters,
     MessageHandler,
+    TypeHandler,
 )
 
+from bot.context import user_context_middleware
+from bot.request import TimedRequest
 from bot.handlers.manage_user_file import file_handler, docs_list_handler, list_buttons_handler
 from bot.handlers.manage_users import add_user, add_admin, del_user, show_users
 from bot.handlers.manage_lang import set_language, language_button
 from bot.handlers.manage_message import start, user_query_handler, unsupported_file_handler
-from config import supported_languages
+from bot.handlers.manage_stats import show_stats
+from config import supported_languages, concurrent_updates
+from utils.metrics import Metrics
+from utils.warmup import ModelWarmup
 
 
 class SmartReaderBot:
-    def __init__(self, token: str):
-        self.app = ApplicationBuilder().token(token).build()
+    def __init__(self, token: str, request: Optional[BaseRequest] = None):
+        """`request` replaces the HTTP client for Bot API calls, e.g. with a stub for load tests."""
+        self.app = (
+            ApplicationBuilder()
+            .token(token)
+            .request(request or TimedRequest(connection_pool_size=256))  # Same pool size as the default request
+            .concurrent_updates(concurrent_updates)
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self._register_handlers()
 
 
+    async def _post_init(self, app):
+        """
+        Start loading models and storages of recently active users in the background, so polling starts right away.
+        Interrupted uploads are resumed when the models are ready.
+        """
+        Metrics().start_server()
+        ModelWarmup().start(app.bot)
+
+
+    async def _post_shutdown(self, app):
+        """Stop ingestion workers and fold pending index changes into snapshots."""
+        from utils.ingestion import IngestionQueue
+
+        warmup = ModelWarmup()
+        await warmup.shutdown()
+        IngestionQueue().shutdown()
+        if warmup.ready:
+            from data.database_manager import DatabaseManager
+            DatabaseManager().flush()
+        Metrics().stop_server()
+
+
     def _register_handlers(self):
+        # Resolves the sender's permissions and language once per update, before any other group
+        self.app.add_handler(TypeHandler(Update, user_context_middleware), group=-1)
+
         self.app.add_handler(CommandHandler("start", start))
 
         self.app.add_handler(CommandHandler("set_lang", set_language))
@@ -38,6 +82,7 @@ class SmartReaderBot:
         self.app.add_handler(CommandHandler("add_user", add_user))
         self.app.add_handler(CommandHandler("del_user", del_user))
         self.app.add_handler(CommandHandler("show_users", show_users))
+        self.app.add_handler(CommandHandler("stats", show_stats))
     
 
     def run(self):
@@ -13,9 +13,28 @@ log_file_path = "./storage/logs/tg_bot.log"
 uploads_path = "./storage/uploads/"
 languages_db_path = "./storage/db/language_prefs.db"
 users_data_db_path = "./storage/db/users_data.db"
+catalog_db_path = "./storage/db/sources_catalog.db"
+jobs_db_path = "./storage/db/ingestion_jobs.db"
+sqlite_pool_size = 4  # Connections per database of users and language preferences, opened in WAL mode
+sqlite_busy_timeout = 10  # Seconds a write waits for another writer
 sources_per_page = 7
 cleanup_original = True  # Delete original files after processing
 cleanup_markdown = False  # Delete markdown files after sending to user
+concurrent_updates = 64  # Number of updates processed concurrently by the bot
+stream_responses = True  # Edit the answer message as tokens arrive instead of waiting for the full answer
+stream_edit_interval = 1.5  # Minimal seconds between edits of a streamed message
+cpu_workers = 4  # Threads for blocking work (embedding, search, reranking) off the event loop
+ingest_workers = 4  # Processes converting and splitting uploaded files
+parallel_convert_min_units = {".pdf": 20, ".xlsx": 4, ".xls": 4}  # Files with this many pages or sheets are converted in parallel ranges
+ingest_max_jobs = 2  # Uploads processed at the same time, the rest wait in the queue
+ingest_max_jobs_per_user = 1  # Uploads of one user processed at the same time
+ingest_embed_batch = 64  # Chunks embedded per step, ingestion progress is reported between steps
+use_content_cache = True  # Reuse converted Markdown and chunk vectors of files that were uploaded before
+content_cache_path = "./storage/cache/content"
+content_cache_max_bytes = 2 * 1024**3  # Shared budget of cached Markdown files and vectors
+metrics_host = "127.0.0.1"  # Metrics are served locally in the Prometheus text format at /metrics
+metrics_port = 9464  # None disables the endpoint, /stats still works
+metrics_window = 2048  # Recent samples per stage used for the p50/p95/p99 of /stats
 
 # LLM settings
 LLM_API_KEY = os.getenv("LLM_API_KEY")
@@ -25,17 +44,58 @@ prompts_dir = "./resources/prompts/"
 max_tokens = 4096
 temperature = 0.7
 temperature_structured = 0.1
+llm_max_connections = 32  # Size of the pooled HTTP connections to the LLM endpoint
+llm_timeout = 120  # Seconds
+llm_max_attempts = 3  # Generations per request, attempts are cancelled as soon as chinese symbols stream in and the last one is kept as is
+llm_cjk_logit_bias = False  # On retries, ban CJK tokens of model_name's tokenizer with logit_bias (needs transformers and an endpoint accepting large biases, e.g. vLLM)
 
 # Retrieval settings
 embed_db_path = "./storage/db/faiss_index"
+storage_mode = "memory"  # "memory" loads whole storages on the heap, "mmap" keeps chunk texts in SQLite and maps flat and IVF vectors from disk (HNSW indexes, the default above ann_min_vectors, are still read into memory)
+storage_backend = "per_user"  # "per_user" keeps a storage per user under embed_db_path, "shared" keeps all users in a few sharded indexes
+shared_db_path = "./storage/db/shared_index"
+shared_shards = 8  # Number of shared FAISS indexes, users are spread over them by slot
+storage_cache_max_bytes = 2 * 1024**3  # Memory budget for loaded per-user vector storages
+storage_prefetch_users = 20  # Number of most recently active users to load at startup
+index_save_delay = 30  # Seconds without writes before a user's log is compacted into a snapshot
+index_log_compact_bytes = 64 * 1024**2  # Compact right away when a user's log grows over this size
 embed_model_device = "cuda:0"
+inference_backend = "torch"  # "torch" runs the stock models on embed_model_device, "onnx" (ONNX Runtime) or "int8" (quantized torch) run them on CPU
+inference_threads = None  # Intra-op threads of CPU inference, None uses the library default (all physical cores)
+inference_interop_threads = 1  # Inter-op threads of CPU inference, requests are already spread over cpu_workers
+inference_check_on_start = False  # Compare CPU backend embeddings with the stock model on sample texts at startup, fall back to torch if they differ
+inference_check_tolerance = 0.99  # Min cosine similarity to the stock model's embeddings
 retrieval_model_name = "HIT-TMG/KaLM-embedding-multilingual-mini-instruct-v1.5"
 embed_dim = 896
+embed_batch_size = 32  # Max number of concurrent queries embedded in one forward pass
+embed_batch_wait_ms = 5  # How long the first query waits for others to join its batch
+query_embedding_cache_size = 4096  # Number of cached query embeddings
+retrieval_cache_size = 2048  # Number of cached top-k search results
 chunk = 1_500
 chunk_overlap = 300
 top_k = 10
+ann_min_vectors = 20_000  # Storages with more chunks are moved from exact search to an ANN index in the background
+ann_index_type = "hnsw"  # ANN index for large storages: "hnsw" or "ivf"
+hnsw_m = 32
+hnsw_ef_construction = 200
+hnsw_ef_search = 128
+ivf_nprobe = 16
+ann_max_deleted_share = 0.2  # Deleted chunks stay in HNSW/IVF indexes as tombstones, the index is rebuilt in the background past this share
+compact_vectors = None  # Opt-in compact storage for large storages: "sq8", "fp16" or "pq" codes with exact rescoring, None keeps float32 only
+compact_dim = None  # Keep only this many leading dimensions in the compact codes, None keeps embed_dim
+compact_pq_m = 32  # Sub-quantizers of "pq" codes, must divide the compact dimension
+compact_min_vectors = 10_000  # Storages are moved to compact codes from this size (takes precedence over ANN), codes are trained on their vectors
+compact_rescore_factor = 8  # Candidates per requested result found with compact codes and rescored with exact vectors
 add_relative_queries = False  # Expand user's query with LLM-generated relative queries
 relative_top_k = 3
+fusion_strategy = "rrf"  # How results of expanded queries are merged: "rrf" (reciprocal rank fusion) or "max"
+rrf_k = 60
 use_reranking = False
 rerank_model_name = "BAAI/bge-reranker-v2-m3"
 rerank_top_k = 10
+rerank_batch_size = 16  # Pairs scored per forward pass of the reranker
+rerank_cache_size = 8192  # Number of cached (query, chunk) scores
+use_answer_cache = False  # Reuse answers to similar questions over the same retrieved chunks
+answer_cache_threshold = 0.95  # Min cosine similarity between queries for a cache hit
+answer_cache_ttl = 24 * 3600  # Seconds
+answer_cache_size = 1024
@@ -0,0 +1,86 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional
+
+import numpy as np
+
+from config import answer_cache_threshold, answer_cache_ttl, answer_cache_size
+
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers looked up by query similarity.
+    Entries are grouped by user, index version, language and the set of retrieved chunk ids,
+    so a hit requires exactly the same context. Within a group the cached query whose embedding
+    has the highest cosine similarity above `threshold` wins.
+    Entries expire after `ttl` seconds, and the number of entries is bounded by `max_size`.
+    """
+    def __init__(self, threshold: float = answer_cache_threshold, ttl: float = answer_cache_ttl, max_size: int = answer_cache_size):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._groups: OrderedDict[tuple, List[tuple]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def _key(self, user_id: str, version: int, lang: str, chunk_ids: FrozenSet[str]) -> tuple:
+        return str(user_id), version, lang, frozenset(chunk_ids)
+
+
+    def get(self, user_id: str, version: int, lang: str, chunk_ids: FrozenSet[str], embedding: List[float]) -> Optional[str]:
+        """Return a cached answer for a similar query over the same context, if any."""
+        key = self._key(user_id, version, lang, chunk_ids)
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._groups.get(key)
+            if entries:
+                fresh = [entry for entry in entries if now - entry[2] < self.ttl]
+                self._size -= len(entries) - len(fresh)
+                if fresh:
+                    self._groups[key] = fresh
+                else:
+                    del self._groups[key]
+                best_score, best_answer = self.threshold, None
+                for vector, answer, _ in fresh:
+                    score = float(np.dot(vector, query))
+                    if score >= best_score:
+                        best_score, best_answer = score, answer
+                if best_answer is not None:
+                    self._groups.move_to_end(key)
+                    self.hits += 1
+                    return best_answer
+            self.misses += 1
+            return None
+
+
+    def put(self, user_id: str, version: int, lang: str, chunk_ids: FrozenSet[str], embedding: List[float], answer: str) -> None:
+        key = self._key(user_id, version, lang, chunk_ids)
+        with self._lock:
+            self._groups.setdefault(key, []).append((self._normalize(embedding), answer, time.monotonic()))
+            self._groups.move_to_end(key)
+            self._size += 1
+            while self._size > self.max_size and self._groups:
+                oldest_key = next(iter(self._groups))
+                entries = self._groups[oldest_key]
+                if entries:
+                    entries.pop(0)
+                    self._size -= 1
+                if not entries:
+                    del self._groups[oldest_key]
+
+
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': self._size}
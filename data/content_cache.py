@@ -0,0 +1,188 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import (
+    content_cache_path,
+    content_cache_max_bytes,
+    retrieval_model_name,
+    inference_backend,
+    chunk,
+    chunk_overlap,
+)
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+EVICT_TO = 0.9  # Evict down to this share of the budget, so evictions don't run on every insert
+VECTOR_ROW_OVERHEAD = 128  # Rough SQLite cost of one cached vector besides its blob
+
+
+def file_hash(file_path: str) -> str:
+    """SHA-256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+
+@singleton
+class ContentCache:
+    """
+    Content-addressed cache for re-uploaded files, shared by all users.
+    Level 1 maps the hash of an uploaded file to its cleaned Markdown, stored as a file.
+    Level 2 maps the hash of a chunk text, the embedding model, its inference backend and the chunk settings
+    to the chunk's vector, as quantized and ONNX backends give slightly different vectors.
+    Both levels share one size budget and are evicted least recently used first.
+    """
+    def __init__(self, cache_dir: str = content_cache_path, max_bytes: int = content_cache_max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats_counters = {'markdown_hits': 0, 'markdown_misses': 0, 'vector_hits': 0, 'vector_misses': 0, 'evictions': 0}
+        os.makedirs(os.path.join(cache_dir, 'md'), exist_ok=True)
+        self._init_db(os.path.join(cache_dir, 'content_cache.db'))
+        self.logger = setup_logging('ContentCache')
+
+
+    def _init_db(self, db_path: str):
+        """Initialize SQLite database with markdown and vector tables."""
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS markdown (
+                    file_hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS vectors (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_markdown_used ON markdown (last_used)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_used ON vectors (last_used)")
+            self._total_bytes = self.conn.execute(
+                "SELECT (SELECT COALESCE(SUM(size), 0) FROM markdown) + (SELECT COALESCE(SUM(size), 0) FROM vectors)"
+            ).fetchone()[0]
+
+
+    def _markdown_path(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, 'md', f'{file_hash}.md')
+
+
+    def copy_markdown(self, file_hash: str, md_file: str) -> bool:
+        """
+        Copy cached cleaned Markdown for a file hash to `md_file`.
+        The copy is made under the cache lock, so a concurrent eviction can't remove the file halfway.
+        Returns:
+            Whether the Markdown was cached.
+        """
+        path = self._markdown_path(file_hash)
+        with self.lock, self.conn:
+            updated = self.conn.execute(
+                "UPDATE markdown SET last_used = ? WHERE file_hash = ?", (time.time(), file_hash)
+            ).rowcount
+            if updated:
+                try:
+                    shutil.copyfile(path, md_file)
+                except FileNotFoundError:
+                    self._total_bytes -= self.conn.execute("SELECT size FROM markdown WHERE file_hash = ?", (file_hash,)).fetchone()[0]
+                    self.conn.execute("DELETE FROM markdown WHERE file_hash = ?", (file_hash,))
+                    updated = 0
+            self.stats_counters['markdown_hits' if updated else 'markdown_misses'] += 1
+        return bool(updated)
+
+
+    def put_markdown(self, file_hash: str, md_file: str) -> None:
+        """Copy cleaned Markdown of a file into the cache."""
+        path = self._markdown_path(file_hash)
+        shutil.copyfile(md_file, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+        size = os.path.getsize(path)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT size FROM markdown WHERE file_hash = ?", (file_hash,)).fetchone()
+            self._total_bytes += size - (row[0] if row else 0)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO markdown (file_hash, size, last_used) VALUES (?, ?, ?)", (file_hash, size, time.time())
+            )
+            self._evict()
+
+
+    @staticmethod
+    def vector_key(text: str, backend: str = inference_backend) -> str:
+        key = f"{retrieval_model_name}\0{backend}\0{chunk}\0{chunk_overlap}\0{text}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+    def get_vectors(self, texts: List[str], backend: str = inference_backend) -> List[Optional[List[float]]]:
+        """Return cached vectors of chunk texts embedded with the given backend, None for misses."""
+        keys = [self.vector_key(text, backend) for text in texts]
+        found = dict()
+        with self.lock, self.conn:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ', '.join('?' * len(batch))
+                found.update(self.conn.execute(f"SELECT key, vector FROM vectors WHERE key IN ({placeholders})", batch).fetchall())
+                self.conn.execute(f"UPDATE vectors SET last_used = ? WHERE key IN ({placeholders})", [time.time(), *batch])
+            self.stats_counters['vector_hits'] += sum(key in found for key in keys)
+            self.stats_counters['vector_misses'] += sum(key not in found for key in keys)
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None for key in keys]
+
+
+    def put_vectors(self, texts: List[str], vectors: List[List[float]], backend: str = inference_backend) -> None:
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((self.vector_key(text, backend), blob, len(blob) + VECTOR_ROW_OVERHEAD, time.time()))
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO vectors (key, vector, size, last_used) VALUES (?, ?, ?, ?)", rows)
+            self._total_bytes += (self.conn.total_changes - before) * (rows[0][2] if rows else 0)
+            self._evict()
+
+
+    def _evict(self):
+        """Drop least recently used entries of both levels until the cache fits its budget. Caller holds the lock."""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TO
+        while self._total_bytes > target:
+            rows = self.conn.execute("""
+                SELECT 'markdown', file_hash, size, last_used FROM markdown
+                UNION ALL
+                SELECT 'vectors', key, size, last_used FROM vectors
+                ORDER BY last_used LIMIT 1000
+            """).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                return
+            for table, key, size, _ in rows:
+                if table == 'markdown':
+                    self.conn.execute("DELETE FROM markdown WHERE file_hash = ?", (key,))
+                    if os.path.exists(self._markdown_path(key)):
+                        os.remove(self._markdown_path(key))
+                else:
+                    self.conn.execute("DELETE FROM vectors WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.stats_counters['evictions'] += 1
+                if self._total_bytes <= target:
+                    break
+
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and current size."""
+        with self.lock:
+            return {**self.stats_counters, 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
@@ -1,26 +1,52 @@
 import os
+import time
+import uuid
+import threading
+from itertools import islice
+from typing import Callable, Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
 import torch
-import faiss
+import numpy as np
 from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
 from langchain_community.vectorstores.utils import filter_complex_metadata
 from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_huggingface import HuggingFaceEmbeddings
-from FlagEmbedding import FlagReranker
 
 from config import (
-    embed_model_device,
     retrieval_model_name,
-    rerank_model_name,
     chunk,
     use_reranking,
-    embed_dim,
     embed_db_path,
+    storage_cache_max_bytes,
+    storage_prefetch_users,
+    storage_backend,
+    ingest_embed_batch,
+    use_content_cache,
+    inference_backend,
+    inference_check_on_start,
+    compact_rescore_factor,
+    ann_max_deleted_share,
 )
+from data.content_cache import ContentCache
+from data.embedding_batcher import BatchingEmbeddings
+from data.index_persistence import IndexPersistence, deleted_positions
+from data.index_selection import build_index, choose_index_type, index_kind, search_params
+from data.inference_backend import load_embeddings, load_reranker, check_embeddings, inference_device
+from data.rescore_vectors import RescoreVectors, live_vectors
+from data.retrieval_cache import CachedQueryEmbeddings
+from data.shared_store import SharedIndexStore, SharedUserStorage
+from data.source_catalog import SourceCatalog
+from data.storage_cache import StorageCache, estimate_store_size
+from utils.metrics import Metrics
 from utils.logging_config import setup_logging
 from utils.singleton import singleton
 
 
+def get_index_name() -> str:
+    """Name of the per-user index folder, which depends on the embedding model and chunk size."""
+    return f"faiss-{retrieval_model_name.split('/')[-1]}-{chunk}".lower().replace('.', '')
+
+
 
 @singleton
 class DatabaseManager:
@@ -28,16 +54,41 @@ class DatabaseManager:
     Manages the database operations including storing and retrieving documents. 
     Utilizes FAISS for vector storage and HuggingFaceEmbeddings for generating embeddings. 
     Optionally uses a reranker for improving retrieval quality. 
+    Keeps recently used storages loaded in an LRU cache with a memory budget.
+    Changes are appended to a per-user write-ahead log and folded into snapshots in the background.
+    Sources and their chunk ids are tracked in a catalog, so listing and deletion don't scan storages.
+    Large storages are moved from exact search to an ANN index in the background.
+    With the "shared" storage backend all users are kept in a few sharded indexes instead.
     Implements a singleton pattern to ensure a single instance of the database manager. 
     """
     def __init__(self):
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=retrieval_model_name, 
-            model_kwargs={'device': embed_model_device},
-        )
-        if use_reranking:
-            self.reranker = FlagReranker(rerank_model_name, use_fp16=True, device=embed_model_device)
         self.logger = setup_logging('DatabaseManager')
+        self.backend, self.device = inference_backend, inference_device()
+        self.embeddings = load_embeddings(self.backend)
+        if inference_check_on_start and self.backend != 'torch' and not check_embeddings(self.embeddings):
+            # CPU backends run where there may be no GPU, so fall back to the stock float32 models on CPU
+            self.logger.warning(f"Falling back from the {self.backend} backend to the stock model on CPU, its embeddings don't match.")
+            del self.embeddings
+            self.backend = 'torch'
+            self.embeddings = load_embeddings(self.backend, device=self.device)
+        # Vector storages embed queries through the batcher to share forward passes between users
+        self.batcher = BatchingEmbeddings(self.embeddings)
+        self.query_embeddings = CachedQueryEmbeddings(self.batcher)
+        if use_reranking:
+            self.reranker = load_reranker(self.backend, device=self.device)
+        self.cache = StorageCache(storage_cache_max_bytes)
+        self.persistence = IndexPersistence(self.query_embeddings)
+        self.catalog = SourceCatalog()
+        self.shared = SharedIndexStore() if storage_backend == 'shared' else None
+        self.content_cache = ContentCache() if use_content_cache else None
+        self._user_locks = dict()
+        self._index_versions = dict()
+        self._catalog_synced = set()
+        self._locks_guard = threading.Lock()
+        self._promotion_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index-promotion')
+        self._promoting = set()
+        self._index_stats = {'promotions': 0, 'promotion_seconds': 0.0}
+        self.metrics = Metrics()
     
 
     def _get_user_dir(self, user_id: str) -> str:
@@ -48,88 +99,423 @@ class DatabaseManager:
     
 
     def _get_index(self) -> str:
-        index_name = f"faiss-{retrieval_model_name.split('/')[-1]}-{chunk}".lower().replace('.', '')
-        return index_name
+        return get_index_name()
     
     
-    def get_storage(self, user_id: str):
-        """Create or retrieve storage for a user"""
-        index_name = self._get_index()
-        user_dir = self._get_user_dir(user_id)
-        index_path = os.path.join(user_dir, index_name)
+    def user_lock(self, user_id: str) -> threading.RLock:
+        """Lock that serializes access to one user's storage across executor threads."""
+        with self._locks_guard:
+            return self._user_locks.setdefault(str(user_id), threading.RLock())
+
+
+    def get_index_version(self, user_id: str) -> int:
+        """Version of a user's index, bumped on every change. Used to invalidate cached results."""
+        return self._index_versions.get(str(user_id), 0)
+
+
+    def _bump_index_version(self, user_id: str):
+        with self._locks_guard:
+            self._index_versions[str(user_id)] = self.get_index_version(user_id) + 1
+
+
+    def _get_index_path(self, user_id: str) -> str:
+        return os.path.join(self._get_user_dir(user_id), self._get_index())
+
+
+    def _mark_active(self, user_id: str, used_at: float):
+        """Set the index mtime, which is used to find recently active users, to the last use of the storage."""
+        index_path = os.path.join(embed_db_path, str(user_id), self._get_index())
         if os.path.exists(index_path):
-            return FAISS.load_local(index_path, self.embeddings, allow_dangerous_deserialization=True)
+            os.utime(index_path, (used_at, used_at))
+
+
+    def _cache_storage(self, user_id: str, vector_storage: FAISS, used_at: Optional[float] = None):
+        for evicted_user, evicted_used_at in self.cache.put(user_id, vector_storage, used_at).items():
+            self._mark_active(evicted_user, evicted_used_at)
+
+
+    def _load_storage(self, user_id: str) -> FAISS:
+        index_path = self._get_index_path(user_id)
+        vector_storage = self.persistence.load(index_path)
+
+        catalog_seq = self.catalog.get_seq(user_id)
+        log = self.persistence.get_log(index_path)
+        if catalog_seq < 0:
+            docstore = vector_storage.docstore
+            docs = docstore._dict if isinstance(docstore, InMemoryDocstore) else dict(docstore.items())
+            self.catalog.rebuild(user_id, docs, log.seq)
         else:
-            vector_storage = FAISS(
-                embedding_function=self.embeddings,
-                index=faiss.IndexFlatL2(embed_dim),
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={},
+            self.catalog.sync(user_id, log.replay(after_seq=catalog_seq))
+        self._catalog_synced.add(str(user_id))
+        self._maybe_promote(user_id, vector_storage)
+        return vector_storage
+
+
+    def _maybe_promote(self, user_id: str, vector_storage: FAISS):
+        """Start a background index migration if the storage outgrew its index type or has too many tombstones."""
+        target = choose_index_type(len(vector_storage.index_to_docstore_id))
+        stale = len(deleted_positions(vector_storage)) > ann_max_deleted_share * vector_storage.index.ntotal
+        if not stale and (target == index_kind(vector_storage.index) or target == 'flat'):
+            return
+        with self._locks_guard:
+            if str(user_id) in self._promoting:
+                return
+            self._promoting.add(str(user_id))
+        self._promotion_executor.submit(self._promote_index, user_id, vector_storage)
+
+
+    def _promote_index(self, user_id: str, vector_storage: FAISS):
+        """
+        Build an index from the stored vectors of live chunks and swap it in if the storage didn't change meanwhile.
+        Tombstones of deleted chunks are dropped, so positions of the remaining chunks shift down.
+        """
+        try:
+            with self.user_lock(user_id):
+                version = self.get_index_version(user_id)
+                source_kind = index_kind(vector_storage.index)
+                doc_ids, vectors = live_vectors(vector_storage)
+                target = choose_index_type(len(doc_ids))
+
+            start = time.perf_counter()
+            new_index = build_index(target, vectors)
+            elapsed = time.perf_counter() - start
+
+            with self.user_lock(user_id):
+                if self.get_index_version(user_id) != version:
+                    self.logger.info(f"Storage of user {user_id} changed during index migration, will retry after the next write")
+                    return
+                vector_storage.index = new_index
+                vector_storage.index_to_docstore_id = dict(enumerate(doc_ids))
+                vector_storage.index_mmapped = False
+                vector_storage.rescore_vectors = RescoreVectors(vectors) if target == 'compact' else None
+                self._bump_index_version(user_id)
+                if user_id in self.cache:
+                    self._cache_storage(user_id, vector_storage)
+            self._schedule_snapshot(user_id, self._get_index_path(user_id), vector_storage)
+
+            with self._locks_guard:
+                self._index_stats['promotions'] += 1
+                self._index_stats['promotion_seconds'] += elapsed
+            self.logger.info(
+                f"Migrated storage of user {user_id} from {source_kind} to {target} index "
+                f"({len(vectors)} vectors, {elapsed:.1f}s)"
             )
-            vector_storage.save_local(index_path)
+        except Exception as e:
+            self.logger.exception(f"Failed to migrate index of user {user_id}: {e}")
+        finally:
+            with self._locks_guard:
+                self._promoting.discard(str(user_id))
 
-            return vector_storage
 
+    def _schedule_snapshot(self, user_id: str, index_path: str, vector_storage: FAISS):
+        def refresh_cache():
+            if user_id in self.cache:
+                self._cache_storage(user_id, vector_storage)
+        self.persistence.schedule(index_path, vector_storage, self.user_lock(user_id), on_compacted=refresh_cache)
 
-    def add_docs(self, chunks: list[Document], user_id: str):
-        """Add embeddings to user's storage"""
-        self.logger.debug(f"Looking for vector storage for user {user_id}")
-        vector_storage = self.get_storage(user_id)
-        self.logger.debug(f"Created/found vector storage for user {user_id}")
 
-        self.embeddings.model_kwargs['device'] = embed_model_device
+    def _sync_catalog(self, user_id: str):
+        """
+        Make sure user's catalog exists and contains all logged changes. The log is read once per user
+        and run (or when the storage is loaded), later changes update the catalog as they are logged.
+        """
+        if str(user_id) in self._catalog_synced:
+            return
+        if self.catalog.get_seq(user_id) < 0:
+            self.get_storage(user_id)  # Builds the catalog from the storage
+            return
+        with self.user_lock(user_id):
+            log = self.persistence.get_log(self._get_index_path(user_id))
+            if log.size():  # Changes logged before a crash may be missing from the catalog
+                self.catalog.sync(user_id, log.replay(after_seq=self.catalog.get_seq(user_id)))
+            self._catalog_synced.add(str(user_id))
+
+
+    def get_storage(self, user_id: str):
+        """Create or retrieve storage for a user"""
+        if self.shared is not None:
+            return SharedUserStorage(self.shared, user_id, self.query_embeddings)
+        vector_storage = self.cache.get(user_id)
+        if vector_storage is None:
+            with self.user_lock(user_id):
+                if user_id in self.cache:  # Loaded by another thread while we waited for the lock
+                    return self.cache.get(user_id)
+                vector_storage = self._load_storage(user_id)
+                self._cache_storage(user_id, vector_storage)
+                self._mark_active(user_id, time.time())  # Kept if the process stops before the storage is evicted
+        return vector_storage
+
+
+    def prefetch_recent_users(self, limit: int = storage_prefetch_users) -> int:
+        """
+        Load storages of the most recently active users into the cache.
+        Args:
+            limit: Maximum number of users to load.
+        Returns:
+            Number of loaded storages.
+        """
+        if self.shared is not None or not os.path.isdir(embed_db_path):
+            return 0  # Shared indexes are loaded on start
+        index_name = self._get_index()
+        candidates = []
+        for user_id in os.listdir(embed_db_path):
+            index_path = os.path.join(embed_db_path, user_id, index_name)
+            if os.path.isdir(index_path):
+                candidates.append((os.path.getmtime(index_path), user_id))
+
+        loaded = 0
+        for used_at, user_id in sorted(candidates, reverse=True)[:limit]:
+            with self.user_lock(user_id):
+                if user_id in self.cache:
+                    continue
+                vector_storage = self._load_storage(user_id)
+                if not self.cache.has_room(estimate_store_size(vector_storage)):
+                    break
+                self._cache_storage(user_id, vector_storage, used_at)  # Prefetching is not a use
+            loaded += 1
+
+        self.logger.info(f"Prefetched {loaded} vector storages, cache stats: {self.cache.stats()}")
+        return loaded
+
+
+    def cache_stats(self) -> dict:
+        """Return hit/miss/eviction counters of the storage cache."""
+        return self.cache.stats()
+
+
+    def index_stats(self) -> dict:
+        """Return counters of background index migrations."""
+        with self._locks_guard:
+            return dict(self._index_stats)
+
+
+    def embedding_stats(self) -> dict:
+        """Return batch fill metrics of the query embedding batcher."""
+        return {**self.batcher.stats(), 'cache': self.query_embeddings.stats()}
+
+
+    def _embed_chunks(self, texts: list[str]) -> tuple[list[list[float]], int]:
+        """
+        Embed chunk texts, reusing vectors from the content cache.
+        Returns:
+            Vectors of the texts and number of vectors taken from the cache.
+        """
+        if self.content_cache is None:
+            with self.metrics.timer('embed_documents'):
+                return self.embeddings.embed_documents(texts), 0
+        vectors = self.content_cache.get_vectors(texts, self.backend)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            with self.metrics.timer('embed_documents'):
+                new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            self.content_cache.put_vectors([texts[i] for i in missing], new_vectors, self.backend)
+        return vectors, len(texts) - len(missing)
+
+
+    def _release_device_memory(self):
+        """Free cached GPU memory after ingestion. CPU backends have nothing to release."""
+        self.embeddings.model_kwargs['device'] = 'cpu'
+        if self.device.startswith('cuda'):
+            torch.cuda.empty_cache()
+
+
+    def _append_chunks(self, user_id: str, ids: list[str], texts: list[str], metadatas: list[dict], vectors: list[list[float]]) -> list[str]:
+        """
+        Log and apply one batch of embedded chunks under the given docstore ids.
+        Returns:
+            Docstore ids of the added chunks.
+        """
+        record = {
+            'op': 'add',
+            'ids': ids,
+            'texts': texts,
+            'metadatas': metadatas,
+            'vectors': vectors,
+            'time': time.time(),
+        }
+        if self.shared is not None:
+            with self.user_lock(user_id):
+                self._bump_index_version(user_id)
+                self.shared.add(user_id, record['ids'], texts, metadatas, vectors)
+            return record['ids']
+
+        index_path = self._get_index_path(user_id)
+        with self.user_lock(user_id):
+            vector_storage = self.get_storage(user_id)
+            self._bump_index_version(user_id)
+            seq = self.persistence.append(index_path, vector_storage, record)
+            self.catalog.apply(user_id, record, seq)
+            self._cache_storage(user_id, vector_storage)
+        self._schedule_snapshot(user_id, index_path, vector_storage)
+        return record['ids']
+
+
+    def _delete_chunks(self, user_id: str, ids: list[str]):
+        """Log and apply the deletion of chunks by docstore id."""
+        if self.shared is not None:
+            with self.user_lock(user_id):
+                self._bump_index_version(user_id)
+                self.shared.delete(user_id, ids)
+            return
+
+        index_path = self._get_index_path(user_id)
+        with self.user_lock(user_id):
+            vector_storage = self.get_storage(user_id)
+            self._bump_index_version(user_id)
+            record = {'op': 'delete', 'ids': ids}
+            seq = self.persistence.append(index_path, vector_storage, record)
+            self.catalog.apply(user_id, record, seq)
+            self._cache_storage(user_id, vector_storage)
+        self._schedule_snapshot(user_id, index_path, vector_storage)
+        self._maybe_promote(user_id, vector_storage)
+
+
+    def delete_chunks(self, ids: list[str], user_id: str):
+        """Delete user's chunks by docstore id, ids that are not stored are skipped."""
+        if self.shared is None:
+            self._sync_catalog(user_id)
+            stored = set(self.catalog.filter_chunk_ids(user_id, ids))
+            ids = [chunk_id for chunk_id in ids if chunk_id in stored]
+        if ids:
+            self._delete_chunks(user_id, ids)
+            self.logger.info(f"Deleted {len(ids)} chunks from {user_id}'s storage.")
+
+
+    def add_docs(
+            self,
+            chunks: Iterable[Document],
+            user_id: str,
+            progress_callback: Optional[Callable[[int, int], None]] = None,
+            on_batch: Optional[Callable[[list[str]], None]] = None,
+        ):
+        """
+        Add embeddings to user's storage.
+        Chunks may come from a generator, they are embedded in batches of `ingest_embed_batch`
+        as they arrive and every batch is logged as its own record, so memory doesn't grow with
+        the document. If a batch fails, the batches added before it are deleted again and
+        the error is raised, except for a ValueError of an unusable document, which returns None.
+        For a list of chunks `progress_callback(done, total)` is called after each batch.
+        `on_batch(ids)` is called with the docstore ids of each batch before it is logged,
+        so that chunks of an interrupted ingestion can be found and deleted.
+        """
+        self.embeddings.model_kwargs['device'] = self.device
+        total = len(chunks) if hasattr(chunks, '__len__') else None
+        chunks = iter(chunks)
+        added_ids = []
+        cached_chunks = 0
         try:
-            vector_storage.add_documents(documents=filter_complex_metadata(chunks))
-        except ValueError as e:
+            while True:
+                with self.metrics.timer('split'):  # Chunks are cleaned and split as they are pulled from the stream
+                    batch = filter_complex_metadata(list(islice(chunks, ingest_embed_batch)))
+                if not batch:
+                    break
+                texts = [doc.page_content for doc in batch]
+                vectors, batch_cached = self._embed_chunks(texts)
+                cached_chunks += batch_cached
+                ids = [str(uuid.uuid4()) for _ in texts]
+                if on_batch is not None:
+                    on_batch(ids)
+                added_ids += self._append_chunks(user_id, ids, texts, [doc.metadata for doc in batch], vectors)
+                if progress_callback is not None and total:
+                    progress_callback(len(added_ids), total)
+        except Exception as e:
             self.logger.error(f"Failed to add document to database: {e}")
-            return
+            if added_ids:
+                self._delete_chunks(user_id, added_ids)
+            if isinstance(e, ValueError):
+                return
+            raise
+        finally:
+            self._release_device_memory()
         # TODO: check that there is always a source in the chunk
-        
-        user_dir = self._get_user_dir(user_id)
-        index_path = os.path.join(user_dir, self._get_index())
-        vector_storage.save_local(index_path)
-        self.embeddings.model_kwargs['device'] = 'cpu'
-        torch.cuda.empty_cache()
 
-        self.logger.info(f"Added {len(chunks)} items to {user_id}'s storage.")
+        if not added_ids:
+            self.logger.warning(f"No chunks to add to {user_id}'s storage.")
+            return
+        if self.content_cache is not None:
+            self.logger.info(f"{cached_chunks} of {len(added_ids)} chunks for {user_id} served from the embedding cache.")
+        if self.shared is None:
+            self._maybe_promote(user_id, self.get_storage(user_id))
+
+        self.logger.info(f"Added {len(added_ids)} items to {user_id}'s storage.")
         return True
 
 
-    def get_users_docs(self, user_id: str):
-        """Retrieves all documents for a given user from the database"""
-        self.logger.debug(f"Looking for vector storage for user {user_id}")
+    def flush(self):
+        """Write snapshots of all storages with logged changes and record the last use of cached storages."""
+        self.persistence.flush()
+        for user_id, used_at in self.cache.last_used().items():
+            self._mark_active(user_id, used_at)
+        if self.shared is not None:
+            self.shared.flush()
+
+
+    def search_by_vectors(self, user_id: str, vectors: list[list[float]], k: int) -> list[list[tuple[Document, float]]]:
+        """
+        Search user's storage with several query vectors in one FAISS call.
+        Returns:
+            For each query, up to k (Document, L2 distance) pairs ordered by distance.
+        """
+        if self.shared is not None:
+            return self.shared.search(user_id, vectors, k)
         vector_storage = self.get_storage(user_id)
-        self.logger.debug(f"Created/found vector storage for user {user_id}")
+        queries = np.asarray(vectors, dtype=np.float32)
+        with self.user_lock(user_id):
+            rescore_vectors = getattr(vector_storage, 'rescore_vectors', None)
+            deleted = deleted_positions(vector_storage)
+            if rescore_vectors is not None:
+                _, candidates = vector_storage.index.search(queries, k * compact_rescore_factor)
+                distances, indices = rescore_vectors.rescore(queries, candidates, k)
+            elif len(deleted):
+                distances, indices = vector_storage.index.search(queries, k, params=search_params(vector_storage.index, deleted))
+            else:
+                distances, indices = vector_storage.index.search(queries, k)
+            hits = [
+                [(vector_storage.index_to_docstore_id[i], float(distance)) for distance, i in zip(row_distances, row_indices) if i != -1]
+                for row_distances, row_indices in zip(distances, indices)
+            ]
+            doc_ids = list({doc_id for row in hits for doc_id, _ in row})
+            docstore = vector_storage.docstore
+            if hasattr(docstore, 'search_many'):
+                docs = docstore.search_many(doc_ids)  # Fetch only the hits from the off-heap docstore
+            else:
+                docs = {doc_id: docstore.search(doc_id) for doc_id in doc_ids}
+        return [[(docs[doc_id], distance) for doc_id, distance in row] for row in hits]
 
-        all_data = list(vector_storage.docstore._dict.values())
-        all_sources = set(data.metadata['source'] for data in all_data if "source" in data.metadata)
-        all_sources = sorted(all_sources)
 
+    def get_users_docs(self, user_id: str):
+        """Retrieves names of all user's sources from the catalog"""
+        if self.shared is not None:
+            all_sources = self.shared.list_sources(user_id)
+        else:
+            self._sync_catalog(user_id)
+            all_sources = self.catalog.list_sources(user_id)
         self.logger.debug(f"Found {len(all_sources)} saved sources for user {user_id}")
         return all_sources
 
 
     def delete_doc(self, source: str, user_id: str):
         """Delete documents from user's storage that match the given source name"""
-        vector_storage = self.get_storage(user_id)
-        all_data = vector_storage.docstore._dict
-        src_dict = dict()
-        for k, v in all_data.items():
-            if "source" in v.metadata:
-                src_dict[k] = v.metadata['source']
-
-        ids_to_delete = [
-            doc_id for doc_id, src in src_dict.items() if src.startswith(source)
-        ]
-
-        if not ids_to_delete:
-            self.logger.info(f"No documents found with source '{source}' for user {user_id}.")
+        if self.shared is not None:
+            with self.user_lock(user_id):
+                ids_to_delete = self.shared.get_chunk_ids(user_id, source)
+                if not ids_to_delete:
+                    self.logger.info(f"No documents found with source '{source}' for user {user_id}.")
+                    return
+                self._delete_chunks(user_id, ids_to_delete)
+            self.logger.info(f"Deleted {len(ids_to_delete)} documents with source '{source}' from {user_id}'s storage.")
             return
 
-        vector_storage.delete(ids=ids_to_delete)
-        user_dir = self._get_user_dir(user_id)
-        index_path = os.path.join(user_dir, self._get_index())
-        vector_storage.save_local(index_path)
+        self._sync_catalog(user_id)
+        with self.user_lock(user_id):
+            ids_to_delete = self.catalog.get_chunk_ids(user_id, source)
+            if not ids_to_delete:
+                self.logger.info(f"No documents found with source '{source}' for user {user_id}.")
+                return
+
+            self._delete_chunks(user_id, ids_to_delete)
         # TODO: also delete *.md files if exist
 
         self.logger.info(f"Deleted {len(ids_to_delete)} documents with source '{source}' from {user_id}'s storage.")
@@ -0,0 +1,108 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from config import embed_batch_size, embed_batch_wait_ms
+from utils.logging_config import setup_logging
+
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that groups concurrent query embeddings into one model forward pass.
+    Callers of `embed_query` block until a dispatcher thread has embedded their query
+    together with all other queries that arrived within `max_wait_ms` (up to `max_batch_size`).
+    Document embeddings are passed to the wrapped model as is, since they are already batched.
+    Queries are embedded with `embed_documents` of the wrapped model, so it must not use
+    separate query encode kwargs.
+    """
+    def __init__(self, base: Embeddings, max_batch_size: int = embed_batch_size, max_wait_ms: float = embed_batch_wait_ms):
+        self.base = base
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.batch_sizes = Counter()
+        self.logger = setup_logging('BatchingEmbeddings')
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+
+    def submit(self, text: str) -> Future:
+        """Queue a query for the next batch and return a future for its vector."""
+        self._ensure_dispatcher()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None:
+            with self._start_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._run, name='embed-batcher', daemon=True)
+                    self._dispatcher.start()
+
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.base.embed_documents(texts)
+            except Exception as e:
+                self.logger.exception(f"Failed to embed batch of {len(texts)} queries: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.batch_sizes[len(batch)] += 1
+            self.logger.debug(f"Embedded batch of {len(batch)} queries")
+
+
+    def stats(self) -> Dict:
+        """Return batch counters, average batch fill and the batch size histogram."""
+        with self._stats_lock:
+            avg_size = self.requests / self.batches if self.batches else 0.0
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'avg_batch_size': avg_size,
+                'avg_batch_fill': avg_size / self.max_batch_size,
+                'batch_sizes': dict(self.batch_sizes),
+            }
@@ -0,0 +1,91 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+from typing import Iterator
+
+from utils.logging_config import setup_logging
+
+
+HEADER = struct.Struct('<II')  # payload length, crc32 of payload
+
+
+class IndexLog:
+    """
+    Append-only write-ahead log of changes to one user's index.
+    Every record is a delta segment (`{'op': 'add', 'ids', 'texts', 'metadatas', 'vectors'}`)
+    or a tombstone (`{'op': 'delete', 'ids'}`) tagged with an increasing sequence number.
+    Records are fsynced before the change is applied in memory, so the log can be
+    replayed on top of the last snapshot after a crash.
+    """
+    def __init__(self, path: str, start_seq: int = 0):
+        self.path = path
+        self.seq = start_seq
+        self._lock = threading.Lock()
+        self.logger = setup_logging('IndexLog')
+
+
+    def append(self, record: dict) -> int:
+        """Durably append a record and return its sequence number."""
+        with self._lock:
+            self.seq += 1
+            payload = pickle.dumps({**record, 'seq': self.seq})
+            with open(self.path, 'ab') as f:
+                f.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            return self.seq
+
+
+    def replay(self, after_seq: int = 0) -> Iterator[dict]:
+        """
+        Yield records newer than `after_seq` in order.
+        A torn record at the end of the log (crash during append) is cut off.
+        """
+        with self._lock:
+            records, valid_size = self._read()
+            if os.path.exists(self.path) and valid_size < os.path.getsize(self.path):
+                self.logger.warning(f"Truncating torn tail of {self.path} at {valid_size} bytes")
+                with open(self.path, 'r+b') as f:
+                    f.truncate(valid_size)
+            if records:
+                self.seq = max(self.seq, records[-1]['seq'])
+        for record in records:
+            if record['seq'] > after_seq:
+                yield record
+
+
+    def truncate(self, upto_seq: int) -> None:
+        """Drop records already contained in a snapshot, keeping newer ones."""
+        with self._lock:
+            records, _ = self._read()
+            kept = [record for record in records if record['seq'] > upto_seq]
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                for record in kept:
+                    payload = pickle.dumps(record)
+                    f.write(HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+
+    def _read(self) -> tuple[list[dict], int]:
+        records, offset = [], 0
+        if not os.path.exists(self.path):
+            return records, offset
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        while offset + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, offset)
+            payload = data[offset + HEADER.size:offset + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            records.append(pickle.loads(payload))
+            offset += HEADER.size + length
+        return records, offset
@@ -0,0 +1,339 @@
+import os
+import json
+import pickle
+import shutil
+import threading
+from typing import Callable, Dict, Optional
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+from config import embed_dim, index_save_delay, index_log_compact_bytes, storage_mode
+from data.index_log import IndexLog
+from data.index_selection import build_index, configure_index, index_kind, reconstruct_all
+from data.rescore_vectors import VECTORS_FILE, MappedFlatIndex, RescoreVectors
+from data.sqlite_docstore import SQLiteDocstore
+from utils.logging_config import setup_logging
+
+
+SNAPSHOT_META = 'snapshot.json'
+
+
+def deleted_positions(vector_storage: FAISS) -> np.ndarray:
+    """
+    Positions of vectors deleted from an ANN index, which keeps them as tombstones until it is rebuilt.
+    Deleted positions have no docstore id, so they are recomputed when the counts don't add up.
+    """
+    deleted = getattr(vector_storage, 'deleted_positions', None)
+    if deleted is None or len(deleted) + len(vector_storage.index_to_docstore_id) != vector_storage.index.ntotal:
+        live = np.fromiter(vector_storage.index_to_docstore_id, dtype=np.int64, count=len(vector_storage.index_to_docstore_id))
+        deleted = np.setdiff1d(np.arange(vector_storage.index.ntotal, dtype=np.int64), live)
+        vector_storage.deleted_positions = deleted
+    return deleted
+
+
+def apply_record(vector_storage: FAISS, record: dict) -> None:
+    """Apply a delta segment or a tombstone record to a loaded storage."""
+    rescore_vectors = getattr(vector_storage, 'rescore_vectors', None)
+    if record['op'] == 'add':
+        # New vectors go after the tombstones of deleted ones, so positions are taken from the index
+        start = vector_storage.index.ntotal
+        vector_storage.index.add(np.asarray(record['vectors'], dtype=np.float32))
+        vector_storage.docstore.add({
+            doc_id: Document(id=doc_id, page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(record['ids'], record['texts'], record['metadatas'])
+        })
+        vector_storage.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(record['ids'])})
+        if rescore_vectors is not None:
+            rescore_vectors.add(record['vectors'])
+    elif record['op'] == 'delete':
+        existing = set(vector_storage.index_to_docstore_id.values())
+        ids = [doc_id for doc_id in record['ids'] if doc_id in existing]
+        if not ids:
+            return
+        deleted = set(ids)
+        positions = [i for i, doc_id in vector_storage.index_to_docstore_id.items() if doc_id in deleted]
+        if index_kind(vector_storage.index) in ('hnsw', 'ivf'):
+            # ANN indexes can't remove vectors with shifting positions, as the docstore mapping expects.
+            # Their vectors are left as tombstones skipped by searches, until the index is rebuilt.
+            for position in positions:
+                del vector_storage.index_to_docstore_id[position]
+            vector_storage.docstore.delete(ids)
+            return
+        vector_storage.delete(ids=ids)
+        if rescore_vectors is not None:
+            rescore_vectors.remove(positions)
+    else:
+        raise ValueError(f"Unknown index log record: {record['op']}")
+
+
+def is_mapped(index: faiss.Index) -> bool:
+    """Whether an index keeps its vectors in the snapshot files. FAISS maps only IVF inverted lists with IO_FLAG_MMAP."""
+    if isinstance(index, MappedFlatIndex):
+        return True
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf is not None and isinstance(faiss.downcast_InvertedLists(ivf.invlists), faiss.OnDiskInvertedLists)
+
+
+
+class IndexPersistence:
+    """
+    Append-only persistence for per-user FAISS storages.
+    A storage on disk is the last snapshot (`save_local` folder with the sequence number
+    of the last included change) plus a write-ahead log of newer changes. Writes only
+    append to the log; snapshots are rewritten in the background once a user has been
+    idle for `save_delay` seconds or the log grows over `compact_bytes`, which folds
+    the log into a new snapshot. Loading replays the log on top of the snapshot.
+    In "mmap" mode chunk texts live in a SQLiteDocstore next to the snapshot. Flat indexes are saved
+    as `vectors.npy` and searched through a MappedFlatIndex, other indexes are read with IO_FLAG_MMAP:
+    FAISS maps the inverted lists of IVF indexes (read back into memory on their first change),
+    HNSW indexes are read into memory.
+    Snapshots of compact indexes also keep the exact vectors for rescoring in `vectors.npy`,
+    which is memory-mapped in both modes.
+    """
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            save_delay: float = index_save_delay,
+            compact_bytes: int = index_log_compact_bytes,
+            mode: str = storage_mode,
+        ):
+        if mode not in ('memory', 'mmap'):
+            raise ValueError(f"Unknown storage mode '{mode}', expected 'memory' or 'mmap'")
+        self.embeddings = embeddings
+        self.save_delay = save_delay
+        self.compact_bytes = compact_bytes
+        self.mode = mode
+        self._logs: Dict[str, IndexLog] = dict()
+        self._timers: Dict[str, threading.Timer] = dict()
+        self._pending: Dict[str, tuple] = dict()
+        self._guard = threading.Lock()
+        self.logger = setup_logging('IndexPersistence')
+
+
+    def get_log(self, index_path: str, start_seq: int = 0) -> IndexLog:
+        with self._guard:
+            log = self._logs.get(index_path)
+            if log is None:
+                log = self._logs[index_path] = IndexLog(f'{index_path}.wal', start_seq)
+            log.seq = max(log.seq, start_seq)
+            return log
+
+
+    def _read_snapshot_seq(self, index_path: str) -> int:
+        meta_path = os.path.join(index_path, SNAPSHOT_META)
+        if not os.path.exists(meta_path):
+            return 0
+        with open(meta_path) as f:
+            return json.load(f)['seq']
+
+
+    def _recover_snapshot(self, index_path: str) -> None:
+        """Finish or roll back a snapshot swap interrupted by a crash."""
+        tmp_path, old_path = f'{index_path}.tmp', f'{index_path}.old'
+        if not os.path.exists(index_path):
+            if os.path.exists(os.path.join(tmp_path, SNAPSHOT_META)):
+                os.replace(tmp_path, index_path)
+            elif os.path.exists(old_path):
+                os.replace(old_path, index_path)
+        for path in (tmp_path, old_path):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+
+    def _new_storage(self, index_path: str) -> FAISS:
+        if self.mode == 'mmap':
+            docstore = SQLiteDocstore(f'{index_path}.docs.db')
+        else:
+            docstore = InMemoryDocstore()
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=faiss.IndexFlatL2(embed_dim),
+            docstore=docstore,
+            index_to_docstore_id={},
+        )
+
+
+    def _map_index(self, index_path: str, vector_storage: FAISS, index: Optional[faiss.Index] = None) -> None:
+        """Replace the index of a storage with the mapped snapshot vectors or the snapshot index read with IO_FLAG_MMAP."""
+        faiss_path = os.path.join(index_path, 'index.faiss')
+        if not os.path.exists(faiss_path):
+            index = MappedFlatIndex(RescoreVectors.load(os.path.join(index_path, VECTORS_FILE)))
+        elif index is None:
+            index = faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP)
+        vector_storage.index = configure_index(index)
+        vector_storage.index_mmapped = is_mapped(index)
+
+
+    def _make_writable(self, index_path: str, vector_storage: FAISS) -> None:
+        """
+        Read a mapped IVF index into memory before it changes, mapped inverted lists are read-only.
+        A MappedFlatIndex keeps changes in memory until the next snapshot.
+        """
+        if getattr(vector_storage, 'index_mmapped', False) and not isinstance(vector_storage.index, MappedFlatIndex):
+            vector_storage.index = configure_index(faiss.read_index(os.path.join(index_path, 'index.faiss')))
+            vector_storage.index_mmapped = False
+
+
+    def _map_rescore_vectors(self, index_path: str, vector_storage: FAISS) -> None:
+        """Map exact vectors of a compact index from the snapshot, dropping the in-memory copy."""
+        vectors_path = os.path.join(index_path, VECTORS_FILE)
+        if os.path.exists(vectors_path) and os.path.exists(os.path.join(index_path, 'index.faiss')):
+            vector_storage.rescore_vectors = RescoreVectors.load(vectors_path)
+
+
+    def _load_snapshot(self, index_path: str) -> FAISS:
+        faiss_path = os.path.join(index_path, 'index.faiss')
+        if self.mode == 'memory' and os.path.exists(faiss_path):
+            vector_storage = FAISS.load_local(index_path, self.embeddings, allow_dangerous_deserialization=True)
+            configure_index(vector_storage.index)
+            self._map_rescore_vectors(index_path, vector_storage)
+            return vector_storage
+
+        with open(os.path.join(index_path, 'index.pkl'), 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        vector_storage = FAISS(self.embeddings, None, docstore, index_to_docstore_id)
+        if self.mode == 'memory':
+            # Flat storage saved in "mmap" mode
+            vector_storage.index = build_index('flat', np.load(os.path.join(index_path, VECTORS_FILE)))
+            return vector_storage
+
+        index = faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP) if os.path.exists(faiss_path) else None
+        if isinstance(docstore, InMemoryDocstore) or (index is not None and index_kind(index) == 'flat'):
+            # Storage saved in "memory" mode or before flat indexes were mapped, move it off the heap once
+            if isinstance(docstore, InMemoryDocstore):
+                vector_storage.docstore = SQLiteDocstore(f'{index_path}.docs.db')
+                vector_storage.docstore.add(docstore._dict)
+            vector_storage.index = faiss.read_index(faiss_path) if is_mapped(index) else index
+            self._map_rescore_vectors(index_path, vector_storage)
+            self._write_snapshot(index_path, vector_storage, self._read_snapshot_seq(index_path))
+            index = None
+        self._map_index(index_path, vector_storage, index)
+        self._map_rescore_vectors(index_path, vector_storage)
+        return vector_storage
+
+
+    def load(self, index_path: str) -> FAISS:
+        """Load the last snapshot of a storage (or create an empty one) and replay newer log records."""
+        self._recover_snapshot(index_path)
+        if os.path.exists(index_path):
+            vector_storage = self._load_snapshot(index_path)
+        else:
+            vector_storage = self._new_storage(index_path)
+            self._write_snapshot(index_path, vector_storage, seq=0)
+
+        snapshot_seq = self._read_snapshot_seq(index_path)
+        log = self.get_log(index_path, snapshot_seq)
+        replayed = 0
+        for record in log.replay(after_seq=snapshot_seq):
+            if record['op'] == 'add':  # Deletes leave ANN indexes unchanged
+                self._make_writable(index_path, vector_storage)
+            apply_record(vector_storage, record)
+            replayed += 1
+        if replayed:
+            self.logger.info(f"Replayed {replayed} log records on top of snapshot {index_path}")
+        return vector_storage
+
+
+    def append(self, index_path: str, vector_storage: FAISS, record: dict) -> int:
+        """
+        Durably log a change and apply it to the loaded storage. Caller holds the user's lock.
+        Returns:
+            Sequence number of the log record.
+        """
+        if record['op'] == 'add':
+            record = {**record, 'vectors': np.asarray(record['vectors'], dtype=np.float32)}
+        seq = self.get_log(index_path).append(record)
+        if record['op'] == 'add':
+            self._make_writable(index_path, vector_storage)
+        apply_record(vector_storage, record)
+        return seq
+
+
+    def schedule(self, index_path: str, vector_storage: FAISS, lock: Callable, on_compacted: Optional[Callable] = None) -> None:
+        """
+        Debounce a background snapshot of the storage, or start it now if the log is large.
+        Args:
+            lock: User's lock held while the snapshot is written.
+            on_compacted: Called after the snapshot is written, e.g. to update cache accounting.
+        """
+        log = self.get_log(index_path)
+        delay = 0 if log.size() >= self.compact_bytes else self.save_delay
+        with self._guard:
+            timer = self._timers.pop(index_path, None)
+            if timer is not None:
+                timer.cancel()
+            self._pending[index_path] = (vector_storage, lock, on_compacted)
+            timer = threading.Timer(delay, self.compact, args=(index_path,))
+            timer.daemon = True
+            self._timers[index_path] = timer
+            timer.start()
+
+
+    def compact(self, index_path: str) -> None:
+        """Write a new snapshot with all logged changes and drop them from the log."""
+        with self._guard:
+            self._timers.pop(index_path, None)
+            pending = self._pending.pop(index_path, None)
+        if pending is None:
+            return
+        vector_storage, lock, on_compacted = pending
+        log = self.get_log(index_path)
+        try:
+            with lock:
+                seq = log.seq
+                self._write_snapshot(index_path, vector_storage, seq)
+                if self.mode == 'mmap':
+                    self._map_index(index_path, vector_storage)
+                self._map_rescore_vectors(index_path, vector_storage)
+            log.truncate(upto_seq=seq)
+            self.logger.debug(f"Compacted {index_path} up to record {seq}")
+            if on_compacted is not None:
+                on_compacted()
+        except Exception as e:
+            self.logger.exception(f"Failed to compact {index_path}, changes stay in the log: {e}")
+
+
+    def _write_snapshot(self, index_path: str, vector_storage: FAISS, seq: int) -> None:
+        """Write a snapshot next to the current one and swap them, so a crash leaves one of them intact."""
+        tmp_path, old_path = f'{index_path}.tmp', f'{index_path}.old'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        if self.mode == 'mmap' and index_kind(vector_storage.index) == 'flat':
+            # FAISS reads flat indexes into memory, so their vectors are saved in a mappable layout
+            index = vector_storage.index
+            vectors = index.vectors if isinstance(index, MappedFlatIndex) else RescoreVectors(reconstruct_all(index))
+            os.makedirs(tmp_path)
+            vectors.save(os.path.join(tmp_path, VECTORS_FILE))
+            with open(os.path.join(tmp_path, 'index.pkl'), 'wb') as f:
+                pickle.dump((vector_storage.docstore, vector_storage.index_to_docstore_id), f)
+        else:
+            vector_storage.save_local(tmp_path)
+        rescore_vectors = getattr(vector_storage, 'rescore_vectors', None)
+        if rescore_vectors is not None:
+            rescore_vectors.save(os.path.join(tmp_path, VECTORS_FILE))
+        with open(os.path.join(tmp_path, SNAPSHOT_META), 'w') as f:
+            json.dump({'seq': seq}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if os.path.exists(index_path):
+            os.replace(index_path, old_path)
+        os.replace(tmp_path, index_path)
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+
+
+    def flush(self) -> None:
+        """Compact all storages with pending changes, e.g. on shutdown."""
+        with self._guard:
+            pending = list(self._pending)
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        for index_path in pending:
+            self.compact(index_path)
@@ -0,0 +1,121 @@
+import math
+from typing import Optional
+
+import faiss
+import numpy as np
+
+from config import (
+    ann_min_vectors,
+    ann_index_type,
+    hnsw_m,
+    hnsw_ef_construction,
+    hnsw_ef_search,
+    ivf_nprobe,
+    compact_vectors,
+    compact_dim,
+    compact_pq_m,
+    compact_min_vectors,
+)
+
+
+IVF_TRAIN_POINTS_PER_LIST = 64
+
+
+def choose_index_type(ntotal: int) -> str:
+    """Exact search for small storages, compact codes or the configured ANN index for large ones."""
+    if compact_vectors is not None and ntotal >= compact_min_vectors:
+        return "compact"
+    return ann_index_type if ntotal >= ann_min_vectors else "flat"
+
+
+def index_kind(index: faiss.Index) -> str:
+    codes = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    if isinstance(codes, (faiss.IndexScalarQuantizer, faiss.IndexPQ)):
+        return "compact"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def configure_index(index: faiss.Index) -> faiss.Index:
+    """Apply search-time parameters, which are not always restored from disk."""
+    kind = index_kind(index)
+    if kind == "hnsw":
+        index.hnsw.efSearch = hnsw_ef_search
+    elif kind == "ivf":
+        index.nprobe = ivf_nprobe
+    return index
+
+
+def search_params(index: faiss.Index, excluded: np.ndarray) -> faiss.SearchParameters:
+    """Search parameters of an ANN index that skip the vectors at the excluded positions."""
+    excluded_ids = faiss.IDSelectorBatch(np.ascontiguousarray(excluded, dtype=np.int64))
+    selector = faiss.IDSelectorNot(excluded_ids)
+    if index_kind(index) == "hnsw":
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_ef_search)
+    else:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf_nprobe)
+    params.referenced_objects = [selector, excluded_ids]  # SWIG doesn't keep them alive
+    return params
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """Return all stored vectors in insertion order."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if index_kind(index) == "ivf":
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def build_compact_index(
+        vectors: np.ndarray,
+        quantizer: str = compact_vectors,
+        dim: Optional[int] = compact_dim,
+        pq_m: int = compact_pq_m,
+    ) -> faiss.Index:
+    """
+    Flat index over quantized codes of the leading `dim` dimensions, the first stage of a compact search.
+    Its candidates are rescored with exact distances to float32 vectors kept outside of the index
+    (see RescoreVectors). The quantizer is trained on the given vectors, but they are not added.
+    """
+    d = vectors.shape[1]
+    dim = min(dim or d, d)
+    if quantizer == "sq8":
+        codes = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    elif quantizer == "fp16":
+        codes = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+    elif quantizer == "pq":
+        codes = faiss.IndexPQ(dim, pq_m, 8)
+    else:
+        raise ValueError(f"Unknown compact vectors '{quantizer}', expected 'sq8', 'fp16' or 'pq'")
+    if dim < d:
+        codes = faiss.IndexPreTransform(faiss.RemapDimensionsTransform(d, dim, False), codes)  # Keeps the prefix
+    codes.train(vectors)
+    return codes
+
+
+def build_index(kind: str, vectors: np.ndarray) -> faiss.Index:
+    """Build an index of the given kind over the vectors, training it on them if needed."""
+    n, d = vectors.shape
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if kind == "flat":
+        index = faiss.IndexFlatL2(d)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m)
+        index.hnsw.efConstruction = hnsw_ef_construction
+    elif kind == "compact":
+        index = build_compact_index(vectors)
+    elif kind == "ivf":
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // IVF_TRAIN_POINTS_PER_LIST))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(d), d, nlist)
+        sample = vectors
+        if n > nlist * IVF_TRAIN_POINTS_PER_LIST * 4:
+            sample = vectors[np.random.default_rng(0).choice(n, nlist * IVF_TRAIN_POINTS_PER_LIST * 4, replace=False)]
+        index.train(sample)
+    else:
+        raise ValueError(f"Unknown index type '{kind}', expected 'flat', 'hnsw', 'ivf' or 'compact'")
+    index.add(vectors)
+    return configure_index(index)
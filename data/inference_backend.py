@@ -0,0 +1,153 @@
+"""
+Loading of the embedding model and the reranker for the configured inference backend.
+"torch" runs the stock models on `embed_model_device`. "onnx" and "int8" are meant for
+machines without a GPU: "onnx" exports the embedder to ONNX Runtime, "int8" quantizes
+the linear layers of the models to int8 with dynamic activation scales.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+from FlagEmbedding import FlagReranker
+
+from config import (
+    embed_model_device,
+    retrieval_model_name,
+    rerank_model_name,
+    inference_backend,
+    inference_threads,
+    inference_interop_threads,
+    inference_check_tolerance,
+)
+from utils.logging_config import setup_logging
+
+
+logger = setup_logging('InferenceBackend')
+
+BACKENDS = ("torch", "onnx", "int8")
+
+# Short multilingual texts for the startup check against the reference model
+CHECK_TEXTS = [
+    "What is the opening time of the restaurant on Sundays?",
+    "The contract can be terminated with three months' notice to the end of a quarter.",
+    "Die Rechnung ist innerhalb von 14 Tagen ohne Abzug zu bezahlen.",
+    "Wie viele Urlaubstage stehen neuen Mitarbeitern im ersten Jahr zu?",
+    "Срок действия договора продлевается автоматически на один год.",
+    "Какие документы нужны для оформления визы?",
+]
+
+
+def _check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected 'torch', 'onnx' or 'int8'")
+
+
+def inference_device(backend: str = inference_backend) -> str:
+    return embed_model_device if backend == "torch" else "cpu"
+
+
+def configure_threads(threads: Optional[int] = inference_threads, interop_threads: Optional[int] = inference_interop_threads):
+    """Set the torch thread pools used for CPU inference. None keeps the torch defaults."""
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:  # Can be set only once, before any inter-op parallel work
+            logger.warning(f"Inter-op threads are already fixed at {torch.get_num_interop_threads()}.")
+
+
+def _onnx_model_kwargs(threads: Optional[int], interop_threads: Optional[int]) -> dict:
+    import onnxruntime
+
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+    if interop_threads:
+        session_options.inter_op_num_threads = interop_threads
+    return {'provider': 'CPUExecutionProvider', 'session_options': session_options}
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Quantize linear layers of a model in place to int8 weights with dynamic activation scales."""
+    model.to('cpu')
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_embeddings(
+        backend: str = inference_backend,
+        threads: Optional[int] = inference_threads,
+        interop_threads: Optional[int] = inference_interop_threads,
+        device: Optional[str] = None,
+    ) -> HuggingFaceEmbeddings:
+    """Load the retrieval model for the given backend. `device` overrides `embed_model_device` of the torch backend."""
+    _check_backend(backend)
+    if backend == "torch":
+        return HuggingFaceEmbeddings(model_name=retrieval_model_name, model_kwargs={'device': device or embed_model_device})
+
+    configure_threads(threads, interop_threads)
+    if backend == "onnx":
+        # sentence-transformers exports the model on first load if the repository has no ONNX weights
+        embeddings = HuggingFaceEmbeddings(
+            model_name=retrieval_model_name,
+            model_kwargs={
+                'device': 'cpu',
+                'backend': 'onnx',
+                'model_kwargs': _onnx_model_kwargs(threads, interop_threads),
+            },
+        )
+    else:
+        embeddings = HuggingFaceEmbeddings(model_name=retrieval_model_name, model_kwargs={'device': 'cpu'})
+        quantize_int8(embeddings._client)
+    logger.info(f"Loaded {retrieval_model_name} with the {backend} backend, {torch.get_num_threads()} threads.")
+    return embeddings
+
+
+def load_reranker(
+        backend: str = inference_backend,
+        threads: Optional[int] = inference_threads,
+        interop_threads: Optional[int] = inference_interop_threads,
+        device: Optional[str] = None,
+    ) -> FlagReranker:
+    """
+    Load the reranker for the given backend. `device` overrides `embed_model_device` of the torch backend.
+    FlagReranker runs only torch models, so with "onnx" the reranker is quantized to int8 as well.
+    """
+    _check_backend(backend)
+    if backend == "torch":
+        device = device or embed_model_device
+        return FlagReranker(rerank_model_name, use_fp16=device.startswith('cuda'), devices=device)
+
+    configure_threads(threads, interop_threads)
+    reranker = FlagReranker(rerank_model_name, use_fp16=False, devices='cpu')
+    quantize_int8(reranker.model)
+    logger.info(f"Loaded {rerank_model_name} with int8 weights on CPU, {torch.get_num_threads()} threads.")
+    return reranker
+
+
+def compare_embeddings(embeddings: Embeddings, reference: Embeddings, texts: List[str]) -> Dict[str, float]:
+    """Cosine similarity between vectors of the same texts from a backend and the reference model."""
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    reference_vectors = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    cosine = (vectors * reference_vectors).sum(axis=1) / (
+        np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference_vectors, axis=1)
+    )
+    return {'min_cosine': float(cosine.min()), 'mean_cosine': float(cosine.mean())}
+
+
+def check_embeddings(embeddings: Embeddings, texts: List[str] = CHECK_TEXTS, tolerance: float = inference_check_tolerance) -> bool:
+    """
+    Compare a CPU backend with the stock float32 model on CPU.
+    Returns:
+        True if every text's cosine similarity to the reference is at least `tolerance`.
+    """
+    reference = HuggingFaceEmbeddings(model_name=retrieval_model_name, model_kwargs={'device': 'cpu'})
+    result = compare_embeddings(embeddings, reference, texts)
+    del reference
+    if result['min_cosine'] < tolerance:
+        logger.warning(f"Embeddings of the {inference_backend} backend differ from the reference model: {result}, tolerance {tolerance}.")
+        return False
+    logger.info(f"Embeddings of the {inference_backend} backend match the reference model: {result}.")
+    return True
@@ -0,0 +1,118 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import List, Optional
+
+from config import jobs_db_path
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+JOB_STATES = ('queued', 'converting', 'embedding', 'indexed', 'failed')
+ACTIVE_STATES = ('queued', 'converting', 'embedding')
+
+
+
+@singleton
+class JobStore:
+    """Keeps the state of file ingestion jobs, so they can be reported and resumed after a restart."""
+    def __init__(self, db_path: str = jobs_db_path):
+        self._init_db(db_path)
+        self.logger = setup_logging('JobStore')
+
+
+    def _init_db(self, db_path: str):
+        """Initialize SQLite database with the ingestion jobs table."""
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    source TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    lang TEXT NOT NULL DEFAULT 'en',
+                    state TEXT NOT NULL,
+                    progress INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON ingestion_jobs (state)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_chunks (
+                    job_id TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_job_chunks_job ON job_chunks (job_id)")
+
+
+    def create(self, user_id: int, source: str, file_path: str, chat_id: int, message_id: int, lang: str) -> str:
+        """Register a queued job. Returns its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                INSERT INTO ingestion_jobs (job_id, user_id, source, file_path, chat_id, message_id, lang, state, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+            """, (job_id, user_id, source, file_path, chat_id, message_id, lang, now, now))
+        return job_id
+
+
+    def update(self, job_id: str, state: str, progress: int = 0, error: Optional[str] = None) -> None:
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state '{state}'")
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE ingestion_jobs SET state = ?, progress = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (state, progress, error, time.time(), job_id),
+            )
+            if state not in ACTIVE_STATES:
+                self.conn.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+
+
+    def add_chunks(self, job_id: str, chunk_ids: List[str]) -> None:
+        """Remember ids of chunks a job is about to add, so an interrupted job can remove them before it reruns."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO job_chunks (job_id, chunk_id) VALUES (?, ?)",
+                [(job_id, chunk_id) for chunk_id in chunk_ids],
+            )
+
+
+    def get_chunks(self, job_id: str) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute("SELECT chunk_id FROM job_chunks WHERE job_id = ?", (job_id,)).fetchall()
+        return [row[0] for row in rows]
+
+
+    def clear_chunks(self, job_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM job_chunks WHERE job_id = ?", (job_id,))
+
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+
+    def get_active(self, user_id: Optional[int] = None) -> List[dict]:
+        """Jobs that are not finished yet, oldest first."""
+        query = f"SELECT * FROM ingestion_jobs WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))})"
+        params = list(ACTIVE_STATES)
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY created_at", params).fetchall()
+        return [dict(row) for row in rows]
@@ -1,9 +1,10 @@
 import os
 import json
-import sqlite3
+import threading
 from typing import Dict
 
 from config import messages_path, languages_db_path, supported_languages
+from data.sqlite_pool import SQLitePool
 from utils.logging_config import setup_logging
 from utils.singleton import singleton
 
@@ -26,17 +27,20 @@ class LanguageManager:
 
 
     def _init_db(self, db_path: str):
-        """Initialize SQLite database with language preferences."""
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS user_languages (
-                user_id INTEGER PRIMARY KEY,
-                language TEXT NOT NULL DEFAULT 'en'
-            )
-        """)
-        self.conn.commit()
+        """
+        Initialize SQLite database with language preferences and load them.
+        Preferences are kept in memory and changes are written through, so lookups don't touch the database.
+        """
+        self.pool = SQLitePool(db_path)
+        self.lock = threading.Lock()
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_languages (
+                    user_id INTEGER PRIMARY KEY,
+                    language TEXT NOT NULL DEFAULT 'en'
+                )
+            """)
+            self._languages: Dict[int, str] = dict(conn.execute("SELECT user_id, language FROM user_languages").fetchall())
 
     
     def _load_messages(self, messages_file: str) -> Dict[str, Dict[str, str]]:
@@ -59,11 +63,13 @@ class LanguageManager:
         if lang not in self.supported_languages:
             return False
         
-        self.cursor.execute("""
-            INSERT OR REPLACE INTO user_languages (user_id, language)
-            VALUES (?, ?)
-        """, (user_id, lang))
-        self.conn.commit()
+        with self.lock:
+            with self.pool.connection() as conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO user_languages (user_id, language)
+                    VALUES (?, ?)
+                """, (user_id, lang))
+            self._languages[user_id] = lang
         return True
 
 
@@ -75,11 +81,7 @@ class LanguageManager:
         Returns:
             str: Language key ('en', 'ru', 'de').
         """
-        self.cursor.execute("""
-            SELECT language FROM user_languages WHERE user_id = ?
-        """, (user_id,))
-        result = self.cursor.fetchone()
-        return result[0] if result else 'en'
+        return self._languages.get(user_id, 'en')
 
 
     def get_message(self, message_key: str, lang: str = "en") -> str:
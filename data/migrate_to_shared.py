@@ -0,0 +1,99 @@
+"""
+Copy per-user storages from `embed_db_path` into the shared multi-tenant indexes.
+Vectors are taken from the stored indexes, so nothing is re-embedded. A marker is written
+to the shared store's directory once all chunks of a user are copied. Marked users are skipped
+on the next run, and chunks of users without a marker (interrupted in the middle) are deleted
+and copied again, which makes the migration resumable.
+Set `storage_backend = "shared"` in config.py afterwards.
+
+    python -m data.migrate_to_shared [--users 123 456]
+"""
+import os
+import json
+import argparse
+
+from config import embed_db_path
+from data.database_manager import get_index_name
+from data.index_persistence import IndexPersistence
+from data.rescore_vectors import live_vectors
+from data.shared_store import SharedIndexStore
+from utils.logging_config import setup_logging
+
+
+BATCH_SIZE = 1_000
+MARKERS_DIR = 'migrated'
+
+
+def marker_path(shared: SharedIndexStore, user_id: str) -> str:
+    return os.path.join(shared.db_dir, MARKERS_DIR, user_id)
+
+
+def mark_migrated(shared: SharedIndexStore, user_id: str, chunks: int) -> None:
+    path = marker_path(shared, user_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'chunks': chunks}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+def migrate_user(user_id: str, persistence: IndexPersistence, shared: SharedIndexStore) -> int:
+    """
+    Copy one user's storage (last snapshot plus logged changes) into the shared store.
+    Returns:
+        Number of copied chunks.
+    """
+    index_path = os.path.join(embed_db_path, user_id, get_index_name())
+    vector_storage = persistence.load(index_path)
+    doc_ids, vectors = live_vectors(vector_storage)
+    docstore = vector_storage.docstore
+
+    for start in range(0, len(doc_ids), BATCH_SIZE):
+        batch_ids = doc_ids[start:start + BATCH_SIZE]
+        if hasattr(docstore, 'search_many'):
+            docs = docstore.search_many(batch_ids)
+        else:
+            docs = {doc_id: docstore.search(doc_id) for doc_id in batch_ids}
+        shared.add(
+            user_id,
+            batch_ids,
+            [docs[doc_id].page_content for doc_id in batch_ids],
+            [docs[doc_id].metadata for doc_id in batch_ids],
+            vectors[start:start + BATCH_SIZE],
+        )
+    return len(doc_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', nargs='+', help="Migrate only these user ids")
+    args = parser.parse_args()
+    logger = setup_logging('MigrateToShared')
+
+    index_name = get_index_name()
+    user_ids = args.users or (sorted(os.listdir(embed_db_path)) if os.path.isdir(embed_db_path) else [])
+    persistence = IndexPersistence(embeddings=None)
+    shared = SharedIndexStore()
+
+    migrated = 0
+    for user_id in user_ids:
+        if not os.path.isdir(os.path.join(embed_db_path, user_id, index_name)):
+            continue
+        if os.path.exists(marker_path(shared, user_id)):
+            logger.info(f"User {user_id} is already in the shared store, skipping")
+            continue
+        partial = shared.delete_user(user_id)
+        if partial:
+            logger.warning(f"Migration of user {user_id} was interrupted, deleted {partial} copied chunks to start over")
+        chunks = migrate_user(user_id, persistence, shared)
+        mark_migrated(shared, user_id, chunks)
+        migrated += 1
+        logger.info(f"Migrated {chunks} chunks of user {user_id}")
+
+    shared.flush()
+    logger.info(f"Migrated {migrated} users to {shared.db_dir}")
+
+
+if __name__ == '__main__':
+    main()
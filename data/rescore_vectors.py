@@ -0,0 +1,230 @@
+from typing import Any, Iterator, Optional
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from data.index_selection import reconstruct_all
+
+
+VECTORS_FILE = 'vectors.npy'
+WRITE_BATCH = 8192
+SEARCH_BATCH = 16384  # Rows of the mapped file scanned at once by exact search
+
+
+class RescoreVectors:
+    """
+    Float32 vectors in FAISS order kept outside of a FAISS index: the exact vectors that rescore
+    candidates of a compact index, and the whole storage of a flat index in "mmap" mode.
+    Vectors of the last snapshot are memory-mapped from its `vectors.npy`, vectors added since then
+    stay in memory and removed vectors are only marked, until the next snapshot writes the live
+    vectors to a new file.
+    """
+    def __init__(self, vectors: np.ndarray):
+        self.mapped = vectors
+        self.added: list[np.ndarray] = []
+        self.deleted = np.zeros(0, dtype=np.int64)  # Removed rows of mapped + added, sorted
+        self._added = None
+        self._live = None
+
+
+    @classmethod
+    def load(cls, path: str) -> 'RescoreVectors':
+        return cls(np.load(path, mmap_mode='r'))
+
+
+    @property
+    def d(self) -> int:
+        return self.mapped.shape[1]
+
+
+    def _rows(self) -> int:
+        return len(self.mapped) + sum(len(vectors) for vectors in self.added)
+
+
+    def __len__(self) -> int:
+        return self._rows() - len(self.deleted)
+
+
+    def in_memory_bytes(self) -> int:
+        """Bytes kept on the heap, the mapped part is backed by the snapshot file."""
+        size = sum(vectors.nbytes for vectors in self.added) + self.deleted.nbytes
+        if not isinstance(self.mapped, np.memmap):
+            size += self.mapped.nbytes
+        return size
+
+
+    def _added_rows(self) -> np.ndarray:
+        if self._added is None:
+            self._added = np.concatenate(self.added) if self.added else np.zeros((0, self.d), dtype=np.float32)
+        return self._added
+
+
+    def _physical(self, positions: np.ndarray) -> np.ndarray:
+        """Rows of vectors at the given positions, which skip removed rows like FAISS remove_ids."""
+        if not len(self.deleted):
+            return positions
+        if self._live is None:
+            self._live = np.delete(np.arange(self._rows()), self.deleted)
+        return self._live[positions]
+
+
+    def all(self) -> np.ndarray:
+        vectors = np.asarray(self.mapped) if not self.added else np.concatenate([self.mapped, self._added_rows()])
+        return np.delete(vectors, self.deleted, axis=0) if len(self.deleted) else vectors
+
+
+    def add(self, vectors: np.ndarray) -> None:
+        self.added.append(np.array(vectors, dtype=np.float32).reshape(-1, self.d))
+        self._added = self._live = None
+
+
+    def remove(self, positions: list[int]) -> int:
+        """Remove vectors at the given positions, later vectors shift down like in FAISS remove_ids."""
+        rows = self._physical(np.unique(np.asarray(positions, dtype=np.int64)))
+        self.deleted = np.union1d(self.deleted, rows)
+        self._live = None
+        return len(rows)
+
+
+    def take(self, positions: np.ndarray) -> np.ndarray:
+        rows = self._physical(np.asarray(positions, dtype=np.int64))
+        n_mapped = len(self.mapped)
+        order = np.argsort(rows, kind='stable')
+        vectors = np.empty((len(rows), self.d), dtype=np.float32)
+        sorted_rows = rows[order]
+        split = np.searchsorted(sorted_rows, n_mapped)
+        vectors[order[:split]] = self.mapped[sorted_rows[:split]]  # Sorted reads from the mapped file
+        if split < len(rows):
+            vectors[order[split:]] = self._added_rows()[sorted_rows[split:] - n_mapped]
+        return vectors
+
+
+    def _blocks(self) -> Iterator[tuple[int, np.ndarray]]:
+        """First row and vectors of consecutive blocks of all rows, removed ones included."""
+        for start in range(0, len(self.mapped), SEARCH_BATCH):
+            yield start, self.mapped[start:start + SEARCH_BATCH]
+        if self.added:
+            yield len(self.mapped), self._added_rows()
+
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Exact L2 search, scanning the mapped file block by block.
+        Returns:
+            Squared distances and positions of the k nearest vectors per query, padded with -1 like FAISS.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        query_norms = (queries ** 2).sum(axis=1)[:, None]
+        for start, block in self._blocks():
+            block_distances = query_norms - 2 * queries @ block.T + (block ** 2).sum(axis=1)[None, :]
+            removed = self.deleted[(self.deleted >= start) & (self.deleted < start + len(block))] - start
+            block_distances[:, removed] = np.inf
+            block_k = min(k, len(block))
+            nearest = np.argpartition(block_distances, block_k - 1, axis=1)[:, :block_k]
+            merged_distances = np.concatenate([distances, np.take_along_axis(block_distances, nearest, axis=1)], axis=1)
+            merged_rows = np.concatenate([rows, nearest + start], axis=1)
+            best = np.argsort(merged_distances, axis=1, kind='stable')[:, :k]
+            distances = np.take_along_axis(merged_distances, best, axis=1)
+            rows = np.take_along_axis(merged_rows, best, axis=1)
+        np.maximum(distances, 0, out=distances)
+        found = np.isfinite(distances)
+        positions = np.full_like(rows, -1)
+        positions[found] = rows[found] - np.searchsorted(self.deleted, rows[found])
+        return distances, positions
+
+
+    def rescore(self, queries: np.ndarray, candidates: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Reorder candidates found with compact codes by exact L2 distance.
+        Returns:
+            Distances and positions of the k nearest candidates per query, padded with -1 like FAISS.
+        """
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, found) in enumerate(zip(queries, candidates)):
+            found = found[found != -1]
+            if not len(found):
+                continue
+            exact = ((self.take(found) - query) ** 2).sum(axis=1)
+            best = np.argsort(exact, kind='stable')[:k]
+            distances[row, :len(best)] = exact[best]
+            indices[row, :len(best)] = found[best]
+        return distances, indices
+
+
+    def save(self, path: str) -> None:
+        """Write the live vectors, block by block."""
+        out = open_memmap(path, mode='w+', dtype=np.float32, shape=(len(self), self.d))
+        written = 0
+        for start, block in self._blocks():
+            removed = self.deleted[(self.deleted >= start) & (self.deleted < start + len(block))] - start
+            for batch_start in range(0, len(block), WRITE_BATCH):
+                batch = block[batch_start:batch_start + WRITE_BATCH]
+                batch_removed = removed[(removed >= batch_start) & (removed < batch_start + len(batch))] - batch_start
+                if len(batch_removed):
+                    batch = np.delete(batch, batch_removed, axis=0)
+                out[written:written + len(batch)] = batch
+                written += len(batch)
+        out.flush()
+        del out
+
+
+
+class MappedFlatIndex:
+    """
+    Exact search over memory-mapped vectors with the part of the IndexFlatL2 interface that
+    the LangChain FAISS wrapper and the storages use. Flat storages are kept in this layout in "mmap"
+    mode, as FAISS reads flat indexes into memory.
+    """
+    def __init__(self, vectors: RescoreVectors):
+        self.vectors = vectors
+        self.d = vectors.d
+
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.vectors)
+
+
+    def in_memory_bytes(self) -> int:
+        return self.vectors.in_memory_bytes()
+
+
+    def add(self, vectors: np.ndarray) -> None:
+        self.vectors.add(vectors)
+
+
+    def remove_ids(self, ids: np.ndarray) -> int:
+        return self.vectors.remove(ids)
+
+
+    def search(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        return self.vectors.search(queries, k)
+
+
+    def reconstruct_n(self, start: int, n: int) -> np.ndarray:
+        return self.vectors.take(np.arange(start, start + n))
+
+
+    def sa_code_size(self) -> int:
+        return self.d * 4
+
+
+
+def stored_vectors(vector_storage: Any) -> np.ndarray:
+    """Exact vectors of a storage in FAISS order, compact indexes keep only lossy codes."""
+    rescore_vectors: Optional[RescoreVectors] = getattr(vector_storage, 'rescore_vectors', None)
+    if rescore_vectors is not None:
+        return rescore_vectors.all()
+    return reconstruct_all(vector_storage.index)
+
+
+def live_vectors(vector_storage: Any) -> tuple[list[str], np.ndarray]:
+    """Docstore ids and exact vectors of a storage's chunks, without the tombstones of an ANN index."""
+    positions = sorted(vector_storage.index_to_docstore_id)
+    vectors = stored_vectors(vector_storage)
+    if len(positions) < len(vectors):
+        vectors = vectors[positions]
+    return [vector_storage.index_to_docstore_id[position] for position in positions], vectors
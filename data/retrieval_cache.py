@@ -0,0 +1,121 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from config import retrieval_model_name, query_embedding_cache_size, retrieval_cache_size
+
+
+
+def normalize_query(text: str) -> str:
+    """Normalize unicode and whitespace so that trivially different queries share a cache key."""
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the number of entries, with hit/miss counters."""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._data)}
+
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that caches query vectors keyed by normalized text and model name."""
+    def __init__(self, base: Embeddings, max_size: int = query_embedding_cache_size, model_name: str = retrieval_model_name):
+        self.base = base
+        self.model_name = model_name
+        self.cache = LRUCache(max_size)
+
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+
+    def embed_query(self, text: str) -> List[float]:
+        text = normalize_query(text)
+        key = (self.model_name, text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.base.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several queries, computing all cache misses in one batch.
+        With a BatchingEmbeddings base the misses join the batch of other concurrent queries.
+        """
+        keys = [(self.model_name, normalize_query(text)) for text in texts]
+        vectors = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            if hasattr(self.base, 'submit'):
+                futures = [self.base.submit(keys[i][1]) for i in missing]
+                new_vectors = [future.result() for future in futures]
+            else:
+                new_vectors = self.base.embed_documents([keys[i][1] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self.cache.put(keys[i], vector)
+        return vectors
+
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
+
+
+
+class RetrievalCache:
+    """
+    Per-user cache of top-k search results (lists of (Document, distance) pairs)
+    keyed by query and the user's index version.
+    Bumping the version on every index change makes older entries unreachable,
+    they are then pushed out by the LRU policy.
+    """
+    def __init__(self, max_size: int = retrieval_cache_size):
+        self.cache = LRUCache(max_size)
+
+
+    def get(self, user_id: str, query: str, k: int, version: int) -> Optional[List]:
+        docs = self.cache.get((str(user_id), version, normalize_query(query), k))
+        return None if docs is None else list(docs)
+
+
+    def put(self, user_id: str, query: str, k: int, version: int, docs: List) -> None:
+        self.cache.put((str(user_id), version, normalize_query(query), k), list(docs))
+
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
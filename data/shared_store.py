@@ -0,0 +1,317 @@
+import os
+import json
+import uuid
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from config import embed_dim, shared_db_path, shared_shards, index_save_delay
+from utils.logging_config import setup_logging
+
+
+SLOT_BITS = 32  # FAISS id = (user's slot << SLOT_BITS) | user's chunk number
+
+
+class SharedIndexStore:
+    """
+    Multi-tenant storage that keeps the vectors of all users in a few shared FAISS shards.
+    Every user gets a slot, and all of the user's vectors get ids from the range
+    [slot << 32, (slot + 1) << 32) in shard `slot % n_shards`, so searches are restricted
+    to one user with an IDSelectorRange. Chunk texts, metadata and vectors are stored in
+    SQLite, which is the source of truth: shards are saved in the background and
+    reconciled with SQLite on load.
+    """
+    def __init__(self, db_dir: str = shared_db_path, n_shards: int = shared_shards, dim: int = embed_dim, save_delay: float = index_save_delay):
+        self.db_dir = db_dir
+        self.n_shards = n_shards
+        self.dim = dim
+        self.save_delay = save_delay
+        self.logger = setup_logging('SharedIndexStore')
+        self._init_db(os.path.join(db_dir, 'chunks.db'))
+        self._shard_locks = [threading.RLock() for _ in range(n_shards)]
+        self._timers: Dict[int, threading.Timer] = dict()
+        self._timers_guard = threading.Lock()
+        self.shards = [self._load_shard(shard) for shard in range(n_shards)]
+
+
+    def _init_db(self, db_path: str):
+        """Initialize SQLite database with tenants and chunks tables."""
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS tenants (
+                    user_id TEXT PRIMARY KEY,
+                    slot INTEGER UNIQUE NOT NULL,
+                    next_seq INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    faiss_id INTEGER PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    source TEXT,
+                    page_content TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (user_id, source)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (user_id, doc_id)")
+
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.db_dir, f'shard-{shard}.faiss')
+
+
+    def _load_shard(self, shard: int) -> faiss.Index:
+        """Read a shard from disk and add or remove vectors so that it matches SQLite."""
+        path = self._shard_path(shard)
+        index = faiss.read_index(path) if os.path.exists(path) else faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
+
+        in_index = set(faiss.vector_to_array(index.id_map).tolist()) if index.ntotal else set()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT faiss_id FROM chunks WHERE (faiss_id >> ?) % ? = ?", (SLOT_BITS, self.n_shards, shard)
+            ).fetchall()
+        in_db = {row[0] for row in rows}
+
+        extra = in_index - in_db
+        if extra:
+            index.remove_ids(np.fromiter(extra, dtype=np.int64))
+        missing = list(in_db - in_index)
+        if missing:
+            vectors = self._get_vectors(missing)
+            index.add_with_ids(vectors, np.asarray(missing, dtype=np.int64))
+        if extra or missing:
+            self.logger.info(f"Reconciled shard {shard}: removed {len(extra)}, restored {len(missing)} vectors")
+            self._save_shard(shard, index)
+        return index
+
+
+    def _get_vectors(self, faiss_ids: List[int]) -> np.ndarray:
+        vectors = []
+        with self.lock:
+            for start in range(0, len(faiss_ids), 500):
+                batch = faiss_ids[start:start + 500]
+                rows = dict(self.conn.execute(
+                    f"SELECT faiss_id, vector FROM chunks WHERE faiss_id IN ({', '.join('?' * len(batch))})", batch
+                ).fetchall())
+                vectors.extend(np.frombuffer(rows[faiss_id], dtype=np.float32) for faiss_id in batch)
+        return np.vstack(vectors)
+
+
+    def _get_slot(self, user_id: str, create: bool = False) -> Optional[int]:
+        with self.lock:
+            row = self.conn.execute("SELECT slot FROM tenants WHERE user_id = ?", (str(user_id),)).fetchone()
+            if row is None and create:
+                with self.conn:
+                    slot = self.conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM tenants").fetchone()[0]
+                    self.conn.execute("INSERT INTO tenants (user_id, slot) VALUES (?, ?)", (str(user_id), slot))
+                return slot
+        return row[0] if row else None
+
+
+    def add(self, user_id: str, doc_ids: List[str], texts: List[str], metadatas: List[dict], vectors: Any) -> None:
+        """Add user's chunks with precomputed vectors."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        slot = self._get_slot(user_id, create=True)
+        shard = slot % self.n_shards
+        with self._shard_locks[shard]:
+            with self.lock, self.conn:
+                start = self.conn.execute("SELECT next_seq FROM tenants WHERE user_id = ?", (str(user_id),)).fetchone()[0]
+                self.conn.execute("UPDATE tenants SET next_seq = ? WHERE user_id = ?", (start + len(texts), str(user_id)))
+                faiss_ids = [(slot << SLOT_BITS) | (start + i) for i in range(len(texts))]
+                self.conn.executemany("""
+                    INSERT INTO chunks (faiss_id, user_id, doc_id, source, page_content, metadata, vector)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (faiss_id, str(user_id), doc_id, metadata.get('source'), text, json.dumps(metadata), vector.tobytes())
+                    for faiss_id, doc_id, text, metadata, vector in zip(faiss_ids, doc_ids, texts, metadatas, vectors)
+                ])
+            self.shards[shard].add_with_ids(vectors, np.asarray(faiss_ids, dtype=np.int64))
+        self._schedule_save(shard)
+
+
+    def delete(self, user_id: str, doc_ids: List[str]) -> int:
+        """Delete user's chunks by docstore id. Returns number of deleted chunks."""
+        slot = self._get_slot(user_id)
+        if slot is None or not doc_ids:
+            return 0
+        shard = slot % self.n_shards
+        with self._shard_locks[shard]:
+            with self.lock, self.conn:
+                faiss_ids = []
+                for start in range(0, len(doc_ids), 500):
+                    batch = doc_ids[start:start + 500]
+                    faiss_ids += [row[0] for row in self.conn.execute(
+                        f"SELECT faiss_id FROM chunks WHERE user_id = ? AND doc_id IN ({', '.join('?' * len(batch))})",
+                        [str(user_id), *batch],
+                    ).fetchall()]
+                self.conn.executemany("DELETE FROM chunks WHERE faiss_id = ?", [(faiss_id,) for faiss_id in faiss_ids])
+            if faiss_ids:
+                self.shards[shard].remove_ids(np.asarray(faiss_ids, dtype=np.int64))
+        self._schedule_save(shard)
+        return len(faiss_ids)
+
+
+    def delete_user(self, user_id: str) -> int:
+        """Delete all chunks of a user. Returns number of deleted chunks."""
+        slot = self._get_slot(user_id)
+        if slot is None:
+            return 0
+        shard = slot % self.n_shards
+        with self._shard_locks[shard]:
+            with self.lock, self.conn:
+                faiss_ids = [row[0] for row in self.conn.execute("SELECT faiss_id FROM chunks WHERE user_id = ?", (str(user_id),)).fetchall()]
+                self.conn.execute("DELETE FROM chunks WHERE user_id = ?", (str(user_id),))
+            if faiss_ids:
+                self.shards[shard].remove_ids(np.asarray(faiss_ids, dtype=np.int64))
+        self._schedule_save(shard)
+        return len(faiss_ids)
+
+
+    def search(self, user_id: str, vectors: Any, k: int) -> List[List[Tuple[Document, float]]]:
+        """Search only user's vectors. Returns (Document, L2 distance) pairs for each query."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        slot = self._get_slot(user_id)
+        if slot is None:
+            return [[] for _ in vectors]
+        shard = slot % self.n_shards
+        params = faiss.SearchParameters()
+        params.sel = faiss.IDSelectorRange(slot << SLOT_BITS, (slot + 1) << SLOT_BITS)
+        with self._shard_locks[shard]:
+            distances, ids = self.shards[shard].search(vectors, k, params=params)
+
+        docs = self._get_docs([int(i) for i in np.unique(ids) if i != -1])
+        return [
+            [(docs[int(i)], float(distance)) for distance, i in zip(row_distances, row_ids) if i != -1 and int(i) in docs]
+            for row_distances, row_ids in zip(distances, ids)
+        ]
+
+
+    def _get_docs(self, faiss_ids: List[int]) -> Dict[int, Document]:
+        if not faiss_ids:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT faiss_id, doc_id, page_content, metadata FROM chunks WHERE faiss_id IN ({', '.join('?' * len(faiss_ids))})",
+                faiss_ids,
+            ).fetchall()
+        return {
+            faiss_id: Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+            for faiss_id, doc_id, page_content, metadata in rows
+        }
+
+
+    def list_sources(self, user_id: str) -> List[str]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT source FROM chunks WHERE user_id = ? AND source IS NOT NULL ORDER BY source", (str(user_id),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+    def get_chunk_ids(self, user_id: str, source_prefix: str) -> List[str]:
+        """Docstore ids of user's chunks whose source starts with the given prefix."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT doc_id FROM chunks WHERE user_id = ? AND substr(source, 1, ?) = ?",
+                (str(user_id), len(source_prefix), source_prefix),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+    def count(self, user_id: str) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunks WHERE user_id = ?", (str(user_id),)).fetchone()[0]
+
+
+    def _schedule_save(self, shard: int) -> None:
+        with self._timers_guard:
+            timer = self._timers.pop(shard, None)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(self.save_delay, self._save, args=(shard,))
+            timer.daemon = True
+            self._timers[shard] = timer
+            timer.start()
+
+
+    def _save(self, shard: int) -> None:
+        with self._timers_guard:
+            self._timers.pop(shard, None)
+        with self._shard_locks[shard]:
+            self._save_shard(shard, self.shards[shard])
+
+
+    def _save_shard(self, shard: int, index: faiss.Index) -> None:
+        path = self._shard_path(shard)
+        faiss.write_index(index, f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+
+    def flush(self) -> None:
+        """Save all shards with pending changes."""
+        with self._timers_guard:
+            pending = list(self._timers)
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+        for shard in pending:
+            with self._shard_locks[shard]:
+                self._save_shard(shard, self.shards[shard])
+
+
+
+class SharedUserStorage(VectorStore):
+    """User-scoped view of SharedIndexStore returned by `DatabaseManager.get_storage` in shared mode."""
+    def __init__(self, store: SharedIndexStore, user_id: str, embeddings: Embeddings):
+        self.store = store
+        self.user_id = str(user_id)
+        self.embedding_function = embeddings
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None, **kwargs) -> List[str]:
+        texts = list(texts)
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        self.store.add(self.user_id, ids, texts, metadatas, self.embedding_function.embed_documents(texts))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> Optional[bool]:
+        return self.store.delete(self.user_id, ids or []) > 0
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return self.store.search(self.user_id, [self.embedding_function.embed_query(query)], k)[0]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    @classmethod
+    def from_texts(
+            cls,
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            *,
+            store: SharedIndexStore,
+            user_id: str,
+            ids: Optional[List[str]] = None,
+            **kwargs,
+        ) -> 'SharedUserStorage':
+        """Add texts to a user's part of the given shared store and return the user's view of it."""
+        storage = cls(store, user_id, embedding)
+        storage.add_texts(texts, metadatas, ids=ids)
+        return storage
@@ -0,0 +1,161 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, List
+
+from config import catalog_db_path
+from utils.logging_config import setup_logging
+
+
+
+class SourceCatalog:
+    """
+    Persistent catalog of user's sources and their chunk ids.
+    Lets the bot list and delete sources without loading vector storages.
+    The catalog is kept in step with the index log: every change is applied together with
+    the sequence number of its log record in one SQLite transaction, so records missed
+    because of a crash can be re-applied from the log.
+    """
+    def __init__(self, db_path: str = catalog_db_path):
+        self._init_db(db_path)
+        self.logger = setup_logging('SourceCatalog')
+
+
+    def _init_db(self, db_path: str):
+        """Initialize SQLite database with the catalog tables."""
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS source_chunks (
+                user_id TEXT NOT NULL,
+                chunk_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                byte_size INTEGER NOT NULL,
+                uploaded_at REAL NOT NULL,
+                PRIMARY KEY (user_id, chunk_id)
+            )
+        """)
+        self.cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_source_chunks_source ON source_chunks (user_id, source)
+        """)
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_state (
+                user_id TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+
+    def get_seq(self, user_id: str) -> int:
+        """Sequence number of the last index log record applied to user's catalog, -1 if user has no catalog."""
+        with self.lock:
+            self.cursor.execute("SELECT seq FROM catalog_state WHERE user_id = ?", (str(user_id),))
+            result = self.cursor.fetchone()
+        return result[0] if result else -1
+
+
+    def apply(self, user_id: str, record: dict, seq: int) -> None:
+        """Apply an index log record (added chunks or tombstones) and remember its sequence number."""
+        user_id = str(user_id)
+        with self.lock, self.conn:
+            if record['op'] == 'add':
+                uploaded_at = record.get('time', time.time())
+                rows = [
+                    (user_id, chunk_id, metadata['source'], len(text.encode('utf-8')), uploaded_at)
+                    for chunk_id, text, metadata in zip(record['ids'], record['texts'], record['metadatas'])
+                    if 'source' in metadata
+                ]
+                self.conn.executemany("""
+                    INSERT OR REPLACE INTO source_chunks (user_id, chunk_id, source, byte_size, uploaded_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, rows)
+            elif record['op'] == 'delete':
+                self.conn.executemany(
+                    "DELETE FROM source_chunks WHERE user_id = ? AND chunk_id = ?",
+                    [(user_id, chunk_id) for chunk_id in record['ids']],
+                )
+            self.conn.execute("""
+                INSERT INTO catalog_state (user_id, seq) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET seq = MAX(seq, excluded.seq)
+            """, (user_id, seq))
+
+
+    def sync(self, user_id: str, records: Iterable[dict]) -> int:
+        """Apply index log records newer than the catalog. Returns number of applied records."""
+        seq = self.get_seq(user_id)
+        applied = 0
+        for record in records:
+            if record['seq'] > seq:
+                self.apply(user_id, record, record['seq'])
+                applied += 1
+        return applied
+
+
+    def rebuild(self, user_id: str, docs: Dict[str, object], seq: int) -> None:
+        """Build user's catalog from a loaded docstore (for storages created before the catalog existed)."""
+        user_id = str(user_id)
+        uploaded_at = time.time()
+        rows = [
+            (user_id, chunk_id, doc.metadata['source'], len(doc.page_content.encode('utf-8')), uploaded_at)
+            for chunk_id, doc in docs.items() if 'source' in doc.metadata
+        ]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM source_chunks WHERE user_id = ?", (user_id,))
+            self.conn.executemany("""
+                INSERT INTO source_chunks (user_id, chunk_id, source, byte_size, uploaded_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            self.conn.execute("INSERT OR REPLACE INTO catalog_state (user_id, seq) VALUES (?, ?)", (user_id, seq))
+        self.logger.info(f"Built catalog of {len(rows)} chunks for user {user_id}")
+
+
+    def list_sources(self, user_id: str) -> List[str]:
+        """Sorted names of user's sources."""
+        with self.lock:
+            self.cursor.execute(
+                "SELECT DISTINCT source FROM source_chunks WHERE user_id = ? ORDER BY source",
+                (str(user_id),),
+            )
+            return [row[0] for row in self.cursor.fetchall()]
+
+
+    def get_sources(self, user_id: str) -> List[Dict]:
+        """Chunk count, byte size and upload time of each of user's sources."""
+        with self.lock:
+            self.cursor.execute("""
+                SELECT source, COUNT(*), SUM(byte_size), MAX(uploaded_at)
+                FROM source_chunks WHERE user_id = ? GROUP BY source ORDER BY source
+            """, (str(user_id),))
+            rows = self.cursor.fetchall()
+        return [
+            {'source': source, 'chunk_count': count, 'byte_size': size, 'uploaded_at': uploaded_at}
+            for source, count, size, uploaded_at in rows
+        ]
+
+
+    def get_chunk_ids(self, user_id: str, source_prefix: str) -> List[str]:
+        """Chunk ids of all user's sources whose name starts with the given prefix."""
+        with self.lock:
+            self.cursor.execute("""
+                SELECT chunk_id FROM source_chunks
+                WHERE user_id = ? AND substr(source, 1, ?) = ?
+            """, (str(user_id), len(source_prefix), source_prefix))
+            return [row[0] for row in self.cursor.fetchall()]
+
+
+    def filter_chunk_ids(self, user_id: str, chunk_ids: List[str]) -> List[str]:
+        """Those of the given chunk ids that are in user's catalog."""
+        found = []
+        with self.lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                self.cursor.execute(
+                    f"SELECT chunk_id FROM source_chunks WHERE user_id = ? AND chunk_id IN ({', '.join('?' * len(batch))})",
+                    [str(user_id), *batch],
+                )
+                found += [row[0] for row in self.cursor.fetchall()]
+        return found
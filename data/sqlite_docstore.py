@@ -0,0 +1,87 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore that keeps chunk texts and metadata in a SQLite file instead of the Python heap.
+    Documents are fetched only when a search hit needs them.
+    Pickling stores just the file path, so the docstore can be saved with `FAISS.save_local`.
+    Writes are idempotent, which lets the index log be replayed on top of it.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._connect()
+
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS docs (
+                    id TEXT PRIMARY KEY,
+                    page_content TEXT NOT NULL,
+                    metadata TEXT NOT NULL
+                )
+            """)
+
+
+    def __getstate__(self) -> dict:
+        return {'db_path': self.db_path}
+
+
+    def __setstate__(self, state: dict):
+        self.db_path = state['db_path']
+        self._connect()
+
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        rows = [(doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in texts.items()]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO docs (id, page_content, metadata) VALUES (?, ?, ?)", rows)
+
+
+    def delete(self, ids: List) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+
+    def search(self, search: str) -> Union[str, Document]:
+        docs = self.search_many([search])
+        return docs.get(search, f"ID {search} not found.")
+
+
+    def search_many(self, ids: List[str]) -> Dict[str, Document]:
+        """Fetch several documents in one query."""
+        if not ids:
+            return {}
+        placeholders = ', '.join('?' * len(ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, page_content, metadata FROM docs WHERE id IN ({placeholders})", list(ids)
+            ).fetchall()
+        return {
+            doc_id: Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+            for doc_id, page_content, metadata in rows
+        }
+
+
+    def items(self) -> Iterator[Tuple[str, Document]]:
+        with self.lock:
+            rows = self.conn.execute("SELECT id, page_content, metadata FROM docs").fetchall()
+        for doc_id, page_content, metadata in rows:
+            yield doc_id, Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
@@ -0,0 +1,36 @@
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+
+from config import sqlite_pool_size, sqlite_busy_timeout
+
+
+
+class SQLitePool:
+    """
+    Fixed pool of SQLite connections in WAL mode, safe to use from executor threads.
+    WAL lets readers run alongside a writer, so each thread takes its own connection
+    instead of sharing one cursor behind a lock. Writes still wait for each other,
+    up to `sqlite_busy_timeout` seconds.
+    """
+    def __init__(self, db_path: str, size: int = sqlite_pool_size):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._pool = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(db_path, timeout=sqlite_busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # Durable in WAL mode except on power loss
+            self._pool.put(conn)
+
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection. Changes are committed on exit, or rolled back on error."""
+        conn = self._pool.get()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._pool.put(conn)
@@ -0,0 +1,139 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from utils.logging_config import setup_logging
+
+
+DOC_OVERHEAD_BYTES = 512  # Rough per-Document cost of the Python objects around the text
+ID_MAPPING_BYTES = 128  # Rough cost of one index_to_docstore_id entry
+
+
+def estimate_store_size(vector_storage: Any) -> int:
+    """
+    Approximate heap size of a loaded vector storage in bytes.
+    Memory-mapped flat vectors, IVF inverted lists, rescoring vectors and off-heap docstores are backed
+    by files and not counted, every other index is, whatever mode it was read in.
+    """
+    index = vector_storage.index
+    size = len(vector_storage.index_to_docstore_id) * ID_MAPPING_BYTES
+    if getattr(vector_storage, 'index_mmapped', False):
+        if hasattr(index, 'in_memory_bytes'):
+            size += index.in_memory_bytes()  # Vectors a mapped flat index got since its snapshot
+    else:
+        try:
+            code_size = index.sa_code_size()
+        except RuntimeError:
+            code_size = index.d * 4
+        size += index.ntotal * code_size
+        if hasattr(index, 'hnsw'):
+            size += index.ntotal * index.hnsw.nb_neighbors(0) * 4  # Links of the base layer
+    rescore_vectors = getattr(vector_storage, 'rescore_vectors', None)
+    if rescore_vectors is not None:
+        size += rescore_vectors.in_memory_bytes()
+
+    docs = getattr(vector_storage.docstore, '_dict', {})
+    for doc in docs.values():
+        size += len(doc.page_content.encode('utf-8')) + DOC_OVERHEAD_BYTES
+    return size
+
+
+class StorageCache:
+    """
+    LRU cache of loaded per-user vector storages bounded by a memory budget in bytes.
+    The most recently used storage is always kept, even if it alone exceeds the budget.
+    The time of the last use of every entry is kept, so it can be recorded when the entry is evicted.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._used_at: Dict[str, float] = dict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.logger = setup_logging('StorageCache')
+
+
+    def get(self, user_id: str) -> Optional[Any]:
+        """Return cached storage for a user and mark it as recently used."""
+        key = str(user_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._used_at[key] = time.time()
+            self.hits += 1
+            return entry[0]
+
+
+    def put(self, user_id: str, vector_storage: Any, used_at: Optional[float] = None) -> Dict[str, float]:
+        """
+        Insert or refresh a user's storage and evict least recently used entries over budget.
+        Args:
+            used_at: Time of the last use of the storage, now by default.
+        Returns:
+            Times of the last use of evicted storages by user id.
+        """
+        key = str(user_id)
+        size = estimate_store_size(vector_storage)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (vector_storage, size)
+            self._used_at[key] = time.time() if used_at is None else used_at
+            self._total_bytes += size
+            return self._evict()
+
+
+    def discard(self, user_id: str) -> None:
+        """Drop a user's storage from the cache."""
+        with self._lock:
+            entry = self._entries.pop(str(user_id), None)
+            self._used_at.pop(str(user_id), None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+
+    def has_room(self, size: int) -> bool:
+        with self._lock:
+            return self._total_bytes + size <= self.max_bytes
+
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return str(user_id) in self._entries
+
+
+    def last_used(self) -> Dict[str, float]:
+        """Times of the last use of cached storages by user id."""
+        with self._lock:
+            return dict(self._used_at)
+
+
+    def _evict(self) -> Dict[str, float]:
+        evicted = dict()
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (_, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            evicted[key] = self._used_at.pop(key)
+            self.logger.debug(f"Evicted storage of user {key} ({size} bytes)")
+        return evicted
+
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and current occupancy."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
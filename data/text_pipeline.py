@@ -0,0 +1,143 @@
+"""
+Streaming versions of `clean_md` and of the RecursiveCharacterTextSplitter used for documents.
+Text is processed line by line, so memory stays bounded by the longest line and one chunk
+instead of several copies of the whole document. Output is identical to
+`split_text(clean_md(text))` with separators ["\n", "."].
+"""
+import re
+import unicodedata
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+def iter_lines(text: str) -> Iterator[str]:
+    """Yield lines of a string split on "\\n" without copying the whole string."""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def iter_file_lines(path: str) -> Iterator[str]:
+    """Yield lines of a text file split on "\\n", the same as `iter_lines(f.read())`."""
+    with open(path, newline='') as f:
+        line = ""
+        for line in f:
+            yield line[:-1] if line.endswith('\n') else line
+        if not line or line.endswith('\n'):
+            yield ""
+
+
+def clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Apply `clean_md` to text given as lines (without "\\n").
+    Yields lines of the cleaned text, which joined with "\\n" equal `clean_md("\\n".join(lines))`.
+    """
+    first_content_seen = False
+    empty_after_content = False
+    n_lines = 0
+    for line in lines:
+        n_lines += 1
+        line = re.sub(r'!\[(.*)]\((.*)\)', "", line)
+        line = unicodedata.normalize('NFKC', line)
+        line = re.sub(r'[\x00-\x09\x0B-\x1F\x7F]', ' ', line)
+        if not line:  # Runs of empty lines collapse into one line break
+            if first_content_seen:
+                empty_after_content = True
+            continue
+        if not first_content_seen and n_lines > 1:
+            yield ""  # Text starts with a line break
+        first_content_seen = True
+        empty_after_content = False
+        line = re.sub(r'[ \t]+', ' ', line)
+        yield re.sub(r'�', '', line)
+
+    if first_content_seen:
+        if empty_after_content:
+            yield ""  # Text ends with a line break
+    elif n_lines > 1:
+        yield from ("", "")
+    elif n_lines == 1:
+        yield ""
+
+
+class StreamingSplitter:
+    """
+    RecursiveCharacterTextSplitter with separators ["\\n", "."] that consumes text line by line
+    and yields chunks as soon as they are complete.
+    """
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n", "."],
+        )
+        # Lines that are too long are split the same way the recursive splitter does it
+        self.line_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["."],
+        )
+
+
+    def split(self, lines: Iterable[str]) -> Iterator[str]:
+        lines = iter(lines)
+        first = next(lines, None)
+        if first is None:
+            return
+        second = next(lines, None)
+        if second is None:
+            # Without line breaks the recursive splitter starts from the next separator
+            yield from self.splitter.split_text(first)
+            return
+
+        current = deque()
+        total = 0
+        pieces = self._pieces(first, second, lines)
+        for piece in pieces:
+            if len(piece) >= self.chunk_size:
+                if current:
+                    yield from self._flush(current)
+                    current, total = deque(), 0
+                yield from self.line_splitter.split_text(piece)
+                continue
+
+            if total + len(piece) > self.chunk_size and current:
+                doc = self._join(current)
+                if doc is not None:
+                    yield doc
+                while total > self.chunk_overlap or (total + len(piece) > self.chunk_size and total > 0):
+                    total -= len(current.popleft())
+            current.append(piece)
+            total += len(piece)
+        yield from self._flush(current)
+
+
+    @staticmethod
+    def _pieces(first: str, second: str, rest: Iterator[str]) -> Iterator[str]:
+        """Splits of the text on "\\n" with the separator kept at the start of each split."""
+        if first:
+            yield first
+        yield "\n" + second
+        for line in rest:
+            yield "\n" + line
+
+
+    def _flush(self, current: deque) -> Iterator[str]:
+        doc = self._join(current)
+        if doc is not None:
+            yield doc
+
+
+    @staticmethod
+    def _join(current: deque) -> Optional[str]:
+        text = "".join(current).strip()
+        return text or None
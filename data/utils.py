@@ -1,4 +1,5 @@
 import re
+import hashlib
 import unicodedata
 
 
@@ -28,3 +29,11 @@ def clean_md(content):
     content = re.sub(r'[ \t]+', ' ', content)
     content = re.sub(r'�', '', content)
     return content
+
+
+def get_doc_id(doc) -> str:
+    """Docstore id of a chunk, or a content hash for documents stored without an id"""
+    if getattr(doc, 'id', None):
+        return doc.id
+    key = f"{doc.metadata.get('source', '')}\n{doc.page_content}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
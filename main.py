@@ -1,8 +1,11 @@
 from config import TG_BOT_TOKEN
-from bot.telegram_bot import SmartReaderBot
+from utils.warmup import startup_phase
 
 def main():
-    bot = SmartReaderBot(TG_BOT_TOKEN)
+    with startup_phase('imports'):
+        from bot.telegram_bot import SmartReaderBot
+    with startup_phase('build application'):
+        bot = SmartReaderBot(TG_BOT_TOKEN)
     bot.run()
 
 if __name__ == "__main__":
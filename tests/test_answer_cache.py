@@ -0,0 +1,26 @@
+import time
+
+from data.answer_cache import SemanticAnswerCache
+
+
+def test_expired_entries_are_evicted_under_size_pressure():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=0.05, max_size=2)
+    cache.put('user', 1, 'en', {'a'}, [1.0, 0.0], "first")
+    cache.put('user', 1, 'en', {'b'}, [0.0, 1.0], "second")
+    time.sleep(0.1)
+
+    assert cache.get('user', 1, 'en', {'a'}, [1.0, 0.0]) is None  # Expired, the group is dropped
+    cache.put('user', 1, 'en', {'c'}, [1.0, 0.0], "third")
+    cache.put('user', 1, 'en', {'d'}, [1.0, 0.0], "fourth")
+
+    assert cache.stats()['entries'] == 2
+    assert cache.get('user', 1, 'en', {'d'}, [1.0, 0.0]) == "fourth"
+
+
+def test_hit_requires_the_same_context():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60, max_size=8)
+    cache.put('user', 1, 'en', {'a'}, [1.0, 0.0], "answer")
+
+    assert cache.get('user', 1, 'en', {'a'}, [0.99, 0.01]) == "answer"
+    assert cache.get('user', 1, 'en', {'b'}, [1.0, 0.0]) is None
+    assert cache.get('user', 2, 'en', {'a'}, [1.0, 0.0]) is None
@@ -1,22 +1,106 @@
 import os
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional
 from markitdown import MarkItDown
 from markitdown._markitdown import UnsupportedFormatException
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from config import (
     chunk,
-    chunk_overlap
+    chunk_overlap,
+    use_content_cache,
 )
+from data.content_cache import ContentCache, file_hash
 from data.utils import clean_md
-from data.database_manager import DatabaseManager
+from data.text_pipeline import iter_lines, iter_file_lines, clean_lines, StreamingSplitter
+from utils.executors import run_blocking
+from utils.metrics import Metrics
+from utils.logging_config import setup_logging
 
 
+# Ingestion worker processes import this module, so models are loaded lazily through DatabaseManager
+logger = setup_logging('FileProcessor')
+
+
+def read_file(file_path: str) -> str:
+    """Read a text file or convert any other supported file to raw Markdown."""
+    if os.path.splitext(file_path)[-1].lower() in ['.txt', '.md']:
+        with open(file_path) as f:
+            return f.read()
+    md = MarkItDown()
+    return md.convert(file_path).text_content or ""
+
+
+def convert_file(file_path: str) -> str:
+    """Convert a file to Markdown and clean the result."""
+    markdown_result = read_file(file_path)
+    return clean_md(markdown_result) if markdown_result else ""
+
+
+def split_markdown(markdown: str, source: str) -> List[Document]:
+    """Split Markdown text of one source into chunks."""
+    text_splitter = StreamingSplitter(chunk_size=chunk, chunk_overlap=chunk_overlap)
+    return [Document(page_content=text, metadata={'source': source}) for text in text_splitter.split(iter_lines(markdown))]
+
+
+def iter_chunks(
+        raw_markdown: str,
+        source: str,
+        md_file: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> Iterator[Document]:
+    """
+    Clean converted Markdown and split it into chunks line by line, writing the cleaned text
+    to `md_file` on the way. Chunks are the same as `split_markdown(clean_md(raw_markdown))`.
+    Args:
+        progress_callback: Called with the number of processed and total characters after each chunk
+    """
+    total = len(raw_markdown)
+    consumed = 0
+
+    def lines():
+        with open(md_file, 'w') as out:
+            for i, line in enumerate(clean_lines(raw_lines())):
+                out.write(line if i == 0 else '\n' + line)
+                yield line
+
+    def raw_lines():
+        nonlocal consumed
+        for line in iter_lines(raw_markdown):
+            consumed += len(line) + 1
+            yield line
+
+    text_splitter = StreamingSplitter(chunk_size=chunk, chunk_overlap=chunk_overlap)
+    for text in text_splitter.split(lines()):
+        if progress_callback is not None:
+            progress_callback(min(consumed, total), total)
+        yield Document(page_content=text, metadata={'source': source})
+
+
+def iter_markdown_chunks(
+        md_file: str,
+        source: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+    ) -> Iterator[Document]:
+    """Split an already cleaned Markdown file into chunks line by line."""
+    total = os.path.getsize(md_file)
+    consumed = 0
+
+    def lines():
+        nonlocal consumed
+        for line in iter_file_lines(md_file):
+            consumed += len(line.encode('utf-8')) + 1
+            yield line
+
+    text_splitter = StreamingSplitter(chunk_size=chunk, chunk_overlap=chunk_overlap)
+    for text in text_splitter.split(lines()):
+        if progress_callback is not None:
+            progress_callback(min(consumed, total), max(total, 1))
+        yield Document(page_content=text, metadata={'source': source})
+
 
 async def process_file(
-        file_path: str, 
-        user_id: str, 
+        file_path: str,
+        user_id: str,
         source: Optional[str] = None,
         cleanup_original: bool = True,
         cleanup_markdown: bool = True,
@@ -32,95 +116,76 @@ async def process_file(
     Returns:
         success_status
     """
-    db_manager = DatabaseManager()
-    db_manager.logger.info(f'Processing file from user {user_id}.')
+    logger.info(f'Processing file from user {user_id}.')
 
     if not os.path.exists(file_path):
-        db_manager.logger.error(f'File not found: {file_path}')
+        logger.error(f'File not found: {file_path}')
         return False
-    
+
     if source is None:
         source = os.path.basename(file_path)
-    
+
     md_file = f'{os.path.splitext(file_path)[0]}.md'
 
-    try:
-        markdown_result = await convert_to_markdown(file_path, user_id, source)
-        if markdown_result is None:
-            return False
+    from data.database_manager import DatabaseManager
 
-        with open(md_file, 'w') as out:
-            out.write(markdown_result)
-        db_manager.logger.info(f'File from user {user_id} converted to md format.')
+    try:
+        content_hash, cached = None, False
+        if use_content_cache:
+            content_hash = await run_blocking(file_hash, file_path)
+            cached = await run_blocking(ContentCache().copy_markdown, content_hash, md_file)
 
-        docs = [Document(page_content=markdown_result, metadata={'source': source})]
+        if cached:
+            logger.info(f'Markdown of {source} from user {user_id} served from the content cache.')
+            chunks = iter_markdown_chunks(md_file, source)
+        else:
+            raw_markdown = await convert_to_markdown(file_path, user_id, source)
+            if raw_markdown is None:
+                return False
+            chunks = iter_chunks(raw_markdown, source, md_file)
 
-        chunks_added = await add_docs_to_database(docs, user_id)
-        if not chunks_added:
+        # Chunks are cleaned, split and embedded as a stream, like uploads in the ingestion queue
+        if not await run_blocking(DatabaseManager().add_docs, chunks, user_id):
             return False
-        db_manager.logger.info(f'{chunks_added} chunks from {source} added to user {user_id} database.')
-
-        if cleanup_original:
-            os.remove(file_path)
-            db_manager.logger.info(f'File {source} from user {user_id} deleted from local directory.')
-        
-        if cleanup_markdown and os.path.exists(md_file):
-            os.remove(md_file)
-            db_manager.logger.info(f'Generated markdown file {md_file} deleted from local directory.')
+        logger.info(f'{source} from user {user_id} added to the database.')
+        if content_hash is not None and not cached:
+            await run_blocking(ContentCache().put_markdown, content_hash, md_file)
+
+        await run_blocking(cleanup_files, file_path, md_file, cleanup_original, cleanup_markdown)
         return True
-    
+
     except UnsupportedFormatException:
-        db_manager.logger.exception(f'File {source} from user {user_id} has unsupported format.')
+        logger.exception(f'File {source} from user {user_id} has unsupported format.')
         return False
     except Exception as e:
-        db_manager.logger.exception(f'Unexpected error processing file {source}: {str(e)}')
+        logger.exception(f'Unexpected error processing file {source}: {str(e)}')
         return False
-    
+
+
+def cleanup_files(file_path: str, md_file: str, cleanup_original: bool, cleanup_markdown: bool) -> None:
+    """Delete the uploaded file and the generated markdown file if enabled."""
+    if cleanup_original and os.path.exists(file_path):
+        os.remove(file_path)
+        logger.info(f'File {file_path} deleted from local directory.')
+
+    if cleanup_markdown and os.path.exists(md_file):
+        os.remove(md_file)
+        logger.info(f'Generated markdown file {md_file} deleted from local directory.')
+
 
 async def convert_to_markdown(file_path: str, user_id: str, source: str) -> Optional[str]:
-    """Convert a file to Markdown format.""" 
-    db_manager = DatabaseManager()   
+    """Convert a file to raw Markdown, which is cleaned while it is split."""
     try:
-        if os.path.splitext(file_path)[-1].lower() in ['.txt', '.md']:
-            with open(file_path) as f:
-                markdown_result = f.read()
-        else:
-            md = MarkItDown()
-            markdown_result = md.convert(file_path).text_content
-            if not markdown_result:
-                db_manager.logger.error(f'No text found in {source}, user: {user_id}')
-                return
-        
-        markdown_result = clean_md(markdown_result)
+        with Metrics().timer('convert'):
+            markdown_result = await run_blocking(read_file, file_path)
+        if not markdown_result:
+            logger.error(f'No text found in {source}, user: {user_id}')
+            return
         return markdown_result
 
     except UnsupportedFormatException:
-        db_manager.logger.exception(f'File {source} from user {user_id} has unsupported format.')
+        logger.exception(f'File {source} from user {user_id} has unsupported format.')
         return
     except Exception as e:
-        db_manager.logger.exception(f'Unexpected error processing file {source}, user: {user_id}: {str(e)}')
+        logger.exception(f'Unexpected error processing file {source}, user: {user_id}: {str(e)}')
         return
-
-
-async def add_docs_to_database(documents: List[Document], user_id: str) -> Optional[int]:
-    """
-    Split text to chunks and add the chunks to user's databse.
-    Args:
-        documents: List of Document objects to process
-        user_id: Telegram ID of the user who owns the documents
-    Returns:
-        Number of chunks added to the database (if added)
-    """
-    db_manager = DatabaseManager()
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk,
-        chunk_overlap=chunk_overlap,
-        separators=["\n", "."],
-    )
-    chunks = text_splitter.split_documents(documents)
-    db_manager.logger.info(f'Text from user {user_id} split into {len(chunks)} chunks.')
-    
-    
-    added_ok = db_manager.add_docs(chunks, user_id)
-    if added_ok:
-        return len(chunks)
\ No newline at end of file
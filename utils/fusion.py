@@ -0,0 +1,45 @@
+from typing import Callable, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from config import rrf_k
+from data.utils import get_doc_id
+
+
+# Each row is a ranked list of (Document, L2 distance) pairs for one query
+Rows = List[List[Tuple[Document, float]]]
+
+
+def reciprocal_rank_fusion(rows: Rows) -> List[Document]:
+    """Rank documents by the sum of 1 / (rrf_k + rank) over all queries that found them."""
+    scores, docs = dict(), dict()
+    for row in rows:
+        for rank, (doc, _) in enumerate(row):
+            doc_id = get_doc_id(doc)
+            docs.setdefault(doc_id, doc)
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return [docs[doc_id] for doc_id in sorted(scores, key=scores.get, reverse=True)]
+
+
+def max_score_fusion(rows: Rows) -> List[Document]:
+    """Rank documents by their best (smallest) distance to any of the queries."""
+    distances, docs = dict(), dict()
+    for row in rows:
+        for doc, distance in row:
+            doc_id = get_doc_id(doc)
+            docs.setdefault(doc_id, doc)
+            distances[doc_id] = min(distances.get(doc_id, distance), distance)
+    return [docs[doc_id] for doc_id in sorted(distances, key=distances.get)]
+
+
+FUSION_STRATEGIES: Dict[str, Callable[[Rows], List[Document]]] = {
+    "rrf": reciprocal_rank_fusion,
+    "max": max_score_fusion,
+}
+
+
+def fuse(rows: Rows, strategy: str) -> List[Document]:
+    """Merge per-query results by docstore id with the selected fusion strategy."""
+    if strategy not in FUSION_STRATEGIES:
+        raise ValueError(f"Unknown fusion strategy '{strategy}', expected one of {list(FUSION_STRATEGIES)}")
+    return FUSION_STRATEGIES[strategy](rows)
@@ -0,0 +1,215 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter
+
+from config import (
+    ingest_workers,
+    ingest_max_jobs,
+    ingest_max_jobs_per_user,
+    stream_edit_interval,
+    cleanup_original,
+    cleanup_markdown,
+    use_content_cache,
+)
+from data.content_cache import ContentCache, file_hash
+from data.job_store import JobStore
+from data.language_manager import LanguageManager
+from utils.file_processor import iter_chunks, iter_markdown_chunks, cleanup_files
+from utils.parallel_conversion import plan_parts, convert_part, join_parts
+from utils.executors import run_blocking
+from utils.metrics import Metrics
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+from utils.warmup import ModelWarmup
+
+
+
+@singleton
+class IngestionQueue:
+    """
+    Processes uploaded files in the background, so uploads don't block queries.
+    Conversion runs in a pool of `ingest_workers` processes, large PDFs and workbooks are converted
+    in page or sheet ranges in parallel. Cleaning, splitting and embedding run as a stream in one
+    dedicated thread, so ingestion doesn't take the threads used for queries. At most
+    `ingest_max_jobs` jobs and `ingest_max_jobs_per_user` jobs of one user are processed at once,
+    the rest wait in the queue. Job states are kept in the JobStore, and the user gets one status
+    message that is edited as the job moves through the stages.
+    """
+    def __init__(self):
+        self.jobs = JobStore()
+        self.lang_manager = LanguageManager()
+        self._global_slots = asyncio.Semaphore(ingest_max_jobs)
+        self._user_slots: Dict[int, asyncio.Semaphore] = dict()
+        self._tasks = set()
+        self._process_pool = None
+        self._embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest-embed')
+        self.logger = setup_logging('IngestionQueue')
+
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # Forking a process with an initialized CUDA context is unsafe, so workers are spawned
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=ingest_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._process_pool
+
+
+    def submit(self, bot: Bot, user_id: int, file_path: str, source: str, chat_id: int, message_id: int, lang: str) -> str:
+        """
+        Queue a downloaded file for ingestion. Progress is reported by editing the message `message_id`.
+        Returns:
+            Id of the job.
+        """
+        job_id = self.jobs.create(user_id, source, file_path, chat_id, message_id, lang)
+        self._start(bot, self.jobs.get(job_id))
+        self.logger.info(f'Queued ingestion job {job_id} for {source} from user {user_id}.')
+        return job_id
+
+
+    def resume(self, bot: Bot, before: Optional[float] = None) -> int:
+        """
+        Requeue jobs that were interrupted by a restart. Chunks a job logged before it was
+        interrupted are deleted before it embeds the file again.
+        Jobs created at or after `before` (the start of this run) are already queued and are skipped.
+        Returns:
+            Number of resumed jobs.
+        """
+        resumed = 0
+        for job in self.jobs.get_active():
+            if before is not None and job['created_at'] >= before:
+                continue
+            if not os.path.exists(job['file_path']):
+                self.jobs.update(job['job_id'], 'failed', error='Uploaded file is missing after restart')
+                continue
+            self.jobs.update(job['job_id'], 'queued')
+            self._start(bot, job)
+            resumed += 1
+        if resumed:
+            self.logger.info(f'Resumed {resumed} interrupted ingestion jobs.')
+        return resumed
+
+
+    def _start(self, bot: Bot, job: dict):
+        task = asyncio.create_task(self._run(bot, job))
+        self._tasks.add(task)  # Keep a reference until the task is done
+        task.add_done_callback(self._tasks.discard)
+
+
+    async def _run(self, bot: Bot, job: dict):
+        user_slots = self._user_slots.setdefault(job['user_id'], asyncio.Semaphore(ingest_max_jobs_per_user))
+        async with user_slots, self._global_slots:
+            try:
+                await self._process(bot, job)
+            except Exception as e:
+                self.logger.exception(f"Ingestion job {job['job_id']} failed: {e}")
+                await run_blocking(self.jobs.update, job['job_id'], 'failed', error=str(e))
+                message = self.lang_manager.get_message('file_failed', job['lang']).format(e=e)
+                await self._report(bot, job, message)
+
+
+    async def _process(self, bot: Bot, job: dict):
+        from data.database_manager import DatabaseManager
+
+        loop = asyncio.get_running_loop()
+        job_id, user_id, source, lang = job['job_id'], job['user_id'], job['source'], job['lang']
+        md_file = f"{os.path.splitext(job['file_path'])[0]}.md"
+
+        await run_blocking(self.jobs.update, job_id, 'converting')
+        await self._report(bot, job, self.lang_manager.get_message('job_converting', lang).format(file_name=source))
+        content_hash, cached = None, False
+        if use_content_cache:
+            content_hash = await loop.run_in_executor(self._get_process_pool(), file_hash, job['file_path'])
+            cached = await run_blocking(ContentCache().copy_markdown, content_hash, md_file)
+        if not cached:
+            with Metrics().timer('convert'):
+                raw_markdown = await self._convert(bot, job)
+        else:
+            self.logger.info(f'Markdown of {source} from user {user_id} served from the content cache.')
+
+        progress = {'percent': 0}
+        def on_progress(done: int, total: int):
+            progress['percent'] = done * 100 // total
+
+        # Chunks are cleaned, split and embedded as a stream, without holding copies of the whole text
+        await ModelWarmup().wait_ready()  # Uploads during startup are converted while the models load
+        db_manager = DatabaseManager()
+        stale_ids = await run_blocking(self.jobs.get_chunks, job_id)
+        if stale_ids:
+            # The job was interrupted while embedding, drop the batches it logged before embedding again
+            await run_blocking(db_manager.delete_chunks, stale_ids, user_id)
+            await run_blocking(self.jobs.clear_chunks, job_id)
+        await run_blocking(self.jobs.update, job_id, 'embedding')
+        if not cached:
+            chunks = iter_chunks(raw_markdown, source, md_file, on_progress)
+        else:
+            chunks = iter_markdown_chunks(md_file, source, on_progress)
+        add_docs = functools.partial(db_manager.add_docs, chunks, user_id, on_batch=functools.partial(self.jobs.add_chunks, job_id))
+        future = loop.run_in_executor(self._embed_executor, add_docs)
+        reported = None
+        while True:
+            if progress['percent'] != reported:
+                reported = progress['percent']
+                await run_blocking(self.jobs.update, job_id, 'embedding', progress=reported)
+                message = self.lang_manager.get_message('job_embedding', lang).format(file_name=source, progress=reported)
+                await self._report(bot, job, message)
+            if future.done():
+                break
+            await asyncio.wait({future}, timeout=stream_edit_interval)
+
+        if not future.result():
+            await run_blocking(self.jobs.update, job_id, 'failed', error='No text found or failed to add chunks to the database')
+            await self._report(bot, job, self.lang_manager.get_message('proc_file_fail', lang).format(file_name=source))
+            return
+
+        await run_blocking(self.jobs.update, job_id, 'indexed', progress=100)
+        if content_hash is not None and not cached:
+            await run_blocking(ContentCache().put_markdown, content_hash, md_file)
+        await run_blocking(cleanup_files, job['file_path'], md_file, cleanup_original, cleanup_markdown)
+        self.logger.info(f'{source} added to user {user_id} database.')
+        await self._report(bot, job, self.lang_manager.get_message('proc_file_ok', lang).format(file_name=source))
+
+
+    async def _convert(self, bot: Bot, job: dict) -> str:
+        """Convert the file in page or sheet ranges spread over the worker processes."""
+        loop = asyncio.get_running_loop()
+        pool = self._get_process_pool()
+        parts = await loop.run_in_executor(pool, plan_parts, job['file_path'], ingest_workers)
+        futures = [loop.run_in_executor(pool, convert_part, job['file_path'], part) for part in parts]
+        if len(parts) > 1:
+            self.logger.info(f"Converting {job['source']} in {len(parts)} parts: {parts}")
+            for done, future in enumerate(asyncio.as_completed(futures), start=1):
+                await future
+                progress = done * 100 // len(parts)
+                await run_blocking(self.jobs.update, job['job_id'], 'converting', progress=progress)
+                message = self.lang_manager.get_message('job_converting_parts', job['lang'])
+                await self._report(bot, job, message.format(file_name=job['source'], progress=progress))
+        texts = await asyncio.gather(*futures)
+        if len(texts) == 1:
+            return texts[0]
+        # Joining runs over the whole text, so it is done in a worker too
+        return await loop.run_in_executor(pool, join_parts, job['file_path'], texts)
+
+
+    async def _report(self, bot: Bot, job: dict, text: str):
+        """Edit the job's status message. Failed edits don't affect the job."""
+        try:
+            await bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['message_id'])
+        except RetryAfter as e:
+            self.logger.warning(f"Skipped status update of job {job['job_id']}, flood control for {e.retry_after}s")
+        except BadRequest as e:
+            self.logger.debug(f"Status update of job {job['job_id']} failed: {e}")
+
+
+    def shutdown(self):
+        """Stop worker processes. Unfinished jobs are resumed on the next start."""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+        self._embed_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,7 @@
 import re
-from typing import List, Optional, Type
+import time
+from typing import AsyncIterator, List, Optional, Type
+import httpx
 import openai
 from pydantic import BaseModel
 
@@ -10,11 +12,27 @@ from config import (
     max_tokens,
     temperature,
     temperature_structured,
+    llm_max_connections,
+    llm_timeout,
+    llm_max_attempts,
+    llm_cjk_logit_bias,
 )
+from utils.executors import run_blocking
+from utils.metrics import Metrics
 from utils.logging_config import setup_logging
 from utils.singleton import singleton
 
 
+CHINESE_PATTERN = re.compile(u'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+
+
+class StreamReset(str):
+    """Yielded by stream_text when the text streamed so far is discarded and the answer starts over."""
+
+
+STREAM_RESET = StreamReset()
+
+
 
 @singleton
 class LLMService:
@@ -22,19 +40,52 @@ class LLMService:
        Singleton class for managing interactions with the Language Model (LLM).
        This class handles the initialization of the LLM client and provides methods
        for generating text and structured data based on prompts.
+       Async methods share one pooled HTTP connection to the endpoint.
+       Completions are streamed and cancelled as soon as chinese symbols appear, then retried.
     """
     def __init__(self):
         if not LLM_API_KEY or not LLM_ENDPOINT:
             raise ValueError("LLM_API_KEY/LLM_ENDPOINT environment variable not set")
         self.client = openai.OpenAI(api_key=LLM_API_KEY, base_url=LLM_ENDPOINT)
+        self.async_client = openai.AsyncOpenAI(
+            api_key=LLM_API_KEY,
+            base_url=LLM_ENDPOINT,
+            timeout=llm_timeout,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=llm_max_connections,
+                    max_keepalive_connections=llm_max_connections,
+                ),
+            ),
+        )
+        self.metrics = Metrics()
         self.logger = setup_logging('LLMService')
+        self._cjk_bias = None
 
 
     def _has_chinese(self, text: str) -> bool:
-        return bool(re.search(u'[\u4e00-\u9fff]', text))
+        return bool(CHINESE_PATTERN.search(text))
 
 
-    def _generate_completion(self, messages: List[dict], schema: Optional[Type[BaseModel]] = None):
+    def cjk_logit_bias(self) -> dict:
+        """
+        Bias of -100 for every token of the model's tokenizer that decodes to chinese symbols.
+        Loads the tokenizer on first use, the warm-up calls this when llm_cjk_logit_bias is on.
+        """
+        if self._cjk_bias is None:
+            try:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                tokens = tokenizer.batch_decode([[token_id] for token_id in range(len(tokenizer))])
+                self._cjk_bias = {str(token_id): -100 for token_id, token in enumerate(tokens) if self._has_chinese(token)}
+                self.logger.info(f"Built logit bias against {len(self._cjk_bias)} CJK tokens of {model_name}")
+            except Exception as e:
+                self.logger.warning(f"Could not build logit bias against CJK tokens: {e}")
+                self._cjk_bias = dict()
+        return self._cjk_bias
+
+
+    def _build_params(self, messages: List[dict], schema: Optional[Type[BaseModel]] = None) -> dict:
         params = {
             "model": model_name,
             "temperature": temperature,
@@ -47,18 +98,88 @@ class LLMService:
                 "extra_body": {"guided_decoding_backend": "outlines"},
                 "temperature": temperature_structured,
             })
+        return params
+
+
+    def _parse_completion(self, completion, schema: Optional[Type[BaseModel]] = None) -> tuple[any, bool]:
+        """Extract the result from a completion and check it for chinese symbols."""
+        if not schema:
+            result = completion.choices[0].message.content
+            return result, not self._has_chinese(result)
+        result = completion.choices[0].message.parsed
+        return result, not any([self._has_chinese(elem) for elem in list(result)[0][-1]])
+
 
-        for _ in range(3):
-            completion = self.client.beta.chat.completions.parse(**params)
-            if not schema:
-                result = completion.choices[0].message.content
-                if not self._has_chinese(result):
-                    return result
-            else:
-                result = completion.choices[0].message.parsed
-                if not any([self._has_chinese(elem) for elem in list(result)[0][-1]]):
-                    return result
-            self.logger.warning(f"Response contains chinese symbols, trying again")
+    def _retry_params(self, params: dict) -> dict:
+        if not llm_cjk_logit_bias or 'logit_bias' in params:
+            return params
+        bias = self.cjk_logit_bias()
+        return {**params, 'logit_bias': bias} if bias else params
+
+
+    def _discard(self, tokens: int, attempt: int):
+        self.metrics.inc('llm_retries_total', reason='chinese')
+        self.metrics.inc('llm_wasted_tokens_total', tokens, reason='chinese')
+        self.logger.warning(f"Response contains chinese symbols, discarded {tokens} tokens of attempt {attempt + 1} and trying again")
+
+
+    def _stream_completion(self, params: dict, abort: bool) -> tuple[any, int]:
+        """
+        Stream a completion and count its content deltas (about one per token).
+        With `abort` the stream is closed on the first chinese symbol and None is returned.
+        """
+        tokens = 0
+        with self.client.beta.chat.completions.stream(**params) as stream:
+            for event in stream:
+                if event.type == 'content.delta':
+                    tokens += 1
+                    if abort and self._has_chinese(event.delta):
+                        return None, tokens
+            return stream.get_final_completion(), tokens
+
+
+    async def _astream_completion(self, params: dict, abort: bool) -> tuple[any, int]:
+        tokens = 0
+        async with self.async_client.beta.chat.completions.stream(**params) as stream:
+            async for event in stream:
+                if event.type == 'content.delta':
+                    tokens += 1
+                    if abort and self._has_chinese(event.delta):
+                        return None, tokens
+            return await stream.get_final_completion(), tokens
+
+
+    def _generate_completion(self, messages: List[dict], schema: Optional[Type[BaseModel]] = None):
+        params = self._build_params(messages, schema)
+        for attempt in range(llm_max_attempts):
+            is_last = attempt == llm_max_attempts - 1
+            with self.metrics.timer('llm'):
+                completion, tokens = self._stream_completion(params, abort=not is_last)
+            if completion is not None:
+                result, is_clean = self._parse_completion(completion, schema)
+                if is_clean or is_last:
+                    break
+            self._discard(tokens, attempt)
+            params = self._retry_params(params)
+        if not is_clean:
+            self.logger.warning(f"Response still contains chinese symbols after {llm_max_attempts} attempts")
+        return result
+
+
+    async def _agenerate_completion(self, messages: List[dict], schema: Optional[Type[BaseModel]] = None):
+        params = self._build_params(messages, schema)
+        for attempt in range(llm_max_attempts):
+            is_last = attempt == llm_max_attempts - 1
+            with self.metrics.timer('llm'):
+                completion, tokens = await self._astream_completion(params, abort=not is_last)
+            if completion is not None:
+                result, is_clean = self._parse_completion(completion, schema)
+                if is_clean or is_last:
+                    break
+            self._discard(tokens, attempt)
+            params = await run_blocking(self._retry_params, params)
+        if not is_clean:
+            self.logger.warning(f"Response still contains chinese symbols after {llm_max_attempts} attempts")
         return result
 
 
@@ -84,6 +205,73 @@ class LLMService:
         return result
 
 
+    async def agenerate_text(self, prompt: str, message: str) -> str:
+        self.logger.info("Processing async text generation request")
+        messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": message},
+        ]
+        result = await self._agenerate_completion(messages)
+        self._log_result(result, message)
+        return result
+
+
+    async def agenerate_structured(self, prompt: str, message: str, schema: Type[BaseModel]):
+        self.logger.info("Processing async structured generation request")
+        messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": message},
+        ]
+        result = await self._agenerate_completion(messages, schema)
+        self._log_result(result, message, schema=schema)
+        return result
+
+
+    async def stream_text(self, prompt: str, message: str) -> AsyncIterator[str]:
+        """
+        Generate text and yield content deltas as soon as the endpoint sends them.
+        If chinese symbols appear, the stream is closed, `STREAM_RESET` is yielded
+        and the answer is generated again. The last attempt is kept as is.
+        """
+        self.logger.info("Processing streaming text generation request")
+        params = self._build_params([
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": message},
+        ])
+        for attempt in range(llm_max_attempts):
+            is_last = attempt == llm_max_attempts - 1
+            is_clean = True
+            tokens = 0
+            result = ""
+            start = time.perf_counter()
+            with self.metrics.timer('llm_stream'):
+                stream = await self.async_client.chat.completions.create(**params, stream=True)
+                async with stream:
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        tokens += 1
+                        if self._has_chinese(delta):
+                            is_clean = False
+                            if not is_last:
+                                break
+                        if not result:
+                            self.metrics.observe('llm_first_token', time.perf_counter() - start)
+                        result += delta
+                        yield delta
+            if is_clean or is_last:
+                break
+            self._discard(tokens, attempt)
+            params = await run_blocking(self._retry_params, params)
+            yield STREAM_RESET
+        if not is_clean:
+            self.logger.warning(f"Response still contains chinese symbols after {llm_max_attempts} attempts")
+        self._log_result(result, message)
+
+
     def _log_result(self, result: any, message: str, schema: Optional[Type[BaseModel]] = None):
         if result:
             self.logger.info("Response received successfully")
@@ -0,0 +1,246 @@
+"""
+Lightweight in-process metrics: stage timers with histograms, counters and gauges.
+Exported in the Prometheus text format on a local HTTP endpoint and summarized by the /stats command.
+"""
+import os
+import time
+import bisect
+import resource
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from config import metrics_host, metrics_port, metrics_window
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+PREFIX = "smartreader"
+# Upper bounds of histogram buckets in seconds, from a cached lookup to a long LLM answer
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+
+class Histogram:
+    """Cumulative bucket counts for Prometheus and a window of recent samples for percentiles."""
+    def __init__(self, window: int):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+    def percentiles(self, qs=(50, 95, 99)) -> List[float]:
+        if not self.recent:
+            return [0.0] * len(qs)
+        return [float(p) for p in np.percentile(np.fromiter(self.recent, dtype=np.float64), qs)]
+
+
+
+@singleton
+class Metrics:
+    """
+    Registry of stage latencies (`stage_seconds`), counters and gauges.
+    Gauges and counters that other components already track can be registered as callbacks,
+    which are read when the metrics are exported.
+    """
+    def __init__(self, window: int = metrics_window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = dict()
+        self._counters: Dict[Tuple[str, Labels], float] = dict()
+        self._gauges: Dict[Tuple[str, Labels], float] = dict()
+        self._callbacks: Dict[str, Tuple[str, str, Optional[str], Callable]] = dict()
+        self._help: Dict[str, str] = dict()
+        self._server = None
+        self.logger = setup_logging('Metrics')
+        self.register_callback('process_resident_memory_bytes', 'gauge', "Resident memory of the bot process", _resident_memory)
+
+
+    def observe(self, stage: str, seconds: float, **labels):
+        key = ('stage_seconds', _labels({'stage': stage, **labels}))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.window)
+            histogram.observe(seconds)
+
+
+    @contextmanager
+    def timer(self, stage: str, **labels) -> Iterator[None]:
+        """Time a block as a stage. Exceptions leaving the block are counted in `errors_total`."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('errors_total', stage=stage)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+
+    def register_callback(self, name: str, kind: str, help_text: str, func: Callable[[], Union[float, Dict[str, float]]], label: Optional[str] = None):
+        """
+        Register a gauge or counter read from `func` on export.
+        With `label`, `func` returns a mapping of label values to numbers.
+        """
+        with self._lock:
+            self._callbacks[name] = (kind, help_text, label, func)
+
+
+    def _read_callbacks(self) -> List[Tuple[str, str, str, Labels, float]]:
+        with self._lock:
+            callbacks = list(self._callbacks.items())
+        samples = []
+        for name, (kind, help_text, label, func) in callbacks:
+            try:
+                value = func()
+            except Exception as e:
+                self.logger.debug(f"Metric callback {name} failed: {e}")
+                continue
+            if label is None:
+                samples.append((name, kind, help_text, (), float(value)))
+            else:
+                samples += [(name, kind, help_text, ((label, str(key)),), float(v)) for key, v in value.items()]
+        return samples
+
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            histograms = [(key, list(h.bucket_counts), h.count, h.sum) for key, h in self._histograms.items()]
+            counters = list(self._counters.items())
+            gauges = list(self._gauges.items())
+
+        if histograms:
+            lines += [f"# HELP {PREFIX}_stage_seconds Latency of request and ingestion stages", f"# TYPE {PREFIX}_stage_seconds histogram"]
+        for (name, labels), bucket_counts, count, total in sorted(histograms):
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ('+Inf',), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{PREFIX}_{name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{PREFIX}_{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{PREFIX}_{name}_count{_format_labels(labels)} {count}")
+
+        samples = [(name, 'counter', "", labels, value) for (name, labels), value in counters]
+        samples += [(name, 'gauge', "", labels, value) for (name, labels), value in gauges]
+        samples += self._read_callbacks()
+        declared = set()
+        for name, kind, help_text, labels, value in sorted(samples, key=lambda s: (s[0], s[3])):
+            if name not in declared:
+                declared.add(name)
+                if help_text:
+                    lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    def summary(self) -> Dict[str, dict]:
+        """Count and p50/p95/p99 in milliseconds of each stage over the recent window."""
+        with self._lock:
+            histograms = {key: (h.count, h.percentiles()) for key, h in self._histograms.items()}
+        result = dict()
+        for (_, labels), (count, percentiles) in sorted(histograms.items()):
+            label_values = dict(labels)
+            name = label_values.pop('stage')
+            if label_values:
+                name += f"[{','.join(label_values.values())}]"
+            result[name] = {'count': count, **{f'p{q}': round(p * 1000, 1) for q, p in zip((50, 95, 99), percentiles)}}
+        return result
+
+
+    def counters(self) -> Dict[str, float]:
+        """Own counters and callback counters, keyed by name and label values."""
+        with self._lock:
+            samples = [(name, labels, value) for (name, labels), value in self._counters.items()]
+        samples += [(name, labels, value) for name, kind, _, labels, value in self._read_callbacks() if kind == 'counter']
+        return {name + (f"[{','.join(v for _, v in labels)}]" if labels else ""): value for name, labels, value in sorted(samples)}
+
+
+    def start_server(self, host: str = metrics_host, port: Optional[int] = metrics_port):
+        """
+        Serve the metrics at http://host:port/metrics from a daemon thread. Port None disables the endpoint.
+        The bot runs without the endpoint if the port can't be bound, e.g. when it is taken.
+        """
+        if port is None or self._server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            self.logger.warning(f"Metrics endpoint disabled, can't listen on {host}:{port}: {e}")
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        self.logger.info(f"Metrics are served at http://{host}:{port}/metrics")
+
+
+    def stop_server(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+
+def _resident_memory() -> float:
+    """Current RSS from /proc on Linux, peak RSS elsewhere."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,83 @@
+import io
+import os
+import re
+import math
+from typing import List, Optional, Tuple
+
+import pandas as pd
+import pdfminer.high_level
+from pdfminer.pdfpage import PDFPage
+from markitdown import MarkItDown
+
+from config import parallel_convert_min_units
+from utils.file_processor import read_file
+
+
+Part = Optional[Tuple[int, int]]  # Range of pages or sheets, None for the whole file
+EXCEL_ENGINES = {'.xlsx': 'openpyxl', '.xls': 'xlrd'}
+
+
+def count_units(file_path: str) -> int:
+    """Number of pages of a PDF or sheets of a workbook, 0 for other formats."""
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == '.pdf':
+        with open(file_path, 'rb') as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+    if ext in EXCEL_ENGINES:
+        return len(pd.ExcelFile(file_path, engine=EXCEL_ENGINES[ext]).sheet_names)
+    return 0
+
+
+def plan_parts(file_path: str, n_parts: int, min_units: Optional[int] = None) -> List[Part]:
+    """
+    Split a large file into contiguous page or sheet ranges that can be converted independently.
+    Files of other formats or below the per-format threshold are converted as one part.
+    """
+    ext = os.path.splitext(file_path)[-1].lower()
+    if min_units is None:
+        min_units = parallel_convert_min_units.get(ext)
+    if min_units is None or n_parts < 2:
+        return [None]
+    units = count_units(file_path)
+    if units < max(min_units, 2):
+        return [None]
+    size = math.ceil(units / n_parts)
+    return [(start, min(start + size, units)) for start in range(0, units, size)]
+
+
+def convert_part(file_path: str, part: Part) -> str:
+    """Convert one range of a file to raw Markdown, the same way MarkItDown converts the whole file."""
+    if part is None:
+        return read_file(file_path)
+    ext = os.path.splitext(file_path)[-1].lower()
+    if ext == '.pdf':
+        return pdfminer.high_level.extract_text(file_path, page_numbers=range(*part))
+
+    sheet_names = pd.ExcelFile(file_path, engine=EXCEL_ENGINES[ext]).sheet_names[part[0]:part[1]]
+    sheets = pd.read_excel(file_path, sheet_name=sheet_names, engine=EXCEL_ENGINES[ext])
+    md = MarkItDown()
+    return "\n\n".join(
+        f"## {name}\n" + sheet_markdown(md, sheets[name])
+        for name in sheet_names
+    )
+
+
+def sheet_markdown(md: MarkItDown, sheet: pd.DataFrame) -> str:
+    """Convert one sheet through the HTML converter, as MarkItDown does for whole workbooks."""
+    html = io.BytesIO(sheet.to_html(index=False).encode('utf-8'))
+    return md.convert_stream(html, file_extension='.html').text_content.strip()
+
+
+def join_parts(file_path: str, texts: List[str]) -> str:
+    """
+    Put converted page or sheet ranges back together in order and normalize line ends like MarkItDown does.
+    A file converted as one part is returned as is, so text files keep their exact content.
+    """
+    if len(texts) == 1:
+        return texts[0]
+    if os.path.splitext(file_path)[-1].lower() == '.pdf':
+        text = "".join(texts)  # Every page already ends with a form feed
+    else:
+        text = "\n\n".join(texts)
+    text = "\n".join(line.rstrip() for line in re.split(r"\r?\n", text))
+    return re.sub(r"\n{3,}", "\n\n", text)
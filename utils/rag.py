@@ -1,21 +1,30 @@
 import os
-from typing import List, Optional
+import threading
+from typing import AsyncIterator, List, Optional
 
 from pydantic import BaseModel
-from FlagEmbedding import FlagReranker
 
 from config import (
     prompts_dir,
     top_k,
     relative_top_k,
+    fusion_strategy,
     use_reranking,
     rerank_top_k,
-    rerank_model_name,
-    embed_model_device,
+    rerank_batch_size,
+    rerank_cache_size,
     supported_languages,
+    use_answer_cache,
 )
-from .llm import LLMService
+from .llm import LLMService, STREAM_RESET
+from .executors import run_blocking
+from .fusion import fuse
 from data.database_manager import DatabaseManager
+from data.inference_backend import load_reranker
+from data.answer_cache import SemanticAnswerCache
+from data.retrieval_cache import LRUCache, RetrievalCache, normalize_query
+from data.utils import get_doc_id
+from utils.metrics import Metrics
 from utils.logging_config import setup_logging
 from utils.singleton import singleton
 
@@ -26,6 +35,9 @@ class RAG:
         self.llm = LLMService()
         self.prompt = self._load_prompts()
         self.db_manager = DatabaseManager()
+        self.retrieval_cache = RetrievalCache()
+        self.answer_cache = SemanticAnswerCache() if use_answer_cache else None
+        self.metrics = Metrics()
         self.logger = setup_logging('RAG')
         
     def _load_prompts(self) -> str:
@@ -40,15 +52,27 @@ class RAG:
 
 
     def _retrieve_documents(self, message: str, relative_questions: Optional[List], user_id: str) -> List:
-        vector_store = self.db_manager.get_storage(user_id)
-        all_docs = vector_store.similarity_search(message, k=top_k)
-
+        queries = [(message, top_k)]
         if relative_questions:
-            for msg in relative_questions:
-                if msg != message:
-                    docs = vector_store.similarity_search(msg, k=relative_top_k)
-                    new_docs = [doc for doc in docs if doc not in all_docs]
-                    all_docs.extend(new_docs)
+            queries += [(msg, relative_top_k) for msg in dict.fromkeys(relative_questions) if msg != message]
+
+        # Results are cached under the version read before the search, a concurrent change bumps it
+        # and makes them unreachable. The user's lock is only taken by the index search itself.
+        version = self.db_manager.get_index_version(user_id)
+        rows = [self.retrieval_cache.get(user_id, query, k, version) for query, k in queries]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            with self.metrics.timer('embed_query'):
+                vectors = self.db_manager.query_embeddings.embed_queries([queries[i][0] for i in missing])
+            max_k = max(queries[i][1] for i in missing)
+            with self.metrics.timer('search'):
+                found = self.db_manager.search_by_vectors(user_id, vectors, max_k)
+            for i, row in zip(missing, found):
+                query, k = queries[i]
+                rows[i] = row[:k]
+                self.retrieval_cache.put(user_id, query, k, version, rows[i])
+
+        all_docs = fuse(rows, fusion_strategy)
         self.logger.info(f"Found {len(all_docs)} similar chunks for user {user_id}")
         return all_docs
 
@@ -69,8 +93,28 @@ class RAG:
         return context, sources_str
 
 
-    def process(self, message: str, user_id: str, lang : str = 'en', relative_questions: Optional[List] = None) -> str:
-        self.logger.info(f"Runing RAG for query {message} from user {user_id}")
+    def _cached_answer(self, message: str, docs: List, user_id: str, lang: str) -> tuple[Optional[str], Optional[tuple]]:
+        """
+        Look up an answer to a similar question over the same chunks.
+        Returns:
+            Cached answer (if found) and the key to store a new answer under (if caching is on).
+        """
+        if self.answer_cache is None:
+            return None, None
+        key = (
+            user_id,
+            self.db_manager.get_index_version(user_id),
+            lang,
+            frozenset(get_doc_id(doc) for doc in docs),
+            self.db_manager.query_embeddings.embed_query(message),
+        )
+        answer = self.answer_cache.get(*key)
+        if answer is not None:
+            self.logger.info(f"Answer cache hit for query {message} from user {user_id}")
+        return answer, key
+
+
+    def _prepare_question(self, message: str, user_id: str, relative_questions: Optional[List] = None) -> tuple[List, str, str]:
         docs = self._retrieve_documents(message, relative_questions, user_id)
 
         if use_reranking:
@@ -79,17 +123,102 @@ class RAG:
 
         context, sources_str = self._format_context(docs)
         user_question = f"Question: {message}\nContext: {context}"
-        response = self.llm.generate_text(self.prompt[lang], user_question)
+        return docs, user_question, sources_str
+
+
+    def process(self, message: str, user_id: str, lang : str = 'en', relative_questions: Optional[List] = None) -> str:
+        self.logger.info(f"Runing RAG for query {message} from user {user_id}")
+        docs, user_question, sources_str = self._prepare_question(message, user_id, relative_questions)
+        response, cache_key = self._cached_answer(message, docs, user_id, lang)
+        if response is None:
+            response = self.llm.generate_text(self.prompt[lang], user_question)
+            if cache_key and response:
+                self.answer_cache.put(*cache_key, response)
         return sources_str + response
+
+
+    async def aprocess(self, message: str, user_id: str, lang : str = 'en', relative_questions: Optional[List] = None) -> str:
+        """Same as `process`, but runs retrieval in the executor and awaits the LLM without blocking the event loop."""
+        self.logger.info(f"Runing async RAG for query {message} from user {user_id}")
+        docs, user_question, sources_str = await run_blocking(self._prepare_question, message, user_id, relative_questions)
+        response, cache_key = await run_blocking(self._cached_answer, message, docs, user_id, lang)
+        if response is None:
+            response = await self.llm.agenerate_text(self.prompt[lang], user_question)
+            if cache_key and response:
+                self.answer_cache.put(*cache_key, response)
+        return sources_str + response
+
+
+    async def astream(self, message: str, user_id: str, lang : str = 'en', relative_questions: Optional[List] = None) -> tuple[str, AsyncIterator[str]]:
+        """
+        Retrieve context and start streaming the answer.
+        Returns:
+            Sources header and an async iterator over the answer's text deltas.
+        """
+        self.logger.info(f"Runing streaming RAG for query {message} from user {user_id}")
+        docs, user_question, sources_str = await run_blocking(self._prepare_question, message, user_id, relative_questions)
+        response, cache_key = await run_blocking(self._cached_answer, message, docs, user_id, lang)
+        if response is not None:
+            return sources_str, self._replay(response)
+        chunks = self.llm.stream_text(self.prompt[lang], user_question)
+        if cache_key:
+            chunks = self._cache_stream(chunks, cache_key)
+        return sources_str, chunks
+
+
+    async def _replay(self, response: str) -> AsyncIterator[str]:
+        yield response
+
+
+    async def _cache_stream(self, chunks: AsyncIterator[str], cache_key: tuple) -> AsyncIterator[str]:
+        """Pass the stream through and cache the full answer once it is complete."""
+        response = ""
+        async for chunk in chunks:
+            response = "" if chunk is STREAM_RESET else response + chunk
+            yield chunk
+        if response:
+            self.answer_cache.put(*cache_key, response)
     
 
 
+@singleton
 class DocumentReranker:
+    """
+    Resident cross-encoder reranker. Reuses the model loaded by DatabaseManager and
+    scores all (query, chunk) pairs of a request in one batched call.
+    Pairs are sorted by length so that each batch holds texts of similar size,
+    and scores are cached by (query, chunk id).
+    """
     def __init__(self):
-        self.reranker = FlagReranker(rerank_model_name, use_fp16=True, device=embed_model_device)
+        db_manager = DatabaseManager()
+        self.reranker = getattr(db_manager, 'reranker', None)
+        if self.reranker is None:
+            self.reranker = load_reranker()
+        self.score_cache = LRUCache(rerank_cache_size)
+        self._lock = threading.Lock()
+
+    def _score(self, message: str, documents: List) -> List[float]:
+        query = normalize_query(message)
+        keys = [(query, get_doc_id(doc)) for doc in documents]
+        scores = [self.score_cache.get(key) for key in keys]
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            missing.sort(key=lambda i: len(documents[i].page_content))
+            pairs = [[message, documents[i].page_content] for i in missing]
+            with self._lock, Metrics().timer('rerank'):
+                new_scores = self.reranker.compute_score(pairs, batch_size=rerank_batch_size)
+            if not isinstance(new_scores, list):
+                new_scores = [new_scores]
+            for i, score in zip(missing, new_scores):
+                scores[i] = score
+                self.score_cache.put(keys[i], score)
+        return scores
 
     def rerank(self, message: str, documents: List) -> List:
-        scores = [self.reranker.compute_score([message, doc.page_content]) for doc in documents]
+        if not documents:
+            return documents
+        scores = self._score(message, documents)
         sorted_idx = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:rerank_top_k]
         return [documents[idx] for idx in sorted_idx]
 
@@ -122,4 +251,14 @@ class QueryExpander:
             schema=RelativeQuestionsFormat
         )
         self.llm.logger.debug(f"Expanded questions: {response.questions}")
+        return response.questions
+
+    async def aexpand_query(self, query: str, lang: str = 'en') -> List:
+        self.llm.logger.info(f"Expanding message: {query}")
+        response = await self.llm.agenerate_structured(
+            prompt=self.prompt[lang],
+            message=query,
+            schema=RelativeQuestionsFormat
+        )
+        self.llm.logger.debug(f"Expanded questions: {response.questions}")
         return response.questions
\ No newline at end of file
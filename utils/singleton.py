@@ -1,7 +1,13 @@
+import threading
+
+
 def singleton(cls):
     instances = {}
+    lock = threading.Lock()
     def get_instance(*args, **kwargs):
         if cls not in instances:
-            instances[cls] = cls(*args, **kwargs)
+            with lock:
+                if cls not in instances:
+                    instances[cls] = cls(*args, **kwargs)
         return instances[cls]
-    return get_instance
\ No newline at end of file
+    return get_instance
@@ -0,0 +1,156 @@
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import Optional
+
+from telegram import Bot
+
+from config import use_reranking, storage_prefetch_users, llm_cjk_logit_bias
+from utils.executors import run_blocking
+from utils.logging_config import setup_logging
+from utils.singleton import singleton
+
+
+logger = setup_logging('Startup')
+
+
+@contextmanager
+def startup_phase(name: str):
+    """Log how long a startup phase took."""
+    start = time.perf_counter()
+    yield
+    logger.info(f"Startup phase '{name}' took {time.perf_counter() - start:.2f}s.")
+
+
+
+@singleton
+class ModelWarmup:
+    """
+    Loads models and storages in the background, so the bot starts polling right away.
+    Heavy libraries (torch, FAISS, FlagEmbedding, MarkItDown) are imported here for the first time.
+    Handlers that need the models await `wait_ready()` instead of loading them in the request path.
+    Interrupted uploads are resumed once the models are ready.
+    """
+    def __init__(self):
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+        self._started = None
+        self._started_at = None
+
+
+    def start(self, bot: Bot):
+        """Start the warm-up task. Must be called from the running event loop."""
+        if self._task is None:
+            self._started = time.perf_counter()
+            self._started_at = time.time()
+            self._task = asyncio.create_task(self._run(bot))
+
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set() and self._error is None
+
+
+    async def wait_ready(self):
+        """Wait until the models are loaded. Raises if the warm-up failed."""
+        if not self._ready.is_set():
+            await self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError(f"Models failed to load: {self._error}") from self._error
+
+
+    async def _run(self, bot: Bot):
+        try:
+            with startup_phase('import models'):
+                await run_blocking(_import_models)
+            with startup_phase('load models'):
+                await run_blocking(_load_models)
+            _register_metrics()
+            with startup_phase('first forward pass'):
+                await run_blocking(_first_forward_pass)
+            if storage_prefetch_users:
+                with startup_phase('prefetch storages'):
+                    await run_blocking(_prefetch_storages)
+        except Exception as e:
+            logger.exception(f"Warm-up failed: {e}")
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        logger.info(f"Models ready {time.perf_counter() - self._started:.2f}s after the warm-up started.")
+
+        from utils.ingestion import IngestionQueue
+        IngestionQueue().resume(bot, before=self._started_at)
+
+
+    async def shutdown(self):
+        """Wait for an unfinished warm-up, so that shutdown doesn't race with model loading."""
+        if self._task is not None and not self._task.done():
+            await asyncio.wait({self._task})
+
+
+
+def _import_models():
+    import data.database_manager  # noqa: F401 torch, FAISS, transformers
+    import utils.rag  # noqa: F401 FlagEmbedding, LLM client
+    import utils.ingestion  # noqa: F401 MarkItDown, pdfminer, pandas
+
+
+def _load_models():
+    from data.database_manager import DatabaseManager
+    from utils.rag import RAG, DocumentReranker
+
+    RAG()  # Loads the embedding model and the reranker through DatabaseManager
+    if use_reranking:
+        DocumentReranker()
+    if llm_cjk_logit_bias:
+        from utils.llm import LLMService
+        LLMService().cjk_logit_bias()  # Loads the tokenizer of the LLM
+    DatabaseManager().logger.info("Models loaded.")
+
+
+def _register_metrics():
+    """Export counters and sizes that the caches and stores already track."""
+    from data.database_manager import DatabaseManager
+    from data.job_store import JobStore
+    from utils.metrics import Metrics
+    from utils.rag import RAG, DocumentReranker
+
+    db_manager, rag = DatabaseManager(), RAG()
+    caches = {
+        'storage': db_manager.cache.stats,
+        'query_embedding': db_manager.query_embeddings.stats,
+        'retrieval': rag.retrieval_cache.stats,
+    }
+    if rag.answer_cache is not None:
+        caches['answer'] = rag.answer_cache.stats
+    if use_reranking:
+        caches['rerank_score'] = DocumentReranker().score_cache.stats
+    if db_manager.content_cache is not None:
+        content_stats = db_manager.content_cache.stats
+        caches['content_markdown'] = lambda: {'hits': content_stats()['markdown_hits'], 'misses': content_stats()['markdown_misses']}
+        caches['content_vectors'] = lambda: {'hits': content_stats()['vector_hits'], 'misses': content_stats()['vector_misses']}
+
+    metrics = Metrics()
+    metrics.register_callback('cache_hits_total', 'counter', "Cache hits", lambda: {name: stats()['hits'] for name, stats in caches.items()}, label='cache')
+    metrics.register_callback('cache_misses_total', 'counter', "Cache misses", lambda: {name: stats()['misses'] for name, stats in caches.items()}, label='cache')
+    metrics.register_callback('loaded_storages', 'gauge', "Vector storages held in memory", lambda: db_manager.cache.stats()['entries'])
+    metrics.register_callback('loaded_storages_bytes', 'gauge', "Estimated size of vector storages held in memory", lambda: db_manager.cache.stats()['bytes'])
+    metrics.register_callback('index_promotions_total', 'counter', "Storages moved to ANN or compact indexes", lambda: db_manager.index_stats()['promotions'])
+    metrics.register_callback('ingestion_jobs_active', 'gauge', "Queued and running ingestion jobs", lambda: len(JobStore().get_active()))
+
+
+def _first_forward_pass():
+    """Run one query through the models, so lazy initialization doesn't fall on the first user."""
+    from data.database_manager import DatabaseManager
+    from utils.rag import DocumentReranker
+
+    DatabaseManager().embeddings.embed_query("warm-up")
+    if use_reranking:
+        DocumentReranker().reranker.compute_score([["warm-up", "warm-up"]])
+
+
+def _prefetch_storages():
+    from data.database_manager import DatabaseManager
+    DatabaseManager().prefetch_recent_users()